@@ -0,0 +1,335 @@
+"""
+Analyzes backpack traffic captures in bulk. Frames are found and
+decoded with vectorized NumPy operations over memory-mapped files,
+so a full race day of traffic takes seconds instead of minutes.
+
+Run from the repository root (requires NumPy):
+
+    python -m benchmarks.analyze_capture elrs_backpack.cap --top 10
+"""
+
+import argparse
+import json
+from dataclasses import dataclass
+from typing import Any
+
+import numpy as np
+
+from .fake_rhapi import install_stubs
+
+install_stubs()
+
+from vrxc_elrs.capture import (  # noqa: E402
+    CAPTURE_MAGIC,
+    CAPTURE_RECORD,
+    Direction,
+    capture_files,
+)
+from vrxc_elrs.msp import (  # noqa: E402
+    MSP_HEADER_LENGTH,
+    MSPPacket,
+    MSPPacketType,
+    MSPTypes,
+)
+
+CRC_TABLE = np.array(
+    [MSPPacket._crc8_dvb_s2(0, value) for value in range(256)], dtype=np.uint8
+)
+PACKET_TYPES = np.array([type_.value for type_ in MSPPacketType], dtype=np.uint8)
+NO_UID = -1
+BOUND_UID = 0
+
+
+@dataclass
+class Stream:
+    """
+    The bytes of one direction of a capture, joined across records
+    """
+
+    data: np.ndarray
+    record_offsets: np.ndarray
+    record_timestamps: np.ndarray
+
+
+@dataclass
+class Frames:
+    """
+    Decoded headers of every frame in a stream
+    """
+
+    starts: np.ndarray
+    sizes: np.ndarray
+    functions: np.ndarray
+    valid: np.ndarray
+    timestamps: np.ndarray
+    uids: np.ndarray
+
+
+def load_streams(paths: list[str]) -> dict[Direction, Stream]:
+    """
+    Memory-maps capture files and joins the data of each direction.
+    Records have variable lengths, so the record headers are walked
+    one by one; the bytes themselves are only touched by NumPy.
+
+    :param paths: The capture files from oldest to newest
+    :return: The stream of each direction
+    """
+    chunks: dict[Direction, list[np.ndarray]] = {d: [] for d in Direction}
+    timestamps: dict[Direction, list[int]] = {d: [] for d in Direction}
+
+    for path in paths:
+        data = np.memmap(path, dtype=np.uint8, mode="r")
+        if bytes(data[: len(CAPTURE_MAGIC)]) != CAPTURE_MAGIC:
+            raise ValueError(f"{path} is not a backpack capture")
+
+        offset = len(CAPTURE_MAGIC)
+        while offset + CAPTURE_RECORD.size <= len(data):
+            timestamp, direction, length = CAPTURE_RECORD.unpack_from(data, offset)
+            offset += CAPTURE_RECORD.size
+            if offset + length > len(data):
+                break
+
+            chunks[Direction(direction)].append(data[offset : offset + length])
+            timestamps[Direction(direction)].append(timestamp)
+            offset += length
+
+    streams = {}
+    for direction in Direction:
+        lengths = np.array([len(chunk) for chunk in chunks[direction]], dtype=np.int64)
+        streams[direction] = Stream(
+            (
+                np.concatenate(chunks[direction])
+                if chunks[direction]
+                else np.zeros(0, dtype=np.uint8)
+            ),
+            np.concatenate(([0], np.cumsum(lengths)[:-1])).astype(np.int64),
+            np.array(timestamps[direction], dtype=np.int64),
+        )
+
+    return streams
+
+
+def frame_starts(data: np.ndarray) -> np.ndarray:
+    """
+    Finds where frames start. Every `$X` header is a candidate, and
+    candidates are chained from the end of one frame to the next
+    candidate after it, the way a sequential parser resynchronizes.
+    The chain is followed with pointer doubling, so the work is done
+    in a logarithmic number of vectorized steps.
+
+    :param data: The stream
+    :return: Start offsets of the complete frames
+    """
+    if len(data) < MSP_HEADER_LENGTH + 1:
+        return np.zeros(0, dtype=np.int64)
+
+    heads = np.flatnonzero(
+        (data[:-2] == ord("$"))
+        & (data[1:-1] == ord("X"))
+        & np.isin(data[2:], PACKET_TYPES)
+    ).astype(np.int64)
+    heads = heads[heads + MSP_HEADER_LENGTH <= len(data)]
+
+    count = len(heads)
+    if count == 0:
+        return heads
+
+    lengths = data[heads + 6].astype(np.int64) | (data[heads + 7].astype(np.int64) << 8)
+    ends = heads + MSP_HEADER_LENGTH + lengths + 1
+    complete = ends <= len(data)
+
+    # A frame cut off by the end of the capture is skipped
+    following = np.where(
+        complete, np.searchsorted(heads, ends), np.arange(1, count + 1)
+    )
+    jump = np.append(following, count)
+    chained = np.zeros(count + 1, dtype=bool)
+    chained[0] = True
+    for _ in range(count.bit_length()):
+        chained[jump[chained]] = True
+        jump = jump[jump]
+
+    return heads[chained[:count] & complete]
+
+
+def check_crc(data: np.ndarray, starts: np.ndarray, bodies: np.ndarray) -> np.ndarray:
+    """
+    Checks the CRC of every frame. The CRC is computed a byte
+    position at a time across all frames at once, longest frames
+    first, so each step only touches frames that are still running.
+
+    :param data: The stream
+    :param starts: Start offsets of the frames
+    :param bodies: Lengths of the checksummed part of each frame
+    :return: Whether each frame's CRC matches
+    """
+    order = np.argsort(-bodies, kind="stable")
+    longest_first = bodies[order]
+    shortest_first = longest_first[::-1]
+    positions = starts[order] + 3
+
+    crc = np.zeros(len(order), dtype=np.uint8)
+    for index in range(int(longest_first[0]) if len(order) else 0):
+        running = len(order) - np.searchsorted(shortest_first, index, side="right")
+        crc[:running] = CRC_TABLE[crc[:running] ^ data[positions[:running] + index]]
+
+    valid = np.empty(len(order), dtype=bool)
+    valid[order] = crc == data[positions + longest_first]
+    return valid
+
+
+def decode_frames(stream: Stream) -> Frames:
+    """
+    Decodes the header of every frame in a stream
+
+    :param stream: The stream
+    :return: The decoded frames
+    """
+    data = stream.data
+    starts = frame_starts(data)
+
+    lengths = data[starts + 6].astype(np.int64) | (
+        data[starts + 7].astype(np.int64) << 8
+    )
+    functions = data[starts + 4].astype(np.int64) | (
+        data[starts + 5].astype(np.int64) << 8
+    )
+    valid = check_crc(data, starts, lengths + 5)
+
+    records = np.searchsorted(stream.record_offsets, starts, side="right") - 1
+    timestamps = stream.record_timestamps[records]
+
+    # Frames are addressed to the uid set by the last send uid frame
+    is_uid = (functions == MSPTypes.MSP_ELRS_SET_SEND_UID) & valid & (lengths >= 1)
+    uid_values = np.full(len(starts), BOUND_UID, dtype=np.int64)
+    addressed = (
+        is_uid & (lengths >= 7) & (data[np.minimum(starts + 8, len(data) - 1)] == 1)
+    )
+    for index in range(6):
+        uid_values[addressed] = (uid_values[addressed] << 8) | data[
+            starts[addressed] + 9 + index
+        ]
+
+    last_uid = np.maximum.accumulate(np.where(is_uid, np.arange(len(starts)), -1))
+    uids = np.where(last_uid >= 0, uid_values[np.maximum(last_uid, 0)], NO_UID)
+
+    return Frames(
+        starts,
+        MSP_HEADER_LENGTH + lengths + 1,
+        functions,
+        valid,
+        timestamps,
+        uids,
+    )
+
+
+def histogram(keys: np.ndarray, frames: Frames) -> dict[int, dict[str, int]]:
+    """
+    Counts packets, bytes and CRC failures by key
+
+    :param keys: The key of each frame
+    :param frames: The frames
+    :return: The counts of each key
+    """
+    values, inverse = np.unique(keys, return_inverse=True)
+    packets = np.bincount(inverse, minlength=len(values))
+    bytes_ = np.bincount(inverse, weights=frames.sizes, minlength=len(values))
+    failures = np.bincount(inverse, weights=~frames.valid, minlength=len(values))
+
+    return {
+        int(value): {
+            "packets": int(packets[index]),
+            "bytes": int(bytes_[index]),
+            "crc_failures": int(failures[index]),
+        }
+        for index, value in enumerate(values)
+    }
+
+
+def function_name(value: int) -> str:
+    try:
+        return MSPTypes(value).name
+    except ValueError:
+        return f"0x{value:04X}"
+
+
+def uid_name(value: int) -> str:
+    if value == NO_UID:
+        return "unset"
+
+    if value == BOUND_UID:
+        return "bound"
+
+    return value.to_bytes(6, "big").hex(".")
+
+
+def analyze(frames: Frames) -> dict[str, Any]:
+    """
+    Builds the histograms of a direction
+
+    :param frames: The decoded frames
+    :return: Totals and histograms by opcode, uid and second
+    """
+    seconds = np.zeros(0, dtype=np.int64)
+    if len(frames.timestamps):
+        seconds = (frames.timestamps - frames.timestamps[0]) // 1_000_000_000
+
+    return {
+        "packets": int(len(frames.starts)),
+        "bytes": int(frames.sizes.sum()),
+        "crc_failures": int((~frames.valid).sum()),
+        "by_opcode": {
+            function_name(key): value
+            for key, value in histogram(frames.functions, frames).items()
+        },
+        "by_uid": {
+            uid_name(key): value
+            for key, value in histogram(frames.uids, frames).items()
+        },
+        "by_second": histogram(seconds, frames),
+    }
+
+
+def print_table(title: str, rows: dict[Any, dict[str, int]], top: int) -> None:
+    print(f"\n{title:<28}{'packets':>10}{'bytes':>12}{'crc fail':>10}")
+    ranked = sorted(rows.items(), key=lambda item: item[1]["bytes"], reverse=True)
+    for key, value in ranked[:top]:
+        print(
+            f"{str(key):<28}{value['packets']:>10}{value['bytes']:>12}"
+            f"{value['crc_failures']:>10}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("capture", help="The newest capture file")
+    parser.add_argument("--top", type=int, default=10, help="Rows shown per table")
+    parser.add_argument("--json", help="Write the full histograms to a file")
+    args = parser.parse_args()
+
+    files = capture_files(args.capture)
+    streams = load_streams(files)
+
+    report = {}
+    for direction, stream in streams.items():
+        result = analyze(decode_frames(stream))
+        report[direction.name] = result
+
+        print(
+            f"\n== {direction.name}: {result['packets']} packets, "
+            f"{result['bytes']} bytes, {result['crc_failures']} CRC failures"
+        )
+        if not result["packets"]:
+            continue
+
+        print_table("opcode", result["by_opcode"], args.top)
+        print_table("uid", result["by_uid"], args.top)
+        print_table("busiest second", result["by_second"], args.top)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,341 @@
+"""
+Stand-ins for the RotorHazard server used to run the plugin outside of a timer
+"""
+
+import enum
+import importlib
+import sys
+import time
+import types
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any, Union
+
+import gevent
+from gevent.queue import Queue
+
+PLUGIN_PATH = Path(__file__).resolve().parent.parent / "custom_plugins"
+
+
+class RaceStatus(enum.IntEnum):
+    READY = 0
+    RACING = 1
+    DONE = 2
+    STAGING = 3
+
+
+class WinCondition(enum.IntEnum):
+    NONE = 0
+    MOST_PROGRESS = 1
+    FIRST_TO_LAP_X = 2
+    FASTEST_LAP = 3
+    FASTEST_CONSECUTIVE = 4
+    MOST_LAPS = 5
+    MOST_LAPS_OVERTIME = 6
+
+
+class UIField:
+    """
+    Records the name and default value of a registered field
+    """
+
+    def __init__(self, name: str, label: str = "", *_, value: Any = None, **__):
+        self.name = name
+        self.label = label
+        self.value = value
+
+
+class UIFieldSelectOption:
+    def __init__(self, value: Any, label: str):
+        self.value = value
+        self.label = label
+
+
+class _Evt:
+    def __getattr__(self, name: str) -> str:
+        return name
+
+
+class _VRxController:
+    def __init__(self, name: str, label: str):
+        self.name = name
+        self.label = label
+
+
+class _Blueprint:
+    """
+    Records the views of a blueprint by route
+    """
+
+    def __init__(self, name: str, import_name: str):
+        self.name = name
+        self.routes: dict[str, Callable] = {}
+
+    def route(self, rule: str, **_) -> Callable:
+        def decorator(view: Callable) -> Callable:
+            self.routes[rule] = view
+            return view
+
+        return decorator
+
+
+class _Response:
+    def __init__(self, response: str, content_type: str = "text/html", **_):
+        self.data = response
+        self.content_type = content_type
+
+
+def _module(name: str, **attrs) -> types.ModuleType:
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    return module
+
+
+def install_stubs() -> None:
+    """
+    Makes the plugin importable without a RotorHazard server.
+    Modules of a real server found on the path are left alone.
+    """
+    if str(PLUGIN_PATH) not in sys.path:
+        sys.path.insert(0, str(PLUGIN_PATH))
+
+    try:
+        importlib.import_module("RHAPI")
+        return
+    except ImportError:
+        pass
+
+    gpio = _module("util.RH_GPIO", is_real_hw_GPIO=lambda: False)
+    stubs = {
+        "RHAPI": _module("RHAPI", RHAPI=object),
+        "eventmanager": _module("eventmanager", Evt=_Evt()),
+        "RHUI": _module(
+            "RHUI",
+            UIField=UIField,
+            UIFieldSelectOption=UIFieldSelectOption,
+            UIFieldType=types.SimpleNamespace(
+                TEXT="text", CHECKBOX="checkbox", SELECT="select", BASIC_INT="int"
+            ),
+        ),
+        "RHRace": _module("RHRace", RaceStatus=RaceStatus, WinCondition=WinCondition),
+        "VRxControl": _module("VRxControl", VRxController=_VRxController),
+        "util": _module("util", RH_GPIO=gpio),
+        "util.RH_GPIO": gpio,
+    }
+    try:
+        importlib.import_module("flask")
+    except ImportError:
+        stubs["flask"] = _module("flask", Blueprint=_Blueprint, Response=_Response)
+
+    for name, module in stubs.items():
+        sys.modules.setdefault(name, module)
+
+
+class FakeDB:
+    """
+    Plugin options and pilot attributes held in memory
+    """
+
+    def __init__(self) -> None:
+        self.options: dict[str, Any] = {}
+        self.pilot_attributes: dict[tuple[int, str], str] = {}
+        self.heats: dict[int, Any] = {}
+        self.raceclasses: dict[int, Any] = {}
+
+    def option(self, name: str, default: Any = False, as_int: bool = False) -> Any:
+        value = self.options.get(name)
+        if value is None:
+            return default
+
+        if as_int:
+            try:
+                return int(value)
+            except (TypeError, ValueError):
+                return default
+
+        return value
+
+    def pilot_attribute_value(self, pilot_id: int, name: str) -> Union[str, None]:
+        return self.pilot_attributes.get((pilot_id, name))
+
+    def pilot_by_id(self, pilot_id: int) -> Any:
+        return types.SimpleNamespace(id=pilot_id, callsign=f"PILOT {pilot_id}")
+
+    def heat_by_id(self, heat_id: int) -> Any:
+        return self.heats.get(heat_id)
+
+    def heat_max_round(self, heat_id: int) -> int:
+        return 0
+
+    def raceclass_by_id(self, class_id: int) -> Any:
+        return self.raceclasses.get(class_id)
+
+
+class FakeRace:
+    """
+    The state of the current race
+    """
+
+    def __init__(self) -> None:
+        self.status = RaceStatus.READY
+        self.heat = 1
+        self.pilots: dict[int, int] = {}
+        self.seats_finished: dict[int, bool] = {}
+
+    def stage(self, *_) -> None:
+        self.status = RaceStatus.STAGING
+
+    def stop(self, *_) -> None:
+        self.status = RaceStatus.DONE
+
+    def save(self, *_) -> None:
+        self.status = RaceStatus.READY
+
+
+class FakeRHAPI:
+    """
+    The parts of the RotorHazard API used by the plugin
+    """
+
+    def __init__(self) -> None:
+        self.db = FakeDB()
+        self.race = FakeRace()
+        self.handlers: dict[str, list[Callable]] = {}
+        self.notifications: list[str] = []
+        self.blueprints: list[Any] = []
+        self.markdown: dict[str, str] = {}
+
+        self.events = types.SimpleNamespace(on=self._on)
+        self.language = types.SimpleNamespace(__=lambda text: text)
+        self.ui = types.SimpleNamespace(
+            message_notify=self.notifications.append,
+            register_panel=lambda *_, **__: None,
+            register_quickbutton=lambda *_, **__: None,
+            register_markdown=self._register_markdown,
+            broadcast_ui=lambda *_: None,
+            blueprint_add=self.blueprints.append,
+        )
+        self.fields = types.SimpleNamespace(
+            register_option=self._register_option,
+            register_pilot_attribute=lambda *_, **__: None,
+        )
+
+    def __(self, text: str) -> str:
+        return text
+
+    def _register_markdown(self, _panel: str, name: str, desc: str) -> None:
+        self.markdown[name] = desc
+
+    def _on(self, event: str, handler: Callable, **_) -> None:
+        self.handlers.setdefault(event, []).append(handler)
+
+    def _register_option(self, field: UIField, *_) -> None:
+        self.db.options.setdefault(field.name, field.value)
+
+
+class CountingConnection:
+    """
+    A connection that drains the send queue like the real
+    connections do, counting bytes instead of writing them.
+    With a baud rate, each write takes as long as it would
+    on a serial port.
+    """
+
+    connected = True
+    recorder = None
+
+    def __init__(self, send_queue: Queue, recieve_queue: Queue, baud: int = 0):
+        from vrxc_elrs.connections import SendUIDTracker
+
+        self._send_queue = send_queue
+        self._baud = baud
+        self._send_uid = SendUIDTracker()
+        self.writes: list[tuple[float, int, int]] = []
+        self.sent: list[Any] = []
+        self.bytes = 0
+        self.packets = 0
+        self.writing = False
+        self._greenlet = gevent.spawn(self._send)
+
+    def _send(self) -> None:
+        from vrxc_elrs.capture import Direction
+        from vrxc_elrs.connections import complete_transactions, drain_burst
+
+        while True:
+            burst, transactions = drain_burst(self._send_queue)
+            self.writing = True
+            start = time.perf_counter()
+            packets = [
+                packet_ for packet in burst for packet_ in self._send_uid.filter(packet)
+            ]
+            if packets:
+                data = b"".join(packet.get_packet() for packet in packets)
+                if self._baud:
+                    gevent.sleep(len(data) * 10 / self._baud)
+                self.writes.append((time.perf_counter(), len(data), len(packets)))
+                if self.recorder is not None:
+                    self.recorder.record(Direction.TX, data)
+                self.sent += packets
+                self.bytes += len(data)
+                self.packets += len(packets)
+
+            complete_transactions(transactions, start, time.perf_counter())
+            self.writing = False
+
+    def connect(self, **_) -> bool:
+        return True
+
+    def disconnect(self) -> None:
+        self._greenlet.kill()
+
+
+def load_controller(rhapi: FakeRHAPI, links: int = 1, baud: int = 0) -> Any:
+    """
+    Initializes the plugin against the fake API and
+    connects each of its backpack links to a counting
+    connection
+
+    :param rhapi: The fake API
+    :param links: The number of backpack links
+    :param baud: The simulated baud rate of each link, 0 for instant writes
+    :return: The plugin's controller
+    """
+    install_stubs()
+    plugin = importlib.import_module("vrxc_elrs")
+
+    rhapi.handlers.clear()
+    plugin.initialize(rhapi)
+    controller = rhapi.handlers["VRX_INITIALIZE"][0].__self__
+    controller.configure_scheduler()
+    controller.configure_tracer()
+    controller._links[0].name = "bench:0"
+    controller._links += [
+        controller._create_link(f"bench:{i}") for i in range(1, links)
+    ]
+    for link in controller._links:
+        link.connection = CountingConnection(link.send_queue, link.recieve_queue, baud)
+
+    return controller
+
+
+def wait_idle(controller: Any) -> None:
+    """
+    Yields to the plugin's greenlets until every queued
+    job has run and the send queues have been written
+
+    :param controller: The plugin's controller
+    """
+    scheduler = controller._scheduler
+    links = controller._links
+    idle = 0
+    while idle < 2:
+        gevent.sleep(0)
+        if (
+            scheduler.queue_depth
+            or scheduler.active
+            or any(not link.send_queue.empty() for link in links)
+            or any(getattr(link.connection, "writing", False) for link in links)
+        ):
+            idle = 0
+        else:
+            idle += 1
@@ -0,0 +1,375 @@
+"""
+Micro-benchmarks for the MSP codec, run over realistic byte streams and
+compared against a stored baseline.
+
+Run from the repository root:
+
+    python -m benchmarks.msp_codec
+    python -m benchmarks.msp_codec --check
+    python -m benchmarks.msp_codec --save-baseline
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+from collections.abc import Callable
+from dataclasses import dataclass
+from pathlib import Path
+
+import gevent
+from gevent.queue import Queue
+
+from .fake_rhapi import install_stubs
+
+install_stubs()
+
+from vrxc_elrs.msp import MSPPacket, MSPPacketType, MSPTypes  # noqa: E402
+
+BASELINE_PATH = Path(__file__).resolve().parent / "baselines" / "msp_codec.json"
+MAX_PAYLOAD = 0xFFFF
+OSD_PILOTS = 32
+OSD_ROW_TEXT = 50
+FALSE_START_RATE = 0.5
+FALSE_STARTS = (b"$", b"$X", b"$X<", b"$X>", b"$X<\x00\xff\xff\x00\x00")
+
+
+@dataclass
+class Stream:
+    """
+    Frames and the bytes they are encoded to
+    """
+
+    name: str
+    frames: list[tuple[MSPTypes, bytes]]
+    data: bytes
+    chunks: list[bytes]
+
+
+@dataclass
+class Result:
+    """
+    Throughput of a benchmark
+    """
+
+    name: str
+    bytes_: int
+    frames: int
+    seconds: float
+    decoded: int | None = None
+    error: str | None = None
+
+    @property
+    def lossless(self) -> bool:
+        """
+        Whether every frame of the stream was decoded
+        """
+        return self.error is None and self.decoded in (None, self.frames)
+
+    @property
+    def mb_per_s(self) -> float:
+        return self.bytes_ / self.seconds / 1e6
+
+    @property
+    def frames_per_s(self) -> float:
+        return self.frames / self.seconds
+
+
+def encode(function: MSPTypes, payload: bytes) -> bytes:
+    packet = MSPPacket()
+    packet.set_function(function)
+    packet.set_payload(payload)
+    return packet.get_packet()
+
+
+def osd_frames(rng: random.Random) -> list[tuple[MSPTypes, bytes]]:
+    """
+    Frames of a staged heat sent to every pilot
+
+    :param rng: The random source
+    :return: The frames
+    """
+    frames = []
+    for _ in range(OSD_PILOTS):
+        frames.append((MSPTypes.MSP_ELRS_SET_SEND_UID, b"\x01" + rng.randbytes(6)))
+        frames.append((MSPTypes.MSP_ELRS_SET_OSD, b"\x02"))
+        for row in range(5):
+            text = bytes(
+                rng.choice(b"ABCDEFGHIJKLMNOPQRSTUVWXYZ :|")
+                for _ in range(OSD_ROW_TEXT)
+            )
+            frames.append((MSPTypes.MSP_ELRS_SET_OSD, bytes((3, row, 0, 0)) + text))
+        frames.append((MSPTypes.MSP_ELRS_SET_OSD, b"\x04"))
+
+    frames.append((MSPTypes.MSP_ELRS_SET_SEND_UID, bytes(7)))
+    return frames
+
+
+def noise(rng: random.Random, size: int) -> bytes:
+    """
+    Random serial noise. Some of it contains a false start of a
+    frame, such as a lone `$`, `$X` or a header with an unknown
+    function, so the decoder has to resync.
+
+    :param rng: The random source
+    :param size: The number of bytes
+    :return: The noise
+    """
+    data = bytearray(rng.randbytes(size))
+    if rng.random() < FALSE_START_RATE:
+        start = rng.choice(FALSE_STARTS)
+        index = rng.randint(0, len(data))
+        data[index:index] = start
+
+    return bytes(data)
+
+
+def chunked(data: bytes, rng: random.Random, largest: int) -> list[bytes]:
+    """
+    Splits data into chunks of random size, so frames cross chunk boundaries
+
+    :param data: The data to split
+    :param rng: The random source
+    :param largest: The largest chunk size
+    :return: The chunks
+    """
+    chunks = []
+    index = 0
+    while index < len(data):
+        size = rng.randint(1, largest)
+        chunks.append(data[index : index + size])
+        index += size
+
+    return chunks
+
+
+def build_streams(seed: int) -> list[Stream]:
+    """
+    Builds the streams every benchmark runs over
+
+    :param seed: The random seed
+    :return: The streams
+    """
+    rng = random.Random(seed)
+    streams = []
+
+    frames = osd_frames(rng)
+    data = b"".join(encode(*frame) for frame in frames)
+    streams.append(Stream("osd_burst", frames, data, [data]))
+
+    noisy = b"".join(noise(rng, rng.randint(0, 32)) + encode(*f) for f in frames)
+    streams.append(Stream("serial_noise", frames, noisy, chunked(noisy, rng, 64)))
+
+    streams.append(Stream("split_chunks", frames, data, chunked(data, rng, 64)))
+
+    frames = [(MSPTypes.MSP_ELRS_SET_OSD, rng.randbytes(MAX_PAYLOAD)) for _ in range(4)]
+    data = b"".join(encode(*frame) for frame in frames)
+    streams.append(Stream("max_payload", frames, data, chunked(data, rng, 4096)))
+
+    return streams
+
+
+def best_time(func: Callable[[], object], repeat: int) -> float:
+    """
+    Times a function, keeping the fastest run
+
+    :param func: The function to time
+    :param repeat: The number of runs
+    :return: Seconds taken by the fastest run
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def bench_get_packet(stream: Stream, repeat: int) -> Result:
+    def run():
+        for function, payload in stream.frames:
+            packet = MSPPacket()
+            packet.set_function(function)
+            packet.set_payload(payload)
+            packet.get_packet()
+
+    seconds = best_time(run, repeat)
+    return Result("get_packet", len(stream.data), len(stream.frames), seconds)
+
+
+def bench_checksum(stream: Stream, repeat: int) -> Result:
+    bodies = []
+    for function, payload in stream.frames:
+        packet = MSPPacket()
+        packet.set_function(function)
+        packet.set_payload(payload)
+        bodies.append(packet._create_body())
+
+    def run():
+        for body in bodies:
+            MSPPacket._calculate_checksum(body)
+
+    seconds = best_time(run, repeat)
+    size = sum(len(body) for body in bodies)
+    return Result("_calculate_checksum", size, len(bodies), seconds)
+
+
+def bench_from_bytes(stream: Stream, repeat: int) -> Result:
+    decoded = 0
+    error = None
+
+    def run():
+        nonlocal decoded, error
+        try:
+            decoded = sum(1 for _ in MSPPacket.packets_from_bytes(stream.data))
+        except ValueError as ex:
+            error = str(ex)
+
+    seconds = best_time(run, repeat)
+    return Result(
+        "packets_from_bytes",
+        len(stream.data),
+        len(stream.frames),
+        seconds,
+        decoded,
+        error,
+    )
+
+
+def bench_from_queue(stream: Stream, repeat: int) -> Result:
+    decoded = 0
+    error = None
+
+    def run():
+        nonlocal decoded
+        decoded = 0
+        queue: Queue = Queue()
+
+        def consume():
+            nonlocal decoded, error
+            try:
+                for packet in MSPPacket.packets_from_bytes_queue(queue):
+                    if packet.type_ != MSPPacketType.UNKNOWN:
+                        decoded += 1
+            except ValueError as ex:
+                error = str(ex)
+
+        consumer = gevent.spawn(consume)
+        for chunk in stream.chunks:
+            queue.put(chunk)
+
+        # Returns once the consumer is blocked on the empty queue
+        gevent.idle()
+        consumer.kill()
+
+    seconds = best_time(run, repeat)
+    return Result(
+        "packets_from_bytes_queue",
+        len(stream.data),
+        len(stream.frames),
+        seconds,
+        decoded,
+        error,
+    )
+
+
+BENCHMARKS: dict[str, Callable[[Stream, int], Result]] = {
+    "get_packet": bench_get_packet,
+    "_calculate_checksum": bench_checksum,
+    "packets_from_bytes": bench_from_bytes,
+    "packets_from_bytes_queue": bench_from_queue,
+}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument(
+        "--save-baseline", action="store_true", help="Store this run as the baseline"
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Fail when throughput drops below the baseline, which must come "
+        "from the same machine",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="With --check, the fraction of the baseline throughput that may be lost",
+    )
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.baseline.exists() and not args.save_baseline:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+
+    print(
+        f"{'benchmark':<26}{'stream':<14}{'MB/s':>9}{'frames/s':>12}"
+        f"{'decoded':>10}{'vs base':>9}"
+    )
+
+    current = {}
+    regressed = False
+    lossy = []
+    for stream in build_streams(args.seed):
+        for name, bench in BENCHMARKS.items():
+            result = bench(stream, args.repeat)
+            key = f"{name}/{stream.name}"
+            current[key] = result.mb_per_s
+
+            decoded = ""
+            if result.error is not None:
+                decoded = "aborted"
+            elif result.decoded is not None:
+                decoded = f"{result.decoded}/{result.frames}"
+
+            if not result.lossless:
+                lossy.append((key, result))
+
+            compared = ""
+            if key in baseline:
+                ratio = result.mb_per_s / baseline[key]
+                compared = f"{ratio:.2f}x"
+                regressed |= ratio < 1 - args.tolerance
+
+            print(
+                f"{name:<26}{stream.name:<14}{result.mb_per_s:>9.3f}"
+                f"{result.frames_per_s:>12.0f}{decoded:>10}{compared:>9}"
+            )
+
+    if lossy:
+        print("\nFrames were lost, so the throughput is not comparable:")
+        for key, result in lossy:
+            if result.error is not None:
+                print(f"  {key}: decoder aborted with {result.error}")
+            else:
+                print(f"  {key}: decoded {result.decoded} of {result.frames} frames")
+
+        if args.save_baseline:
+            print("The baseline was not saved")
+
+        return 1
+
+    if args.save_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(
+            json.dumps(current, indent=2, sort_keys=True) + "\n", encoding="utf-8"
+        )
+        print(f"\nBaseline saved to {args.baseline}")
+
+    if regressed:
+        print(f"\nThroughput dropped more than {args.tolerance:.0%} below the baseline")
+        if args.check:
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,188 @@
+"""
+Emulates an ELRS Netpack on a local TCP port so the plugin's socket
+connection can be load tested without hardware.
+
+Run from the repository root, then set the plugin's `ELRS Netpack Address`
+to the machine running the emulator:
+
+    python -m benchmarks.netpack_emulator --latency 20 --throughput 20000
+
+Commands read from stdin:
+
+    start [delay]   send a start recording command to every client
+    stop            send a stop recording command to every client
+    raw <hex>       send raw bytes to every client
+    sleep <seconds> wait before the next command
+    screens         print the visible screen of every uid
+    stats           print traffic counters
+    drop            close every client connection
+"""
+
+import argparse
+import logging
+import sys
+import time
+
+import gevent
+import gevent.server
+import gevent.socket as socket
+from gevent.fileobject import FileObject
+from gevent.queue import Queue
+
+from .virtual_backpack import VirtualBackpack, recording_state_packet, run_commands
+
+RECV_SIZE = 256
+DEFAULT_PORT = 8080
+
+logger = logging.getLogger(__name__)
+
+
+class NetpackEmulator:
+    """
+    A TCP server speaking MSP like an ELRS Netpack. All clients
+    share one virtual backpack, as a Netpack relays every client
+    to the same radio.
+    """
+
+    def __init__(
+        self,
+        host: str = "0.0.0.0",
+        port: int = DEFAULT_PORT,
+        latency: float = 0,
+        throughput: float = 0,
+    ):
+        """
+        :param host: The address to listen on
+        :param port: The port to listen on
+        :param latency: Seconds added before received data is handled
+        :param throughput: Bytes per second read from each client, or 0 for no limit
+        """
+        self.backpack = VirtualBackpack()
+        self.latency = latency
+        self.throughput = throughput
+        self.clients: set[socket.socket] = set()
+        self.connections = 0
+        self.started = time.monotonic()
+        self._server = gevent.server.StreamServer((host, port), self._handle)
+
+    @property
+    def address(self) -> tuple[str, int]:
+        return self._server.address
+
+    def start(self) -> None:
+        self._server.start()
+        logger.info("Netpack emulator listening on %s:%s", *self.address[:2])
+
+    def stop(self) -> None:
+        self.drop_clients()
+        self._server.stop()
+
+    def _handle(self, client: socket.socket, address: tuple) -> None:
+        """
+        Serves one client. A reader greenlet applies the throughput
+        limit and a handler greenlet applies the latency, so a slow
+        link pushes back on the plugin's writes like a real one.
+        """
+        logger.info("Client connected from %s:%s", *address[:2])
+        self.clients.add(client)
+        self.connections += 1
+
+        received: Queue = Queue()
+        handler = gevent.spawn(self._respond, client, received)
+        try:
+            while data := client.recv(RECV_SIZE):
+                received.put((time.monotonic() + self.latency, data))
+                if self.throughput:
+                    gevent.sleep(len(data) / self.throughput)
+
+        except OSError:
+            pass
+
+        finally:
+            handler.kill()
+            self.clients.discard(client)
+            client.close()
+            logger.info("Client %s:%s disconnected", *address[:2])
+
+    def _respond(self, client: socket.socket, received: Queue) -> None:
+        while True:
+            due, data = received.get()
+            if (delay := due - time.monotonic()) > 0:
+                gevent.sleep(delay)
+
+            if response := self.backpack.feed(data):
+                gevent.sleep(self.latency)
+                client.sendall(response)
+
+    def inject(self, data: bytes) -> None:
+        """
+        Sends bytes to every client, as if they came from the radio
+
+        :param data: The bytes to send
+        """
+        for client in list(self.clients):
+            try:
+                client.sendall(data)
+            except OSError:
+                self.clients.discard(client)
+
+    def inject_recording_state(self, state: int, delay: int = 0) -> None:
+        """
+        Sends a recording state command to every client
+
+        :param state: 1 to start and 0 to stop recording
+        :param delay: The delay before the state changes in seconds
+        """
+        self.inject(recording_state_packet(state, delay))
+
+    def drop_clients(self) -> None:
+        """
+        Closes every client connection to test reconnecting
+        """
+        for client in list(self.clients):
+            client.close()
+
+        self.clients.clear()
+
+    def stats(self) -> str:
+        backpack = self.backpack
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return (
+            f"clients: {len(self.clients)}  connections: {self.connections}  "
+            f"frames: {backpack.frames}  invalid: {backpack.invalid}  "
+            f"bytes: {backpack.bytes} ({backpack.bytes / elapsed:.0f} B/s)  "
+            f"screens: {len(backpack.screens)}"
+        )
+
+    def screens(self) -> str:
+        return self.backpack.render_screens()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument(
+        "--latency", type=float, default=0, help="One way link latency in milliseconds"
+    )
+    parser.add_argument(
+        "--throughput", type=float, default=0, help="Link throughput in bytes/s"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    emulator = NetpackEmulator(
+        args.host, args.port, args.latency / 1000, args.throughput
+    )
+    emulator.start()
+
+    try:
+        run_commands(emulator, FileObject(sys.stdin))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emulator.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,431 @@
+"""
+Replays synthetic races through the plugin's race event handlers and
+reports how long each event takes to reach the wire.
+
+Run from the repository root:
+
+    python -m benchmarks.race_load --pilots 8 16 32
+"""
+
+import argparse
+import json
+import random
+import statistics
+import time
+import types
+from collections.abc import Callable
+from dataclasses import asdict, dataclass
+from typing import Any, Union
+
+import gevent
+
+from .fake_rhapi import (
+    FakeRHAPI,
+    WinCondition,
+    install_stubs,
+    load_controller,
+    wait_idle,
+)
+
+install_stubs()
+
+from vrxc_elrs.capture import WireRecorder  # noqa: E402
+
+CONSECUTIVES_BASE = 3
+
+# Every OSD feature is enabled so each event does its full amount of work.
+# Uptimes are long enough that no row expires while a race is replayed.
+RACE_OPTIONS = {
+    "_heat_name": "1",
+    "_round_num": "1",
+    "_class_name": "1",
+    "_event_name": "1",
+    "_position_mode": "1",
+    "_gap_mode": "1",
+    "_results_mode": "1",
+    "_racestart_uptime": 6000,
+    "_finish_uptime": 6000,
+    "_results_uptime": 6000,
+    "_announcement_uptime": 6000,
+    "eventName": "Benchmark Event",
+    "_slow_transaction_ms": 0,
+}
+
+
+@dataclass
+class EventSample:
+    """
+    Measurements of a single handled event
+    """
+
+    event: str
+    cpu: float
+    first_write: Union[float, None]
+    last_write: Union[float, None]
+    packets: int
+    bytes_: int
+
+
+@dataclass
+class PilotState:
+    """
+    Lap progress of a pilot in the synthetic race
+    """
+
+    pilot_id: int
+    callsign: str
+    laps: int = 0
+    total: float = 0
+    last: float = 0
+    best: Union[float, None] = None
+    lap_times: tuple[float, ...] = ()
+
+    @property
+    def consecutives(self) -> Union[float, None]:
+        if len(self.lap_times) < CONSECUTIVES_BASE:
+            return None
+
+        return min(
+            sum(self.lap_times[i : i + CONSECUTIVES_BASE])
+            for i in range(len(self.lap_times) - CONSECUTIVES_BASE + 1)
+        )
+
+
+def percentile(values: list[float], pct: float) -> float:
+    """
+    Nearest rank percentile
+
+    :param values: The sampled values
+    :param pct: The percentile between 0 and 100
+    :return: The value at the percentile
+    """
+    ordered = sorted(values)
+    rank = max(int(round(pct / 100 * len(ordered) + 0.5)) - 1, 0)
+    return ordered[min(rank, len(ordered) - 1)]
+
+
+def format_ms(millis: Union[float, None]) -> str:
+    if millis is None:
+        return ""
+
+    minutes, millis = divmod(int(millis), 60000)
+    return f"{minutes}:{millis / 1000:06.3f}"
+
+
+class RaceReplay:
+    """
+    Drives a plugin controller through a synthetic race
+    """
+
+    def __init__(
+        self,
+        pilots: int,
+        laps: int,
+        win_condition: WinCondition,
+        seed: int,
+        links: int = 1,
+        baud: int = 0,
+    ):
+        self.laps = laps
+        self.win_condition = win_condition
+        self.rng = random.Random(seed)
+        self.samples: list[EventSample] = []
+
+        self.rhapi = FakeRHAPI()
+        self.rhapi.db.options.update(RACE_OPTIONS)
+        self.rhapi.db.heats[1] = types.SimpleNamespace(
+            id=1, class_id=1, display_name="Heat 1"
+        )
+        self.rhapi.db.raceclasses[1] = types.SimpleNamespace(
+            id=1, display_name="Open Class"
+        )
+
+        self.pilots: dict[int, PilotState] = {}
+        for seat in range(pilots):
+            pilot_id = seat + 1
+            self.pilots[pilot_id] = PilotState(pilot_id, f"PILOT{pilot_id}")
+            self.rhapi.race.pilots[seat] = pilot_id
+            self.rhapi.race.seats_finished[seat] = False
+            self.rhapi.db.pilot_attributes[(pilot_id, "elrs_active")] = "1"
+            self.rhapi.db.pilot_attributes[(pilot_id, "comm_elrs")] = (
+                f"benchmark-{pilot_id}"
+            )
+
+        self.controller = load_controller(self.rhapi, links, baud)
+        self.connections = [link.connection for link in self.controller._links]
+
+    def measure(self, event: str, handler: Callable, *args) -> None:
+        """
+        Runs an event handler and records the writes it caused
+
+        :param event: The name of the event
+        :param handler: The handler to run
+        """
+        connections = self.connections
+        writes = [len(connection.writes) for connection in connections]
+        packets = sum(connection.packets for connection in connections)
+        bytes_ = sum(connection.bytes for connection in connections)
+
+        cpu = time.process_time()
+        start = time.perf_counter()
+        handler(*args)
+        wait_idle(self.controller)
+        cpu = time.process_time() - cpu
+
+        new_writes = sorted(
+            write
+            for connection, count in zip(connections, writes)
+            for write in connection.writes[count:]
+        )
+        self.samples.append(
+            EventSample(
+                event,
+                cpu,
+                new_writes[0][0] - start if new_writes else None,
+                new_writes[-1][0] - start if new_writes else None,
+                sum(connection.packets for connection in connections) - packets,
+                sum(connection.bytes for connection in connections) - bytes_,
+            )
+        )
+
+    def _leaderboard(self) -> list[PilotState]:
+        return sorted(self.pilots.values(), key=lambda p: (-p.laps, p.total))
+
+    def _results(self) -> list[dict[str, Any]]:
+        return [
+            {
+                "pilot_id": pilot.pilot_id,
+                "callsign": pilot.callsign,
+                "position": position,
+                "laps": max(pilot.laps - 1, 0),
+                "total_time": format_ms(pilot.total),
+                "fastest_lap": format_ms(pilot.best),
+                "consecutives": format_ms(pilot.consecutives),
+                "consecutives_base": CONSECUTIVES_BASE,
+            }
+            for position, pilot in enumerate(self._leaderboard(), 1)
+        ]
+
+    def _gap_info(self, pilot: PilotState) -> Any:
+        leaderboard = self._leaderboard()
+        index = leaderboard.index(pilot)
+        ahead = leaderboard[index - 1] if index else None
+        first = leaderboard[0]
+
+        def rank(other: Union[PilotState, None]) -> Any:
+            if other is None or other is pilot:
+                return types.SimpleNamespace(diff_time=0, callsign="")
+
+            return types.SimpleNamespace(
+                diff_time=max(pilot.total - other.total, 0), callsign=other.callsign
+            )
+
+        return types.SimpleNamespace(
+            race=types.SimpleNamespace(win_condition=self.win_condition),
+            current=types.SimpleNamespace(
+                lap_number=pilot.laps - 1,
+                last_lap_time=pilot.last,
+                total_time_laps=pilot.total,
+                consecutives=pilot.consecutives,
+                consecutives_base=CONSECUTIVES_BASE,
+                is_best=pilot.last == pilot.best,
+                is_best_lap=pilot.last == pilot.best,
+            ),
+            next_rank=rank(ahead),
+            first_rank=rank(first),
+        )
+
+    def _crossings(self) -> list[tuple[float, int, float]]:
+        """
+        Generates every gate crossing of the race in order,
+        starting with each pilot's holeshot
+
+        :return: Race time, pilot and lap time of each crossing
+        """
+        crossings = []
+        for pilot_id in self.pilots:
+            pace = self.rng.gauss(30000, 3000)
+            total = 0.0
+            for lap in range(self.laps + 1):
+                if lap:
+                    lap_time = max(self.rng.gauss(pace, pace * 0.05), 5000)
+                else:
+                    lap_time = self.rng.uniform(500, 2500)
+
+                total += lap_time
+                crossings.append((total, pilot_id, lap_time))
+
+        return sorted(crossings)
+
+    def run(self) -> list[EventSample]:
+        """
+        Replays the race
+
+        :return: The measured events
+        """
+        controller = self.controller
+        seats = {pilot_id: seat for seat, pilot_id in self.rhapi.race.pilots.items()}
+
+        self.measure("stage", controller.onRaceStage, {"heat_id": 1})
+        self.measure("start", controller.onRaceStart, {})
+
+        finished = False
+        for total, pilot_id, lap_time in self._crossings():
+            pilot = self.pilots[pilot_id]
+            pilot.total = total
+            pilot.laps += 1
+            if pilot.laps > 1:
+                pilot.last = lap_time
+                pilot.best = min(pilot.best or lap_time, lap_time)
+                pilot.lap_times += (lap_time,)
+
+            self.measure(
+                "lap",
+                controller.onRaceLapRecorded,
+                {
+                    "pilot_id": pilot_id,
+                    "results": {"by_race_time": self._results()},
+                    "gap_info": self._gap_info(pilot),
+                },
+            )
+
+            if pilot.laps <= self.laps:
+                continue
+
+            if not finished:
+                finished = True
+                self.measure("finish", controller.onRaceFinish, {})
+
+            self.rhapi.race.seats_finished[seats[pilot_id]] = True
+            self.measure(
+                "done",
+                controller.onRacePilotDone,
+                {
+                    "pilot_id": pilot_id,
+                    "results": {
+                        "by_race_time": self._results(),
+                        "meta": {
+                            "primary_leaderboard": "by_race_time",
+                            "win_condition": self.win_condition,
+                        },
+                    },
+                },
+            )
+
+        self.measure("stop", controller.onRaceStop, {})
+        self.measure("clear", controller.onLapsClear, {})
+
+        for connection in self.connections:
+            connection.disconnect()
+
+        return self.samples
+
+
+def summarize(samples: list[EventSample]) -> dict[str, dict[str, float]]:
+    """
+    Summarizes the samples of each event type
+
+    :param samples: The measured events
+    :return: Statistics by event type
+    """
+    summary = {}
+    for event in dict.fromkeys(sample.event for sample in samples):
+        matching = [sample for sample in samples if sample.event == event]
+        latencies = [s.last_write for s in matching if s.last_write is not None]
+        firsts = [s.first_write for s in matching if s.first_write is not None]
+
+        stats = {
+            "events": len(matching),
+            "cpu_us": statistics.fmean(s.cpu for s in matching) * 1e6,
+            "packets": statistics.fmean(s.packets for s in matching),
+            "bytes": statistics.fmean(s.bytes_ for s in matching),
+        }
+        if latencies:
+            stats["first_p50_ms"] = percentile(firsts, 50) * 1e3
+            stats["p50_ms"] = percentile(latencies, 50) * 1e3
+            stats["p95_ms"] = percentile(latencies, 95) * 1e3
+            stats["p99_ms"] = percentile(latencies, 99) * 1e3
+
+        summary[event] = stats
+
+    return summary
+
+
+def print_summary(pilots: int, summary: dict[str, dict[str, float]]) -> None:
+    print(f"\n{pilots} pilots")
+    print(
+        f"{'event':<8}{'count':>7}{'first p50':>11}{'p50':>9}{'p95':>9}"
+        f"{'p99':>9}{'cpu/evt':>11}{'pkts/evt':>10}{'bytes/evt':>11}"
+    )
+    for event, stats in summary.items():
+        latency = "".join(
+            f"{stats[key]:>{width}.3f}" if key in stats else f"{'-':>{width}}"
+            for key, width in (
+                ("first_p50_ms", 11),
+                ("p50_ms", 9),
+                ("p95_ms", 9),
+                ("p99_ms", 9),
+            )
+        )
+        print(
+            f"{event:<8}{stats['events']:>7}{latency}"
+            f"{stats['cpu_us']:>9.0f}us{stats['packets']:>10.1f}{stats['bytes']:>11.1f}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--pilots", type=int, nargs="+", default=[8, 16, 32])
+    parser.add_argument("--laps", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument(
+        "--win-condition",
+        choices=[condition.name for condition in WinCondition],
+        default=WinCondition.MOST_PROGRESS.name,
+    )
+    parser.add_argument("--json", help="Write the samples and summary to a file")
+    parser.add_argument("--capture", help="Record the written bytes to a capture file")
+    parser.add_argument(
+        "--links", type=int, default=1, help="Spread the pilots across backpack links"
+    )
+    parser.add_argument(
+        "--baud", type=int, default=0, help="Simulated baud rate of each link"
+    )
+    args = parser.parse_args()
+
+    report = {}
+    for pilots in args.pilots:
+        replay = RaceReplay(
+            pilots,
+            args.laps,
+            WinCondition[args.win_condition],
+            args.seed,
+            args.links,
+            args.baud,
+        )
+        if args.capture:
+            recorder = WireRecorder(args.capture)
+            for connection in replay.connections:
+                connection.recorder = recorder
+
+        samples = replay.run()
+        if args.capture:
+            recorder.close()
+
+        summary = summarize(samples)
+        print_summary(pilots, summary)
+
+        report[pilots] = {
+            "summary": summary,
+            "samples": [asdict(sample) for sample in samples],
+        }
+
+    print("\nLatency is from the event handler being called to the bytes being written")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
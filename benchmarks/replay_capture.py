@@ -0,0 +1,153 @@
+"""
+Replays a backpack traffic capture through the MSP parser and a
+virtual backpack, at the original or an accelerated speed.
+
+Run from the repository root:
+
+    python -m benchmarks.replay_capture elrs_backpack.cap --speed 10
+    python -m benchmarks.replay_capture elrs_backpack.cap --speed 0 --profile
+"""
+
+import argparse
+import cProfile
+import pstats
+import time
+from collections import Counter
+from collections.abc import Iterable
+
+import gevent
+from gevent.queue import Queue
+
+from .fake_rhapi import install_stubs
+from .virtual_backpack import VirtualBackpack
+
+install_stubs()
+
+from vrxc_elrs.capture import (  # noqa: E402
+    CaptureRecord,
+    Direction,
+    capture_files,
+    read_capture,
+)
+from vrxc_elrs.metrics import Metrics  # noqa: E402
+from vrxc_elrs.msp import MSPPacket  # noqa: E402
+
+
+class CaptureReplay:
+    """
+    Feeds recorded traffic back through the codec. Sent bytes
+    go to a virtual backpack, which rebuilds each pilot's screen.
+    Received bytes are put in a queue parsed by the plugin's
+    decoder, the same way the serial and socket connections
+    parse each read.
+    """
+
+    def __init__(self, speed: float):
+        """
+        :param speed: Replay speed relative to the recording, or 0 for no delays
+        """
+        self.speed = speed
+        self.backpack = VirtualBackpack()
+        self.received: Counter[str] = Counter()
+        self.records = 0
+        self.first_ns: int | None = None
+        self.last_ns: int | None = None
+        self.metrics = Metrics()
+        self._parsing_queue: Queue = Queue()
+
+    def replay(self, records: Iterable[CaptureRecord]) -> None:
+        parser = gevent.spawn(self._parser)
+        try:
+            self._replay(records)
+
+            # Returns once the parser is blocked on the empty queue
+            gevent.idle()
+        finally:
+            parser.kill()
+
+    def _replay(self, records: Iterable[CaptureRecord]) -> None:
+        start = time.monotonic()
+        for record in records:
+            if self.first_ns is None:
+                self.first_ns = record.timestamp_ns
+
+            if self.speed:
+                due = (record.timestamp_ns - self.first_ns) / 1e9 / self.speed
+                if (delay := due - (time.monotonic() - start)) > 0:
+                    gevent.sleep(delay)
+
+            self.records += 1
+            self.last_ns = record.timestamp_ns
+
+            if record.direction == Direction.TX:
+                self.backpack.feed(record.data)
+            else:
+                self._parsing_queue.put(record.data)
+
+    def _parser(self) -> None:
+        for packet in MSPPacket.packets_from_bytes_queue(
+            self._parsing_queue, self.metrics
+        ):
+            assert packet.function is not None
+            self.received[packet.function.name] += 1
+
+    def summary(self) -> str:
+        backpack = self.backpack
+        recorded = 0.0
+        if self.first_ns is not None and self.last_ns is not None:
+            recorded = (self.last_ns - self.first_ns) / 1e9
+
+        lines = [
+            f"records: {self.records}  recorded span: {recorded:.1f}s",
+            f"sent: {backpack.bytes} bytes  {backpack.frames} frames  "
+            f"{backpack.invalid} invalid  {len(backpack.screens)} screens",
+        ]
+        for name, count in self.received.most_common():
+            lines.append(f"received {name}: {count}")
+
+        counters = self.metrics.counters
+        lines.append(
+            f"received crc failures: {counters.get('crc_failures', 0)}  "
+            f"resyncs: {counters.get('resyncs', 0)}"
+        )
+
+        return "\n".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("capture", help="The newest capture file")
+    parser.add_argument(
+        "--speed",
+        type=float,
+        default=1,
+        help="Replay speed relative to the recording, 0 replays without delays",
+    )
+    parser.add_argument("--screens", action="store_true", help="Print final screens")
+    parser.add_argument("--profile", action="store_true", help="Profile the replay")
+    args = parser.parse_args()
+
+    replay = CaptureReplay(args.speed)
+    files = capture_files(args.capture)
+    records = (record for path in files for record in read_capture(path))
+
+    start = time.perf_counter()
+    if args.profile:
+        profile = cProfile.Profile()
+        profile.runcall(replay.replay, records)
+    else:
+        replay.replay(records)
+    elapsed = time.perf_counter() - start
+
+    print(f"files: {len(files)}  replayed in {elapsed:.2f}s")
+    print(replay.summary())
+
+    if args.screens:
+        print(replay.backpack.render_screens())
+
+    if args.profile:
+        pstats.Stats(profile).sort_stats("cumulative").print_stats(25)
+
+
+if __name__ == "__main__":
+    main()
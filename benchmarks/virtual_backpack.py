@@ -0,0 +1,253 @@
+"""
+A backpack emulated in software. Decodes the MSP stream sent by the
+plugin into virtual goggle screens and answers the commands a real
+backpack answers.
+"""
+
+import logging
+from collections.abc import Generator, Iterable
+from dataclasses import dataclass, field
+from typing import Any
+
+import gevent
+
+from .fake_rhapi import install_stubs
+
+install_stubs()
+
+from vrxc_elrs.msp import (  # noqa: E402
+    MSP_HEADER_LENGTH,
+    MSPPacket,
+    MSPPacketType,
+    MSPTypes,
+)
+from vrxc_elrs.osd import OSD_COLUMNS, OSD_ROWS  # noqa: E402
+
+EMULATOR_VERSION = "1.5.0-emulator"
+BOUND_UID = "bound"
+
+logger = logging.getLogger(__name__)
+
+
+def split_frames(buffer: bytearray) -> Generator[bytes, None, None]:
+    """
+    Removes complete MSP v2 frames from the front of a buffer.
+    Bytes before a frame header are discarded, and a partial
+    frame is left in the buffer for the next read.
+
+    :param buffer: The received bytes
+    :yield: The complete frames
+    """
+    while True:
+        start = buffer.find(b"$X")
+        if start < 0:
+            del buffer[: max(len(buffer) - 1, 0)]
+            return
+
+        del buffer[:start]
+        if len(buffer) < MSP_HEADER_LENGTH:
+            return
+
+        size = MSP_HEADER_LENGTH + int.from_bytes(buffer[6:8], "little") + 1
+        if len(buffer) < size:
+            return
+
+        frame = bytes(buffer[:size])
+        del buffer[:size]
+        yield frame
+
+
+def decode_frame(frame: bytes) -> MSPPacket | None:
+    """
+    Decodes a single frame
+
+    :param frame: The frame
+    :return: The packet, or None when the frame is invalid
+    """
+    try:
+        return next(MSPPacket.packets_from_bytes(frame), None)
+    except ValueError:
+        # Unknown function
+        return None
+
+
+def response_packet(function: MSPTypes, payload: bytes = b"") -> bytes:
+    packet = MSPPacket()
+    packet.set_type(MSPPacketType.RESPONSE)
+    packet.set_function(function)
+    packet.set_payload(payload)
+    return packet.get_packet()
+
+
+def recording_state_packet(state: int, delay: int = 0) -> bytes:
+    """
+    A recording state command, as sent by the race director's transmitter
+
+    :param state: 1 to start and 0 to stop recording
+    :param delay: The delay before the state changes in seconds
+    :return: The encoded packet
+    """
+    packet = MSPPacket()
+    packet.set_function(MSPTypes.MSP_ELRS_BACKPACK_SET_RECORDING_STATE)
+    packet.set_payload(bytes((state,)) + delay.to_bytes(2, "little"))
+    return packet.get_packet()
+
+
+@dataclass
+class VirtualScreen:
+    """
+    The OSD of one pair of goggles. Text is drawn to a working
+    buffer and becomes visible when the display command is sent.
+    """
+
+    working: list[bytearray] = field(
+        default_factory=lambda: [bytearray(OSD_COLUMNS) for _ in range(OSD_ROWS)]
+    )
+    shown: list[bytes] = field(
+        default_factory=lambda: [bytes(OSD_COLUMNS) for _ in range(OSD_ROWS)]
+    )
+    displays: int = 0
+
+    def clear(self) -> None:
+        for row in self.working:
+            row[:] = bytes(OSD_COLUMNS)
+
+    def write(self, row: int, col: int, data: bytes) -> None:
+        if not 0 <= row < OSD_ROWS:
+            return
+
+        data = data[: max(OSD_COLUMNS - col, 0)]
+        self.working[row][col : col + len(data)] = data
+
+    def display(self) -> None:
+        self.shown = [bytes(row) for row in self.working]
+        self.displays += 1
+
+    def render(self) -> str:
+        """
+        Renders the visible screen as text
+
+        :return: The screen framed by a border
+        """
+        border = "+" + "-" * OSD_COLUMNS + "+"
+        rows = [
+            "|" + row.replace(b"\x00", b" ").decode("ascii", "replace") + "|"
+            for row in self.shown
+        ]
+        return "\n".join([border, *rows, border])
+
+
+class VirtualBackpack:
+    """
+    The state of an emulated backpack, fed with the bytes
+    written by the plugin
+    """
+
+    def __init__(self, version: str = EMULATOR_VERSION):
+        self.version = version
+        self.screens: dict[str, VirtualScreen] = {}
+        self.frames = 0
+        self.bytes = 0
+        self.invalid = 0
+        self._uid = BOUND_UID
+        self._buffer = bytearray()
+
+    def screen(self, uid: str) -> VirtualScreen:
+        if uid not in self.screens:
+            self.screens[uid] = VirtualScreen()
+
+        return self.screens[uid]
+
+    def render_screens(self) -> str:
+        """
+        Renders the visible screen of every uid
+
+        :return: The screens
+        """
+        return "\n".join(
+            f"{uid} ({screen.displays} displays)\n{screen.render()}"
+            for uid, screen in self.screens.items()
+        )
+
+    def feed(self, data: bytes) -> bytes:
+        """
+        Handles bytes written by the plugin
+
+        :param data: The received bytes
+        :return: The bytes to send back
+        """
+        self.bytes += len(data)
+        self._buffer += data
+
+        responses = bytearray()
+        for frame in split_frames(self._buffer):
+            packet = decode_frame(frame)
+            if packet is None:
+                self.invalid += 1
+                continue
+
+            self.frames += 1
+            responses += self.handle(packet)
+
+        return bytes(responses)
+
+    def handle(self, packet: MSPPacket) -> bytes:
+        """
+        Handles a decoded packet
+
+        :param packet: The packet
+        :return: The bytes to send back
+        """
+        payload = bytes(packet.payload)
+
+        if packet.function == MSPTypes.MSP_ELRS_GET_BACKPACK_VERSION:
+            return response_packet(packet.function, self.version.encode())
+
+        if packet.function == MSPTypes.MSP_ELRS_SET_SEND_UID:
+            if payload[:1] == b"\x01":
+                self._uid = payload[1:7].hex(".")
+            else:
+                self._uid = BOUND_UID
+
+        elif packet.function == MSPTypes.MSP_ELRS_SET_OSD and payload:
+            screen = self.screen(self._uid)
+            if payload[0] == 0x02:
+                screen.clear()
+            elif payload[0] == 0x03 and len(payload) >= 4:
+                screen.write(payload[1], payload[2], payload[4:])
+            elif payload[0] == 0x04:
+                screen.display()
+
+        return b""
+
+
+def run_commands(target: Any, lines: Iterable[str]) -> None:
+    """
+    Runs console or script commands against an emulated backpack
+
+    :param target: The emulator to control
+    :param lines: The command lines
+    """
+    for line in lines:
+        if not (parts := line.split()) or parts[0].startswith("#"):
+            continue
+
+        command, *args = parts
+        if command == "start":
+            target.inject_recording_state(1, int(args[0]) if args else 0)
+        elif command == "stop":
+            target.inject_recording_state(0)
+        elif command == "raw" and args:
+            target.inject(bytes.fromhex("".join(args)))
+        elif command == "sleep" and args:
+            gevent.sleep(float(args[0]))
+        elif command == "screens":
+            print(target.screens() or "No screens yet")
+        elif command == "stats":
+            print(target.stats())
+        elif command == "drop" and hasattr(target, "drop_clients"):
+            target.drop_clients()
+        else:
+            print(
+                "Commands: start [delay], stop, raw <hex>, sleep <s>, screens, stats, drop"
+            )
@@ -0,0 +1,152 @@
+"""
+Emulates a USB backpack on a pseudo-terminal so the plugin's serial
+connection can be tested and load tested without an ESP32.
+
+Run from the repository root, then set the plugin's `Backpack Serial Port`
+to the printed device:
+
+    python -m benchmarks.virtual_serial --script commands.txt
+
+Commands are read from the script and then from stdin:
+
+    start [delay]   send a start recording command
+    stop            send a stop recording command
+    raw <hex>       send raw bytes
+    sleep <seconds> wait before the next command
+    screens         print the visible screen of every uid
+    stats           print traffic counters
+"""
+
+import argparse
+import itertools
+import logging
+import os
+import sys
+import time
+import tty
+
+import gevent
+import gevent.os
+from gevent.fileobject import FileObject
+
+from .virtual_backpack import VirtualBackpack, recording_state_packet, run_commands
+
+READ_SIZE = 4096
+UART_THROUGHPUT = 460800 // 10
+
+logger = logging.getLogger(__name__)
+
+
+class VirtualSerialBackpack:
+    """
+    A backpack on the slave side of a pseudo-terminal. The plugin
+    opens `port` like any other serial device.
+    """
+
+    _reader: gevent.Greenlet | None = None
+
+    def __init__(self, throughput: float = UART_THROUGHPUT):
+        """
+        :param throughput: Bytes per second read from the plugin, or 0 for no limit
+        """
+        self.backpack = VirtualBackpack()
+        self.throughput = throughput
+        self.reads = 0
+        self.started = time.monotonic()
+
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        gevent.os.make_nonblocking(self._master)
+        self.port = os.ttyname(self._slave)
+
+    def start(self) -> None:
+        self._reader = gevent.spawn(self._read)
+        logger.info("Virtual backpack on %s", self.port)
+
+    def stop(self) -> None:
+        if self._reader is not None:
+            self._reader.kill()
+
+        os.close(self._master)
+        os.close(self._slave)
+
+    def _read(self) -> None:
+        """
+        Handles the bytes written by the plugin. Each read is
+        roughly one write from the plugin, so the read count shows
+        how well writes are coalesced.
+        """
+        while True:
+            data = gevent.os.nb_read(self._master, READ_SIZE)
+            self.reads += 1
+            if response := self.backpack.feed(data):
+                self.inject(response)
+
+            if self.throughput:
+                gevent.sleep(len(data) / self.throughput)
+
+    def inject(self, data: bytes) -> None:
+        """
+        Sends bytes to the plugin, as if they came from the radio
+
+        :param data: The bytes to send
+        """
+        view = memoryview(data)
+        while view:
+            view = view[gevent.os.nb_write(self._master, view) :]
+
+    def inject_recording_state(self, state: int, delay: int = 0) -> None:
+        """
+        Sends a recording state command to the plugin
+
+        :param state: 1 to start and 0 to stop recording
+        :param delay: The delay before the state changes in seconds
+        """
+        self.inject(recording_state_packet(state, delay))
+
+    def stats(self) -> str:
+        backpack = self.backpack
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        per_read = backpack.bytes / self.reads if self.reads else 0
+        return (
+            f"reads: {self.reads} ({per_read:.0f} B/read)  "
+            f"frames: {backpack.frames}  invalid: {backpack.invalid}  "
+            f"bytes: {backpack.bytes} ({backpack.bytes / elapsed:.0f} B/s)  "
+            f"screens: {len(backpack.screens)}"
+        )
+
+    def screens(self) -> str:
+        return self.backpack.render_screens()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--script", help="File of commands to run at startup")
+    parser.add_argument(
+        "--throughput",
+        type=float,
+        default=UART_THROUGHPUT,
+        help="Bytes/s read from the plugin, 0 for no limit. Defaults to 460800 baud.",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    backpack = VirtualSerialBackpack(args.throughput)
+    backpack.start()
+    print(f"Backpack Serial Port: {backpack.port}")
+
+    script = []
+    if args.script:
+        with open(args.script, encoding="utf-8") as file:
+            script = file.readlines()
+
+    try:
+        run_commands(backpack, itertools.chain(script, FileObject(sys.stdin)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        backpack.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,8 +4,14 @@ import RHAPI
 from eventmanager import Evt
 from RHUI import UIField, UIFieldSelectOption, UIFieldType
 
+from .capture import DEFAULT_CAPTURE_PATH
 from .connections import ConnectionTypeEnum
-from .elrs_backpack import ELRSBackpack
+from .elrs_backpack import DEFAULT_CRITICAL_REPEATS, ELRSBackpack
+from .heartbeat import DEFAULT_HEARTBEAT_INTERVAL
+from .profiler import DEFAULT_PROFILE_SECONDS
+from .prometheus import create_blueprint
+from .scheduler import DEFAULT_POOL_SIZE
+from .tracing import DEFAULT_SLOW_TRANSACTION_MS
 
 logger = logging.getLogger(__name__)
 
@@ -16,10 +22,32 @@ def initialize(rhapi: RHAPI.RHAPI):
 
     rhapi.events.on(Evt.VRX_INITIALIZE, controller.register_handlers)
     rhapi.events.on(Evt.PILOT_ALTER, controller.pilot_alter)
+    rhapi.events.on(Evt.PILOT_DELETE, controller.clear_pilot_caches)
+    rhapi.events.on(Evt.DATABASE_RESET, controller.clear_pilot_caches)
+    rhapi.events.on(Evt.DATABASE_RESTORE, controller.clear_pilot_caches)
+    rhapi.events.on(Evt.DATABASE_RECOVER, controller.clear_pilot_caches)
+    rhapi.events.on(Evt.OPTION_SET, controller.option_set)
+    rhapi.events.on(Evt.HEAT_SET, controller.refresh_stage_frames)
+    rhapi.events.on(Evt.HEAT_ALTER, controller.refresh_stage_frames)
+    rhapi.events.on(Evt.CLASS_ALTER, controller.refresh_stage_frames)
+    rhapi.events.on(Evt.LAPS_SAVE, controller.refresh_stage_frames)
+    rhapi.events.on(
+        Evt.STARTUP, controller.configure_scheduler, name="configure_scheduler"
+    )
+    rhapi.events.on(Evt.STARTUP, controller.configure_tracer, name="configure_tracer")
+    rhapi.events.on(
+        Evt.STARTUP, controller.configure_heartbeat, name="configure_heartbeat"
+    )
+    rhapi.events.on(
+        Evt.STARTUP, controller.configure_recorder, name="configure_recorder"
+    )
     rhapi.events.on(
         Evt.STARTUP, controller.start_recieve_loop, name="start_recieve_loop"
     )
     rhapi.events.on(Evt.STARTUP, controller.start_connection, name="start_connection")
+    rhapi.events.on(Evt.SHUTDOWN, controller.close_recorder, name="close_recorder")
+
+    rhapi.ui.blueprint_add(create_blueprint(controller.prometheus_metrics))
 
     #
     # Setup UI
@@ -79,6 +107,39 @@ def initialize(rhapi: RHAPI.RHAPI):
     )
     rhapi.fields.register_option(_socket_ip, "elrs_settings")
 
+    _serial_port = UIField(
+        "_serial_port",
+        "Backpack Serial Port",
+        desc="Serial device of the backpack. Leave empty to scan for it",
+        field_type=UIFieldType.TEXT,
+    )
+    rhapi.fields.register_option(_serial_port, "elrs_settings")
+
+    _extra_backpacks = UIField(
+        "_extra_backpacks",
+        "Additional Backpacks",
+        desc="Backpacks to spread pilots across, such as usb:/dev/ttyUSB1, socket:host",
+        field_type=UIFieldType.TEXT,
+    )
+    rhapi.fields.register_option(_extra_backpacks, "elrs_settings")
+
+    _wire_capture = UIField(
+        "_wire_capture",
+        "Record Backpack Traffic",
+        desc="Record all traffic to and from the backpack for troubleshooting",
+        field_type=UIFieldType.CHECKBOX,
+    )
+    rhapi.fields.register_option(_wire_capture, "elrs_settings")
+
+    _capture_path = UIField(
+        "_capture_path",
+        "Traffic Capture File",
+        desc="File the backpack traffic is recorded to",
+        value=DEFAULT_CAPTURE_PATH,
+        field_type=UIFieldType.TEXT,
+    )
+    rhapi.fields.register_option(_capture_path, "elrs_settings")
+
     conn_opts = [UIFieldSelectOption(value=None, label="")]
     for type_ in ConnectionTypeEnum:
         race_selection = UIFieldSelectOption(value=type_.id_, label=type_.name)
@@ -93,6 +154,69 @@ def initialize(rhapi: RHAPI.RHAPI):
     )
     rhapi.fields.register_option(_conn_opt, "elrs_settings")
 
+    _io_worker = UIField(
+        "_io_worker",
+        "Backpack I/O Worker Process",
+        desc="Encode and write backpack messages in a separate process",
+        field_type=UIFieldType.CHECKBOX,
+    )
+    rhapi.fields.register_option(_io_worker, "elrs_settings")
+
+    _heartbeat_interval = UIField(
+        "_heartbeat_interval",
+        "Backpack Heartbeat Interval (s)",
+        desc="Seconds between checks that the backpack is responding. "
+        "Backpacks that stop responding are reconnected. 0 disables",
+        field_type=UIFieldType.BASIC_INT,
+        value=DEFAULT_HEARTBEAT_INTERVAL,
+    )
+    rhapi.fields.register_option(_heartbeat_interval, "elrs_settings")
+
+    _worker_pool_size = UIField(
+        "_worker_pool_size",
+        "OSD Worker Pool Size",
+        desc="Maximum number of concurrent OSD workers",
+        field_type=UIFieldType.BASIC_INT,
+        value=DEFAULT_POOL_SIZE,
+    )
+    rhapi.fields.register_option(_worker_pool_size, "elrs_settings")
+
+    _slow_transaction_ms = UIField(
+        "_slow_transaction_ms",
+        "Slow OSD Message Warning (ms)",
+        desc="Log OSD messages taking longer than this from event to backpack. 0 disables",
+        field_type=UIFieldType.BASIC_INT,
+        value=DEFAULT_SLOW_TRANSACTION_MS,
+    )
+    rhapi.fields.register_option(_slow_transaction_ms, "elrs_settings")
+
+    _profile_seconds = UIField(
+        "_profile_seconds",
+        "Profiling Duration (s)",
+        desc="How long `Profile Backpack` samples for, up to 600 seconds",
+        field_type=UIFieldType.BASIC_INT,
+        value=DEFAULT_PROFILE_SECONDS,
+    )
+    rhapi.fields.register_option(_profile_seconds, "elrs_settings")
+
+    _test_first_row = UIField(
+        "_test_first_row",
+        "OSD Test First Row",
+        desc="First row of the OSD test sweep",
+        field_type=UIFieldType.BASIC_INT,
+        value=0,
+    )
+    rhapi.fields.register_option(_test_first_row, "elrs_settings")
+
+    _test_last_row = UIField(
+        "_test_last_row",
+        "OSD Test Last Row",
+        desc="Last row of the OSD test sweep",
+        field_type=UIFieldType.BASIC_INT,
+        value=17,
+    )
+    rhapi.fields.register_option(_test_last_row, "elrs_settings")
+
     _heat_name = UIField(
         "_heat_name",
         "Show Heat Name",
@@ -133,6 +257,14 @@ def initialize(rhapi: RHAPI.RHAPI):
     )
     rhapi.fields.register_option(_position_mode, "elrs_vrxc")
 
+    _timed_start = UIField(
+        "_timed_start",
+        "Send Start Message on Schedule",
+        desc="Send the start message at the scheduled start time",
+        field_type=UIFieldType.CHECKBOX,
+    )
+    rhapi.fields.register_option(_timed_start, "elrs_vrxc")
+
     _gap_mode = UIField(
         "_gap_mode",
         "Show Gap Time",
@@ -207,6 +339,14 @@ def initialize(rhapi: RHAPI.RHAPI):
     )
     rhapi.fields.register_option(_leader_message, "elrs_vrxc")
 
+    _osd_layout = UIField(
+        "_osd_layout",
+        "Custom OSD Layout",
+        desc='JSON formats by screen element, e.g. {"racing.lap": "LAP {lap}"}',
+        field_type=UIFieldType.TEXT,
+    )
+    rhapi.fields.register_option(_osd_layout, "elrs_vrxc")
+
     #
     # Basic Integers
     #
@@ -220,6 +360,15 @@ def initialize(rhapi: RHAPI.RHAPI):
     )
     rhapi.fields.register_option(_racestart_uptime, "elrs_vrxc")
 
+    _critical_repeats = UIField(
+        "_critical_repeats",
+        "Race Start and Stop Repeats",
+        desc="Extra times the start and land messages are sent, up to 5",
+        field_type=UIFieldType.BASIC_INT,
+        value=DEFAULT_CRITICAL_REPEATS,
+    )
+    rhapi.fields.register_option(_critical_repeats, "elrs_vrxc")
+
     _finish_uptime = UIField(
         "_finish_uptime",
         "Finish Message Uptime",
@@ -348,3 +497,12 @@ def initialize(rhapi: RHAPI.RHAPI):
     rhapi.ui.register_quickbutton(
         "elrs_settings", "enable_wifi", "Start Backpack WiFi", controller.activate_wifi
     )
+    rhapi.ui.register_quickbutton(
+        "elrs_settings",
+        "show_metrics",
+        "Show Backpack Metrics",
+        controller.show_metrics,
+    )
+    rhapi.ui.register_quickbutton(
+        "elrs_settings", "profile", "Profile Backpack", controller.start_profiler
+    )
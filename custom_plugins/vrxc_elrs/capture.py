@@ -0,0 +1,155 @@
+"""
+Recording of the raw bytes sent to and received from the backpack
+"""
+
+import logging
+import os
+import struct
+import time
+from collections.abc import Generator
+from enum import IntEnum
+from typing import BinaryIO, NamedTuple, Union
+
+DEFAULT_CAPTURE_PATH = "elrs_backpack.cap"
+CAPTURE_MAGIC = b"ELRSCAP1"
+CAPTURE_RECORD = struct.Struct("<QBI")
+CAPTURE_FILE_SIZE = 16 * 1024 * 1024
+CAPTURE_FILES = 8
+CAPTURE_FLUSH_INTERVAL = 1.0
+
+logger = logging.getLogger(__name__)
+
+
+class Direction(IntEnum):
+    TX = 0
+    RX = 1
+
+
+class CaptureRecord(NamedTuple):
+    """
+    A single write to or read from the backpack
+    """
+
+    timestamp_ns: int
+    direction: Direction
+    data: bytes
+
+
+class WireRecorder:
+    """
+    Appends timestamped traffic to a set of rotating capture
+    files, so recording can run all day in a bounded amount of
+    disk space. The newest file is `path`, older files are
+    `path.1`, `path.2` and so on.
+
+    Each file starts with `CAPTURE_MAGIC`, followed by records of
+    a `CAPTURE_RECORD` header (timestamp in ns, direction, length)
+    and the recorded bytes.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_size: int = CAPTURE_FILE_SIZE,
+        max_files: int = CAPTURE_FILES,
+    ):
+        """
+        :param path: The capture file to write
+        :param max_size: The size a file is rotated at
+        :param max_files: The number of files kept, including the current one
+        """
+        self.path = path
+        self.max_size = max_size
+        self.max_files = max(max_files, 1)
+        self._file: Union[BinaryIO, None] = None
+        self._size = 0
+        self._flushed = 0.0
+        self._open()
+
+    def _open(self) -> None:
+        self._file = open(self.path, "ab", buffering=64 * 1024)
+        self._size = self._file.tell()
+        if self._size == 0:
+            self._file.write(CAPTURE_MAGIC)
+            self._size = len(CAPTURE_MAGIC)
+
+    def _rotate(self) -> None:
+        assert self._file is not None
+        self._file.close()
+
+        for index in range(self.max_files - 1, 0, -1):
+            source = self.path if index == 1 else f"{self.path}.{index - 1}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{index}")
+
+        if self.max_files == 1:
+            os.remove(self.path)
+
+        self._open()
+
+    def record(self, direction: Direction, data: bytes) -> None:
+        """
+        Appends traffic to the capture
+
+        :param direction: Whether the data was sent or received
+        :param data: The raw bytes
+        """
+        if self._file is None or not data:
+            return
+
+        if self._size + CAPTURE_RECORD.size + len(data) > self.max_size:
+            self._rotate()
+
+        self._file.write(CAPTURE_RECORD.pack(time.time_ns(), direction, len(data)))
+        self._file.write(data)
+        self._size += CAPTURE_RECORD.size + len(data)
+
+        if (now := time.monotonic()) - self._flushed > CAPTURE_FLUSH_INTERVAL:
+            self._file.flush()
+            self._flushed = now
+
+    def close(self) -> None:
+        """
+        Flushes and closes the capture
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def capture_files(path: str) -> list[str]:
+    """
+    Finds the files of a rotated capture
+
+    :param path: The newest capture file
+    :return: The files from oldest to newest
+    """
+    files = [path]
+    index = 1
+    while os.path.exists(f"{path}.{index}"):
+        files.append(f"{path}.{index}")
+        index += 1
+
+    return [file for file in reversed(files) if os.path.exists(file)]
+
+
+def read_capture(path: str) -> Generator[CaptureRecord, None, None]:
+    """
+    Reads the records of a capture file. A record cut off
+    by a crash ends the file.
+
+    :param path: The capture file
+    :yield: The records in the order they were recorded
+    """
+    with open(path, "rb") as file:
+        if file.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise ValueError(f"{path} is not a backpack capture")
+
+        while len(header := file.read(CAPTURE_RECORD.size)) == CAPTURE_RECORD.size:
+            timestamp, direction, length = CAPTURE_RECORD.unpack(header)
+            data = file.read(length)
+            if len(data) < length:
+                logger.warning("Capture %s ends with a partial record", path)
+                return
+
+            yield CaptureRecord(timestamp, Direction(direction), data)
@@ -1,4 +1,6 @@
 import logging
+import time
+from collections.abc import Generator
 from dataclasses import dataclass
 from enum import Enum
 from typing import Protocol, Union
@@ -10,10 +12,19 @@ import serial
 import serial.tools.list_ports
 from gevent.queue import Queue
 
+from .capture import Direction, WireRecorder
+from .metrics import Metrics
 from .msp import MSPPacket, MSPPacketType, MSPTypes
+from .tracing import Transaction
 
 SOCKET_PORT = 8080
+MAX_BURST_PACKETS = 256
 AVOIDED_PORTS = {"/dev/ttyAMA0", "/dev/ttyAMA10", "COM1"}
+LOCAL_FUNCTIONS = {
+    MSPTypes.MSP_ELRS_SET_SEND_UID,
+    MSPTypes.MSP_ELRS_GET_BACKPACK_VERSION,
+    MSPTypes.MSP_ELRS_BACKPACK_SET_MODE,
+}
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +35,8 @@ class BackpackConnection(Protocol):
     """
 
     connected: bool
+    recorder: Union[WireRecorder, None]
+    metrics: Metrics
 
     def __init__(self, send_queue: Queue, recieve_queue: Queue): ...
 
@@ -32,6 +45,122 @@ class BackpackConnection(Protocol):
     def disconnect(self): ...
 
 
+def drain_burst(send_queue: Queue) -> tuple[list[MSPPacket], list[Transaction]]:
+    """
+    Waits for a packet on the send queue and collects any packets
+    queued behind it so they can be written as one burst. Traced
+    transactions queued behind their packets are collected
+    separately, to be completed once the burst is written.
+
+    :param send_queue: The queue to drain
+    :return: The packets and the transactions of the burst
+    """
+    packets: list[MSPPacket] = []
+    transactions: list[Transaction] = []
+
+    item = send_queue.get()
+    while True:
+        if isinstance(item, Transaction):
+            transactions.append(item)
+        else:
+            packets.append(item)
+
+        if len(packets) >= MAX_BURST_PACKETS or send_queue.empty():
+            return packets, transactions
+
+        item = send_queue.get_nowait()
+
+
+def complete_transactions(
+    transactions: list[Transaction], write_start: float, write_end: float
+) -> None:
+    """
+    Completes the traced transactions of a written burst
+
+    :param transactions: The transactions of the burst
+    :param write_start: `time.perf_counter` before the write
+    :param write_end: `time.perf_counter` after the write
+    """
+    for transaction in transactions:
+        transaction.complete(write_start, write_end)
+
+
+def record_write(
+    metrics: Metrics, packets: list[MSPPacket], data: bytes, start: float
+) -> None:
+    """
+    Counts a completed write to the backpack
+
+    :param metrics: The connection metrics
+    :param packets: The packets taken from the send queue for the write
+    :param data: The bytes written
+    :param start: `time.perf_counter` before the write
+    """
+    metrics.observe("write_seconds", time.perf_counter() - start)
+    metrics.increment("writes")
+    metrics.increment("packets_sent", len(packets))
+    metrics.increment("bytes_sent", len(data))
+
+
+def record_drop(metrics: Metrics, connected: bool) -> None:
+    """
+    Counts a connection lost while it was still in use. Loops
+    stopped by a requested disconnect are not counted.
+
+    :param metrics: The connection metrics
+    :param connected: Whether the connection was still marked connected
+    """
+    if connected:
+        metrics.increment("drops")
+
+
+class SendUIDTracker:
+    """
+    Tracks the send uid currently set on the backpack. Requests
+    to change the uid are held back until a packet addressed to
+    the recipient is written, so redundant set and reset packets
+    never reach the connection.
+    """
+
+    def __init__(self) -> None:
+        self._current: Union[bytes, None] = None
+        self._pending: Union[MSPPacket, None] = None
+
+    def encode(self, packets: list[MSPPacket]) -> bytes:
+        """
+        Encodes a burst of packets into the bytes to write
+
+        :param packets: The packets from the send queue
+        :return: The encoded burst
+        """
+        return b"".join(
+            packet_.get_packet()
+            for packet in packets
+            for packet_ in self.filter(packet)
+        )
+
+    def filter(self, packet: MSPPacket) -> Generator[MSPPacket, None, None]:
+        """
+        Yields the packets that need to be written for
+        the provided packet
+
+        :param packet: The packet from the send queue
+        :yield: The packets to write
+        """
+        if packet.function == MSPTypes.MSP_ELRS_SET_SEND_UID:
+            self._pending = packet
+            return
+
+        if packet.function not in LOCAL_FUNCTIONS and self._pending is not None:
+            if (address := bytes(self._pending.payload)) != self._current:
+                yield self._pending
+                self._current = address
+
+            self._pending = None
+
+        yield packet
+
+
 @dataclass
 class ConnectionType:
     """
@@ -50,6 +179,7 @@ class SerialConnection:
     _send_greenlet: Union[gevent.Greenlet, None] = None
     _recieve_greenlet: Union[gevent.Greenlet, None] = None
     _parsing_greenlet: Union[gevent.Greenlet, None] = None
+    recorder: Union[WireRecorder, None] = None
 
     def __init__(self, send_queue: Queue, recieve_queue: Queue):
         self._connected = False
@@ -57,20 +187,33 @@ class SerialConnection:
         self._recieve_queue = recieve_queue
         self._connection: Union[serial.Serial, None] = None
         self._parsing_queue = gevent.queue.Queue()
+        self._send_uid = SendUIDTracker()
+        self.metrics = Metrics()
 
     @property
     def connected(self) -> bool:
         return self._connected
 
-    def connect(self) -> bool:
+    def connect(self, port: Union[str, None] = None) -> bool:
+        """
+        Finds the backpack on the serial devices
+
+        :param port: Only try this device instead of scanning
+        :return: Whether the backpack was found
+        """
         packet = MSPPacket()
         packet.set_function(MSPTypes.MSP_ELRS_GET_BACKPACK_VERSION)
 
         logger.info("Attempting to find backpack")
 
-        avaliable_port = {port.device for port in serial.tools.list_ports.comports()}
+        if port:
+            avaliable_port = {port}
+        else:
+            avaliable_port = {
+                port.device for port in serial.tools.list_ports.comports()
+            } - AVOIDED_PORTS
 
-        for port in avaliable_port - AVOIDED_PORTS:
+        for port in avaliable_port:
 
             try:
                 connection = serial.Serial(
@@ -136,10 +279,18 @@ class SerialConnection:
 
         try:
             while self._connected:
-                packet: MSPPacket = self._send_queue.get()
-                self._connection.write(packet.get_packet())
+                packets, transactions = drain_burst(self._send_queue)
+                start = time.perf_counter()
+                if data := self._send_uid.encode(packets):
+                    self._connection.write(data)
+                    record_write(self.metrics, packets, data, start)
+                    if self.recorder is not None:
+                        self.recorder.record(Direction.TX, data)
+
+                complete_transactions(transactions, start, time.perf_counter())
 
         finally:
+            record_drop(self.metrics, self._connected)
             self._connected = False
             self._send_greenlet = None
             self.disconnect()
@@ -148,7 +299,10 @@ class SerialConnection:
         """
         Parses incoming data
         """
-        for packet in MSPPacket.packets_from_bytes_queue(self._parsing_queue):
+        for packet in MSPPacket.packets_from_bytes_queue(
+            self._parsing_queue, self.metrics
+        ):
+            self.metrics.increment("packets_received")
             self._recieve_queue.put(packet)
 
     def _recieve(self) -> None:
@@ -160,10 +314,16 @@ class SerialConnection:
         try:
             while self._connected:
                 data = self._connection.read_all()
+                if data:
+                    self.metrics.increment("bytes_received", len(data))
+                    if self.recorder is not None:
+                        self.recorder.record(Direction.RX, data)
+
                 self._parsing_queue.put(data)
                 gevent.sleep(0.2)
 
         finally:
+            record_drop(self.metrics, self._connected)
             self._connected = False
             self._recieve_greenlet = None
             self.disconnect()
@@ -183,7 +343,8 @@ class SerialConnection:
         if self._recieve_greenlet is not None:
             self._recieve_greenlet.kill()
 
-        self._connection.close()
+        if self._connection is not None:
+            self._connection.close()
 
 
 class SocketConnection:
@@ -193,12 +354,17 @@ class SocketConnection:
 
     _send_greenlet: Union[gevent.Greenlet, None] = None
     _recieve_greenlet: Union[gevent.Greenlet, None] = None
+    _parsing_greenlet: Union[gevent.Greenlet, None] = None
+    recorder: Union[WireRecorder, None] = None
 
     def __init__(self, send_queue: Queue, recieve_queue: Queue):
         self._connected = False
         self._send_queue = send_queue
         self._recieve_queue = recieve_queue
         self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._parsing_queue = gevent.queue.Queue()
+        self._send_uid = SendUIDTracker()
+        self.metrics = Metrics()
 
     @property
     def connected(self) -> bool:
@@ -235,6 +401,7 @@ class SocketConnection:
 
         self._socket.settimeout(None)
 
+        self._parsing_greenlet = gevent.spawn(self._parser)
         self._send_greenlet = gevent.spawn(self._send)
         self._recieve_greenlet = gevent.spawn(self._recieve)
 
@@ -246,22 +413,40 @@ class SocketConnection:
         """
         try:
             while self._connected:
-                packet: MSPPacket = self._send_queue.get()
-
-                timeout = gevent.Timeout(1)
-                timeout.start()
-                try:
-                    self._socket.sendall(packet.get_packet())
-                finally:
-                    timeout.close()
+                packets, transactions = drain_burst(self._send_queue)
+                start = time.perf_counter()
+                if data := self._send_uid.encode(packets):
+                    timeout = gevent.Timeout(1)
+                    timeout.start()
+                    try:
+                        self._socket.sendall(data)
+                    finally:
+                        timeout.close()
+
+                    record_write(self.metrics, packets, data, start)
+                    if self.recorder is not None:
+                        self.recorder.record(Direction.TX, data)
+
+                complete_transactions(transactions, start, time.perf_counter())
         except gevent._socketcommon.cancel_wait_ex:
             ...
 
         finally:
+            record_drop(self.metrics, self._connected)
             self._connected = False
             self._send_greenlet = None
             self.disconnect()
 
+    def _parser(self) -> None:
+        """
+        Parses incoming data
+        """
+        for packet in MSPPacket.packets_from_bytes_queue(
+            self._parsing_queue, self.metrics
+        ):
+            self.metrics.increment("packets_received")
+            self._recieve_queue.put(packet)
+
     def _recieve(self) -> None:
         """
         Recieves data from the socket and adds it to the queue
@@ -269,12 +454,20 @@ class SocketConnection:
         try:
             while self._connected:
                 data = self._socket.recv(128)
-                for packet in MSPPacket.packets_from_bytes(data):
-                    self._recieve_queue.put(packet)
+                if not data:
+                    logger.warning("Backpack closed the socket connection")
+                    break
+
+                self.metrics.increment("bytes_received", len(data))
+                if self.recorder is not None:
+                    self.recorder.record(Direction.RX, data)
+
+                self._parsing_queue.put(data)
         except gevent._socketcommon.cancel_wait_ex:
             ...
 
         finally:
+            record_drop(self.metrics, self._connected)
             self._connected = False
             self._recieve_greenlet = None
             self.disconnect()
@@ -285,6 +478,9 @@ class SocketConnection:
         """
         self._connected = False
 
+        if self._parsing_greenlet is not None:
+            self._parsing_greenlet.kill()
+
         if self._send_greenlet is not None:
             self._send_greenlet.kill()
 
@@ -1,40 +1,161 @@
+import functools
 import hashlib
+import itertools
+import json
 import logging
+import random
+import time
+from collections.abc import Sequence
+from dataclasses import dataclass
 
 import gevent
-import gevent.lock
 import gevent.socket as socket
 import util.RH_GPIO as RH_GPIO
-from gevent.queue import Queue
 from RHRace import RaceStatus, WinCondition
 from VRxControl import VRxController
 
+from .capture import DEFAULT_CAPTURE_PATH, WireRecorder
 from .connections import BackpackConnection, ConnectionTypeEnum
+from .heartbeat import DEFAULT_HEARTBEAT_INTERVAL, LinkState
+from .links import BackpackLink, link_for_uid, parse_links
+from .metrics import Metrics, format_metrics, format_metrics_markdown
 from .msp import MSPPacket, MSPPacketType, MSPTypes
+from .osd import (
+    MESSAGE_OPTIONS,
+    OSD_COLUMNS,
+    OSD_ROWS,
+    ROW_OPTIONS,
+    OSDLayout,
+    OSDText,
+    center_column,
+    encode_centered_text,
+    encode_text,
+    format_split_time,
+)
+from .profiler import DEFAULT_PROFILE_SECONDS, StackSampler
+from .prometheus import format_prometheus
+from .scheduler import DEFAULT_POOL_SIZE, DelayedJob, OSDScheduler
+from .tracing import (
+    DEFAULT_SLOW_TRANSACTION_MS,
+    TracedLock,
+    Tracer,
+    current_transaction,
+    traced,
+)
+from .worker import WorkerConnection
 
 logger = logging.getLogger(__name__)
 
 
+CAPTURE_OPTIONS = {"_wire_capture", "_capture_path"}
+STAGE_OPTIONS = {
+    "_heat_name",
+    "_round_num",
+    "_class_name",
+    "_event_name",
+    "eventName",
+}
+MAX_PROFILE_SECONDS = 600
+DEFAULT_CRITICAL_REPEATS = 2
+MAX_CRITICAL_REPEATS = 5
+CRITICAL_REPEAT_SPACING = 0.1
+CRITICAL_REPEAT_JITTER = 0.5
+FIELD_TEST_INTERVAL = 0.5
+FIELD_TEST_HOLD = 1.0
+FIELD_TEST_BACKOFF = 0.05
+RECONNECT_ATTEMPTS = 3
+RECONNECT_DELAY = 5
+LAYOUT_OPTIONS = ROW_OPTIONS | set(MESSAGE_OPTIONS.values()) | {"_osd_layout"}
+
+
 class CancelError(BaseException): ...
 
 
+@dataclass
+class StageFrames:
+    """
+    OSD frames shown to pilots when a heat is staged, and their recipients
+    """
+
+    heat_id: int
+    pilots: dict[int, int]
+    uids: list[bytes]
+    rows: list[int]
+    packets: tuple[MSPPacket, ...]
+
+
+@dataclass
+class StagedStart:
+    """
+    Race start frames prepared ahead of the start event
+    """
+
+    uids: list[bytes]
+    packets: tuple[MSPPacket, ...]
+    repeat_packets: tuple[MSPPacket, ...]
+    status_row: int
+    uptime: float
+
+
 class ELRSBackpack(VRxController):
 
-    _connection: BackpackConnection | None = None
+    _recorder: WireRecorder | None = None
+    _layout: OSDLayout | None = None
+    _stage_frames: StageFrames | None = None
+    _staged_start: StagedStart | None = None
+    _start_sent: bool = False
+    _start_timer: gevent.Greenlet | None = None
+    _field_test: int = 0
+    _route: BackpackLink | None = None
+    _receiving: bool = False
+    _heartbeat_interval: float = DEFAULT_HEARTBEAT_INTERVAL
+    _profiler: StackSampler | None = None
 
     def __init__(self, name, label, rhapi):
         super().__init__(name, label)
         self._rhapi = rhapi
-        self._send_queue = Queue()
-        self._recieve_queue = Queue(maxsize=100)
-        self._queue_lock = gevent.lock.RLock()
+        self._queue_lock = TracedLock()
+        self._generations = itertools.count(1)
+        self._row_owners: dict[tuple[bytes, int], int] = {}
+        self._row_expiries: dict[tuple[bytes, int], DelayedJob] = {}
+        self.metrics = Metrics()
+        self._scheduler = OSDScheduler(metrics=self.metrics)
+        self._tracer = Tracer(self.metrics)
+        self._routed: list[BackpackLink] = []
+        self._links = [self._create_link("")]
+        self._lap_states: dict[int, tuple[int | None, int]] = {}
+        self._pilot_uids: dict[int, bytes] = {}
+
+        self.metrics.gauge_callback(
+            "send_queue_depth",
+            lambda: sum(link.send_queue.qsize() for link in self._links),
+        )
+        self.metrics.gauge_callback(
+            "receive_queue_depth",
+            lambda: sum(link.recieve_queue.qsize() for link in self._links),
+        )
+        self.metrics.gauge_callback(
+            "osd_queue_depth", lambda: self._scheduler.queue_depth
+        )
+        self.metrics.gauge_callback(
+            "osd_max_queue_depth", lambda: self._scheduler.max_queue_depth
+        )
+        self.metrics.gauge_callback("osd_workers", lambda: self._scheduler.active)
 
     @property
     def _backpack_connected(self) -> bool:
-        if self._connection is None:
-            return False
+        return any(link.connected for link in self._links)
 
-        return self._connection.connected
+    @property
+    def link_state(self) -> LinkState:
+        """
+        The state of the healthiest connected backpack link
+        according to its heartbeat
+        """
+        return max(
+            (link.heartbeat.state for link in self._links if link.connected),
+            default=LinkState.DEAD,
+        )
 
     def register_handlers(self, args) -> None:
         """
@@ -67,22 +188,203 @@ class ELRSBackpack(VRxController):
     # Connection handling
     #
 
+    def configure_scheduler(self, *_) -> None:
+        """
+        Applies the configured size of the OSD worker pool
+        """
+        size = self._rhapi.db.option("_worker_pool_size", None, as_int=True)
+        self._scheduler.resize(size if size else DEFAULT_POOL_SIZE)
+
+    def configure_tracer(self, *_) -> None:
+        """
+        Applies the configured threshold for logging slow transactions
+        """
+        threshold = self._rhapi.db.option(
+            "_slow_transaction_ms", DEFAULT_SLOW_TRANSACTION_MS, as_int=True
+        )
+        self._tracer.slow_threshold = max(threshold, 0) / 1000
+
+    def configure_heartbeat(self, *_) -> None:
+        """
+        Applies the configured interval of the heartbeat pings
+        """
+        interval = self._rhapi.db.option(
+            "_heartbeat_interval", DEFAULT_HEARTBEAT_INTERVAL, as_int=True
+        )
+        self._heartbeat_interval = max(interval, 0)
+        for link in self._links:
+            link.heartbeat.interval = self._heartbeat_interval
+            if link.connected:
+                link.heartbeat.start()
+
+    def configure_recorder(self, *_) -> None:
+        """
+        Starts or stops recording the backpack traffic
+        """
+        self.close_recorder()
+
+        if self._rhapi.db.option("_wire_capture") == "1":
+            path = self._rhapi.db.option("_capture_path", None) or DEFAULT_CAPTURE_PATH
+            try:
+                self._recorder = WireRecorder(path)
+            except OSError:
+                message = "Failed to open the backpack traffic capture"
+                logger.exception(message)
+                self._rhapi.ui.message_notify(self._rhapi.language.__(message))
+            else:
+                logger.info("Recording backpack traffic to %s", path)
+
+        for link in self._links:
+            if link.connection is not None:
+                link.connection.recorder = self._recorder
+
+    def close_recorder(self, *_) -> None:
+        """
+        Stops recording the backpack traffic
+        """
+        for link in self._links:
+            if link.connection is not None:
+                link.connection.recorder = None
+
+        if self._recorder is not None:
+            self._recorder.close()
+            self._recorder = None
+
+    def option_set(self, args: dict) -> None:
+        """
+        Reacts to changes of the plugin's options
+
+        :param args: Event arguments
+        """
+        option = args.get("option")
+        if option == "_worker_pool_size":
+            self.configure_scheduler()
+
+        if option == "_slow_transaction_ms":
+            self.configure_tracer()
+
+        if option == "_heartbeat_interval":
+            self.configure_heartbeat()
+
+        if option == "_extra_backpacks":
+            self.configure_links()
+
+        if option in CAPTURE_OPTIONS:
+            self.configure_recorder()
+
+        if option in LAYOUT_OPTIONS:
+            self._layout = None
+
+        if option in STAGE_OPTIONS or option in LAYOUT_OPTIONS:
+            self._stage_frames = None
+
     def start_recieve_loop(self, *_):
         """
         Start the msp packet processing loop
         """
-        gevent.spawn(self.recieve_loop)
+        self._receiving = True
+        for link in self._links:
+            self._start_receiver(link)
+
         logger.info("Backpack recieve greenlet started.")
 
+    def _start_receiver(self, link: BackpackLink) -> None:
+        """
+        Starts processing the packets recieved by a link
+
+        :param link: The link
+        """
+        if self._receiving and link.receiver is None:
+            link.receiver = gevent.spawn(self.recieve_loop, link)
+
+    def _create_link(self, name: str) -> BackpackLink:
+        """
+        Creates a backpack link
+
+        :param name: The name of the link
+        :return: The link
+        """
+        link = BackpackLink(name, self._osd_idle, self._link_state_changed)
+        link.heartbeat.interval = self._heartbeat_interval
+        self._start_receiver(link)
+        return link
+
+    def configure_links(self, *_) -> list[tuple[BackpackLink, ConnectionTypeEnum, str]]:
+        """
+        Applies the configured additional backpacks. Links that
+        are no longer configured are disconnected and removed.
+
+        :return: The additional links with their connection type and address
+        """
+        try:
+            configured = parse_links(
+                self._rhapi.db.option("_extra_backpacks", None) or ""
+            )
+        except ValueError as error:
+            logger.error("Invalid additional backpacks: %s", error)
+            message = "Invalid additional backpacks"
+            self._rhapi.ui.message_notify(self._rhapi.language.__(message))
+            configured = []
+
+        current = {link.name: link for link in self._links[1:]}
+        primary = self._links[0]
+        extras = []
+        for type_, address in configured:
+            name = f"{type_.name.lower()}:{address}"
+            if name == primary.name or any(link.name == name for link, *_ in extras):
+                continue
+
+            link = current.pop(name, None) or self._create_link(name)
+            extras.append((link, type_, address))
+
+        for link in current.values():
+            if link.reconnector is not None:
+                link.reconnector.kill()
+            link.disconnect()
+            if link.receiver is not None:
+                link.receiver.kill()
+
+        self._links = [primary, *(link for link, *_ in extras)]
+        return extras
+
     def start_connection(self, *_) -> None:
         """
-        Starts the connection loop
+        Connects the configured backpacks that are not
+        connected yet
         """
-        if self._backpack_connected:
+        extras = self.configure_links()
+
+        if all(link.connected for link in self._links):
             message = "Backpack already connected"
             self._rhapi.ui.message_notify(self._rhapi.language.__(message))
             return
 
+        if not self._links[0].connected:
+            self._connect_primary(self._links[0])
+
+        for link, type_, address in extras:
+            if link.connected:
+                continue
+
+            if type_ == ConnectionTypeEnum.SOCKET:
+                try:
+                    ip_addr = socket.gethostbyname(address)
+                except OSError:
+                    logger.exception("Failed to resolve %s", address)
+                    message = "Attempt to establish backpack connection failed"
+                    self._notify_link(link, message)
+                    continue
+
+                self._establish_connection(link, type_.type_, ip_addr=ip_addr)
+            else:
+                self._establish_connection(link, type_.type_, port=address)
+
+    def _connect_primary(self, link: BackpackLink) -> None:
+        """
+        Connects the backpack of the connection settings
+
+        :param link: The link of the backpack
+        """
         id_ = self._rhapi.db.option("_conn_opt", None, as_int=True)
         for con in ConnectionTypeEnum:
             if id_ == con.id_:
@@ -92,8 +394,11 @@ class ELRSBackpack(VRxController):
             self._rhapi.ui.message_notify(self._rhapi.language.__(message))
             return
 
+        port = self._rhapi.db.option("_serial_port", None) or None
+
         if con == ConnectionTypeEnum.USB:
-            self._establish_connection(con.type_)
+            link.name = f"usb:{port or 'scan'}"
+            self._establish_connection(link, con.type_, port=port)
 
         elif con == ConnectionTypeEnum.ONBOARD:
 
@@ -108,7 +413,8 @@ class ELRSBackpack(VRxController):
                 gevent.sleep()
                 RH_GPIO.output(11, RH_GPIO.HIGH)
 
-                self._establish_connection(con.type_)
+                link.name = f"onboard:{port or 'scan'}"
+                self._establish_connection(link, con.type_, port=port)
 
             else:
                 message = "Instance not running on Raspberry Pi"
@@ -118,53 +424,138 @@ class ELRSBackpack(VRxController):
             addr = self._rhapi.db.option("_socket_ip", None)
             if addr is not None:
                 ip_addr = socket.gethostbyname(addr)
-                self._establish_connection(con.type_, ip_addr=ip_addr)
+                link.name = f"socket:{addr}"
+                self._establish_connection(link, con.type_, ip_addr=ip_addr)
             else:
                 message = "IP Address for socket not provided"
                 self._rhapi.ui.message_notify(self._rhapi.language.__(message))
 
     def _establish_connection(
-        self, connection_type: type[BackpackConnection], **kwargs
+        self, link: BackpackLink, connection_type: type[BackpackConnection], **kwargs
     ):
         """
         Setup the backpack connection
 
+        :param link: The link to connect
         :param connection_type: The type of connection to use
         """
         # Clear data in send queue
-        while not self._send_queue.empty():
-            self._send_queue.get()
+        if flushed := link.flush():
+            self.metrics.increment("packets_flushed", flushed)
+
+        if self._rhapi.db.option("_io_worker") == "1":
+            connection_type = functools.partial(
+                WorkerConnection, connection_type=connection_type
+            )
 
-        self._connection = connection_type(self._send_queue, self._recieve_queue)
-        if not self._connection.connect(**kwargs):
+        if not link.connect(connection_type, self._recorder, **kwargs):
             message = "Attempt to establish backpack connection failed"
-            self._rhapi.ui.message_notify(self._rhapi.language.__(message))
+            self._notify_link(link, message)
             return
 
         message = "Backpack sucessfully connected"
-        self._rhapi.ui.message_notify(self._rhapi.language.__(message))
+        self._notify_link(link, message)
+
+    def _notify_link(self, link: BackpackLink, message: str) -> None:
+        """
+        Notifies about a backpack, naming the backpack when
+        several are attached
+
+        :param link: The link of the backpack
+        :param message: The message
+        """
+        message = self._rhapi.language.__(message)
+        if len(self._links) > 1:
+            message = f"{message} ({link.name})"
+
+        self._rhapi.ui.message_notify(message)
+
+    def _osd_idle(self) -> bool:
+        """
+        Whether no OSD messages are waiting to be prepared
+
+        :return: Whether the scheduler is idle
+        """
+        return not self._scheduler.queue_depth
+
+    def _link_state_changed(self, link: BackpackLink, state: LinkState) -> None:
+        """
+        Reports changes of the link state found by the heartbeat.
+        Pilots of a dead link are sent through the remaining links
+        while the link is reconnected.
+
+        :param link: The link
+        :param state: The new state
+        """
+        if state == LinkState.DEGRADED:
+            logger.warning("Backpack %s missed a heartbeat", link.name)
+            return
+
+        if state == LinkState.DEAD:
+            message = "Backpack stopped responding"
+            logger.error("%s: %s", message, link.name)
+        else:
+            message = "Backpack responding again"
+            logger.info("%s: %s", message, link.name)
+
+        self._notify_link(link, message)
+
+        # Reconnecting stops the heartbeat that called this,
+        # so it runs in a greenlet of its own
+        if state == LinkState.DEAD and link.reconnector is None:
+            link.reconnector = gevent.spawn(self._reconnect, link)
+
+    def _reconnect(self, link: BackpackLink) -> None:
+        """
+        Reopens the connection of a link whose backpack
+        stopped responding. A backpack that is restarting may
+        take a while to show up again, so a few attempts are made.
+
+        :param link: The link
+        """
+        try:
+            for attempt in range(RECONNECT_ATTEMPTS):
+                if attempt:
+                    gevent.sleep(RECONNECT_DELAY)
 
-        self.version_request()
+                logger.info("Reconnecting backpack %s", link.name)
+                if flushed := link.flush():
+                    self.metrics.increment("packets_flushed", flushed)
 
-    def recieve_loop(self) -> None:
+                if link.reconnect(self._recorder):
+                    self._notify_link(link, "Backpack reconnected")
+                    return
+
+            message = "Attempt to reconnect backpack failed"
+            self._notify_link(link, message)
+        finally:
+            link.reconnector = None
+
+    def recieve_loop(self, link: BackpackLink) -> None:
         """
-        Handles recieving data from the backpack
+        Handles recieving data from a backpack
+
+        :param link: The link of the backpack
         """
         try:
             while True:
-                packet: MSPPacket = self._recieve_queue.get()
+                packet: MSPPacket = link.recieve_queue.get()
 
                 function_ = packet.function
 
                 if packet.type_ == MSPPacketType.RESPONSE:
 
                     if function_ == MSPTypes.MSP_ELRS_GET_BACKPACK_VERSION:
+                        link.heartbeat.response()
+
                         version = bytes(i for i in packet.payload if i != 0).decode(
                             "utf-8"
                         )
-                        message = f"Backpack device firmware version: {version}"
-                        logger.info(message)
-                        self._rhapi.ui.message_notify(self._rhapi.language.__(message))
+                        if version != link.version:
+                            link.version = version
+                            message = f"Backpack device firmware version: {version}"
+                            logger.info("%s (%s)", message, link.name)
+                            self._notify_link(link, message)
 
                 if packet.type_ == MSPPacketType.COMMAND:
 
@@ -180,19 +571,136 @@ class ELRSBackpack(VRxController):
 
     def disconnect(self, *_) -> None:
         """
-        Disconnect the connection loop
+        Disconnect the connection loops
         """
         if not self._backpack_connected:
             message = "Backpack not connected"
             self._rhapi.ui.message_notify(self._rhapi.language.__(message))
             return
 
-        assert self._connection is not None
-        self._connection.disconnect()
+        for link in self._links:
+            if link.reconnector is not None:
+                link.reconnector.kill()
+            if link.connected:
+                link.disconnect()
 
         message = "Backpack disconnected"
         self._rhapi.ui.message_notify(self._rhapi.language.__(message))
 
+    #
+    # Metrics
+    #
+
+    def get_metrics(self) -> dict:
+        """
+        Collects the metrics of the plugin and of the backpack
+        links. Counters of the links are kept across reconnects.
+
+        :return: The metrics of the plugin under `backpack` and
+            of each link by name under `links`
+        """
+        return {
+            "backpack": self.metrics.as_dict(),
+            "links": {link.name: link.metrics.as_dict() for link in self._links},
+        }
+
+    def show_metrics(self, *_) -> None:
+        """
+        Shows the current metrics as tables in the settings
+        panel, with a short summary as a notification
+        """
+        metrics = self.get_metrics()
+        lines = []
+        sections = {}
+        for name, link_metrics in metrics["links"].items():
+            prefix = f"{name} " if len(metrics["links"]) > 1 else ""
+            lines += format_metrics(link_metrics, prefix)
+            sections[f"Backpack {name}".strip()] = link_metrics
+
+        lines += format_metrics(metrics["backpack"])
+        sections["OSD"] = metrics["backpack"]
+        logger.info("Backpack metrics:\n%s", "\n".join(lines))
+
+        self._rhapi.ui.register_markdown(
+            "elrs_settings", "elrs_metrics", format_metrics_markdown(sections)
+        )
+        self._rhapi.ui.broadcast_ui("settings")
+
+        sent = sum(
+            link["counters"].get("packets_sent", 0)
+            for link in metrics["links"].values()
+        )
+        drops = sum(
+            link["counters"].get("drops", 0) for link in metrics["links"].values()
+        )
+        message = self._rhapi.language.__(
+            "Backpack metrics updated: {} packets sent, {} dropped connections"
+        ).format(sent, drops)
+        self._rhapi.ui.message_notify(message)
+
+    def start_profiler(self, *_) -> None:
+        """
+        Samples the plugin's greenlets for the configured duration
+        and writes the stacks to a file for a flamegraph
+        """
+        if self._profiler is not None and self._profiler.running:
+            message = "Backpack profiler already running"
+            self._rhapi.ui.message_notify(self._rhapi.language.__(message))
+            return
+
+        seconds = self._rhapi.db.option(
+            "_profile_seconds", DEFAULT_PROFILE_SECONDS, as_int=True
+        )
+        seconds = min(max(seconds, 1), MAX_PROFILE_SECONDS)
+        path = f"elrs_profile_{time.strftime('%Y%m%d_%H%M%S')}.folded"
+
+        self._profiler = StackSampler(path, seconds)
+        self._profiler.start()
+        gevent.spawn(self._finish_profiler, self._profiler)
+
+        message = f"Profiling backpack for {seconds} seconds"
+        logger.info(message)
+        self._rhapi.ui.message_notify(self._rhapi.language.__(message))
+
+    def _finish_profiler(self, profiler: StackSampler) -> None:
+        """
+        Writes the profile once sampling has ended
+
+        :param profiler: The running profiler
+        """
+        try:
+            samples = profiler.wait()
+        except OSError:
+            message = "Failed to write the backpack profile"
+            logger.exception(message)
+            self._rhapi.ui.message_notify(self._rhapi.language.__(message))
+            return
+
+        message = f"Backpack profile written to {profiler.path} ({samples} samples)"
+        logger.info(message)
+        self._rhapi.ui.message_notify(self._rhapi.language.__(message))
+
+    def prometheus_metrics(self) -> str:
+        """
+        Formats the metrics for Prometheus. Samples are labelled
+        with the timer's name and the backpack link, so several
+        timers and backpacks can share one dashboard.
+
+        :return: The metrics in the Prometheus text format
+        """
+        metrics = self.get_metrics()
+        labels = {"timer": str(self._rhapi.db.option("timerName", None) or "")}
+        lines = format_prometheus([(metrics["backpack"], labels)], "elrs_backpack_")
+        lines += format_prometheus(
+            [
+                (link_metrics, {**labels, "link": name})
+                for name, link_metrics in metrics["links"].items()
+            ],
+            "elrs_link_",
+        )
+
+        return "\n".join(lines) + "\n"
+
     #
     # Packet creation
     #
@@ -220,12 +728,17 @@ class ELRSBackpack(VRxController):
         """
         Get the uid for a pilot. If a bindphrase is not
         saved as an attribute, the pilot callsign is used
-        to generate the uid.
+        to generate the uid. Uids are cached until the
+        pilot is altered or the database changes.
 
         :param pilot_id: The pilot id
         :return: The pilot uid
         """
         assert pilot_id > 0, "Can not generate backpack uid for invalid pilot"
+
+        if (uid := self._pilot_uids.get(pilot_id)) is not None:
+            return uid
+
         bindphrase = self._rhapi.db.pilot_attribute_value(pilot_id, "comm_elrs")
         if bindphrase:
             uid = self.hash_phrase(bindphrase)
@@ -234,6 +747,7 @@ class ELRSBackpack(VRxController):
             assert pilot is not None, "Pilot not in database"
             uid = self.hash_phrase(pilot.callsign)
 
+        self._pilot_uids[pilot_id] = uid
         return uid
 
     def center_osd(self, len_: int) -> int:
@@ -245,27 +759,75 @@ class ELRSBackpack(VRxController):
         :param len_: The length of the string
         :return:
         """
-        offset = len_ // 2
-        col = 50 // 2 - offset
-        return max(col, 0)
+        return center_column(len_)
 
     def send_msp(self, msp: MSPPacket) -> None:
         """
         Sends a MSP packet to the backpack connection
-        if it is active
+        if it is active. Packets follow the link of the
+        last send uid; other packets go to the first
+        healthy link.
 
         :param msp: _description_
         """
-        if self._backpack_connected:
-            self._send_queue.put(msp)
+        self._queue_packet(self._route or self._default_link(), msp)
+
+    def _queue_packet(self, link: BackpackLink, msp: MSPPacket) -> None:
+        """
+        Queues a MSP packet on a link if it is connected
+
+        :param link: The link
+        :param msp: The packet
+        """
+        if link.connected:
+            link.send_queue.put(msp)
+            self.metrics.increment("packets_queued")
+            if (transaction := current_transaction()) is not None:
+                transaction.mark_queued(link.send_queue)
+        else:
+            self.metrics.increment("packets_discarded")
+
+    def _default_link(self) -> BackpackLink:
+        """
+        The link used for packets without a send uid, such as
+        those for the timer's own backpack and bound goggles
+
+        :return: The first healthy link, else the first connected link
+        """
+        for link in self._links:
+            if link.healthy:
+                return link
+
+        for link in self._links:
+            if link.connected:
+                return link
+
+        return self._links[0]
+
+    def _link_for(self, uid: bytes) -> BackpackLink:
+        """
+        The link a pilot's packets are sent through
+
+        :param uid: The pilot's uid
+        :return: The link
+        """
+        healthy = [link for link in self._links if link.healthy]
+        return link_for_uid(uid, healthy) or self._default_link()
 
     def set_send_uid(self, address: bytes) -> None:
         """
         Sends the packet to set the address for the
-        recipient of future packets
+        recipient of future packets. The connection only
+        writes it when the address on the backpack changes.
+        It also picks the link the recipient's packets are
+        sent through.
 
         :param address: Address to set
         """
+        self._route = self._link_for(address)
+        if all(link is not self._route for link in self._routed):
+            self._routed.append(self._route)
+
         packet = MSPPacket()
         packet.set_function(MSPTypes.MSP_ELRS_SET_SEND_UID)
         payload = bytearray()
@@ -277,58 +839,158 @@ class ELRSBackpack(VRxController):
     def reset_send_uid(self) -> None:
         """
         Sends the packet to reset the packet recipient
-        to the system default
+        to the system default on every link used since
+        the last reset. The connection only writes it when
+        a later packet requires the default address.
         """
         packet = MSPPacket()
         packet.set_function(MSPTypes.MSP_ELRS_SET_SEND_UID)
         payload = bytearray()
         payload.append(0x00)
         packet.set_payload(payload)
-        self.send_msp(packet)
 
-    def send_clear_osd(self) -> None:
+        routed = self._routed or [self._default_link()]
+        for link in routed:
+            self._queue_packet(link, packet)
+
+        self._route = None
+        self._routed = []
+
+    def send_group(self, uids: Sequence[bytes], packets: Sequence[MSPPacket]) -> None:
         """
-        Sends the packet to clear the goggle's osd
+        Sends the same packets to each of the recipients as
+        one burst. The packets are only encoded once; only
+        the send uid changes between recipients.
+
+        :param uids: The uids of the recipients
+        :param packets: The packets to send to each recipient
+        """
+        with self._queue_lock:
+            for uid in uids:
+                self.set_send_uid(uid)
+                for packet in packets:
+                    self.send_msp(packet)
+
+            self.reset_send_uid()
+
+    def clear_osd_packet(self) -> MSPPacket:
+        """
+        Creates the packet to clear the goggle's osd
+
+        :return: The packet
         """
         packet = MSPPacket()
         packet.set_function(MSPTypes.MSP_ELRS_SET_OSD)
         payload = bytearray()
         payload.append(0x02)
         packet.set_payload(payload)
-        self.send_msp(packet)
+        return packet
 
-    def send_osd_text(self, row: int, col: int, text: str) -> None:
+    def osd_text_packet(self, row: int, col: int, text: str) -> MSPPacket:
         """
-        Sends a packet that provides text data to the
-        recipient. This does not display the text to the
-        recipient until `send_display_osd` is called
+        Creates a packet that provides text data to the
+        recipient
 
         :param row: The row to display the text on
-        :param col: The column to place the start of the
-        :param message: _description_
+        :param col: The column to place the start of the text
+        :param text: The text to display
+        :return: The packet
         """
-        payload = bytearray((0x03, row, col, 0))
-        for index, char in enumerate(text):
-            if index >= 50:
-                break
+        return self._osd_row_packet(row, col, encode_text(text))
+
+    def centered_text_packet(self, row: int, text: str) -> MSPPacket:
+        """
+        Creates a packet that provides text data to the
+        recipient, centered on the row
+
+        :param row: The row to display the text on
+        :param text: The text to display
+        :return: The packet
+        """
+        return self._osd_row_packet(row, *encode_centered_text(text))
+
+    def text_packet(self, text: OSDText) -> MSPPacket:
+        """
+        Creates a packet that provides rendered layout
+        text to the recipient
+
+        :param text: The rendered text
+        :return: The packet
+        """
+        return self._osd_row_packet(*text)
 
-            payload.append(ord(char))
+    def _osd_row_packet(self, row: int, col: int, data: bytes) -> MSPPacket:
+        """
+        Creates a packet that writes encoded text to a row
 
+        :param row: The row to write to
+        :param col: The column to place the start of the text
+        :param data: The encoded text
+        :return: The packet
+        """
         packet = MSPPacket()
         packet.set_function(MSPTypes.MSP_ELRS_SET_OSD)
-        packet.set_payload(payload)
-        self.send_msp(packet)
+        packet.set_payload(bytes((0x03, row, col, 0)) + data)
+        return packet
 
-    def send_display_osd(self) -> None:
+    def display_osd_packet(self) -> MSPPacket:
         """
-        Sends a packet that informs the recipient
+        Creates a packet that informs the recipient
         to display any provided text
+
+        :return: The packet
         """
         packet = MSPPacket()
         packet.set_function(MSPTypes.MSP_ELRS_SET_OSD)
         payload = bytearray((0x04,))
         packet.set_payload(payload)
-        self.send_msp(packet)
+        return packet
+
+    def clear_osd_row_packet(self, row: int) -> MSPPacket:
+        """
+        Creates a packet that clears the text data
+        in a specific row
+
+        :param row: The row to remove text from
+        :return: The packet
+        """
+        return self._osd_row_packet(row, 0, bytes(OSD_COLUMNS))
+
+    def send_clear_osd(self) -> None:
+        """
+        Sends the packet to clear the goggle's osd
+        """
+        self.send_msp(self.clear_osd_packet())
+
+    def send_osd_text(self, row: int, col: int, text: str) -> None:
+        """
+        Sends a packet that provides text data to the
+        recipient. This does not display the text to the
+        recipient until `send_display_osd` is called
+
+        :param row: The row to display the text on
+        :param col: The column to place the start of the text
+        :param text: The text to display
+        """
+        self.send_msp(self.osd_text_packet(row, col, text))
+
+    def send_centered_osd_text(self, row: int, text: str) -> None:
+        """
+        Sends a packet that provides text data to the
+        recipient, centered on the row. This does not display
+        the text to the recipient until `send_display_osd` is called
+
+        :param row: The row to display the text on
+        :param text: The text to display
+        """
+        self.send_msp(self.centered_text_packet(row, text))
+
+    def send_display_osd(self) -> None:
+        """
+        Sends a packet that informs the recipient
+        to display any provided text
+        """
+        self.send_msp(self.display_osd_packet())
 
     def send_clear_osd_row(self, row: int) -> None:
         """
@@ -338,14 +1000,7 @@ class ELRSBackpack(VRxController):
 
         :param row: The row to remove text from
         """
-        payload = bytearray((0x03, row, 0, 0))
-        for _ in range(50):
-            payload.append(0)
-
-        packet = MSPPacket()
-        packet.set_function(MSPTypes.MSP_ELRS_SET_OSD)
-        packet.set_payload(payload)
-        self.send_msp(packet)
+        self.send_msp(self.clear_osd_row_packet(row))
 
     def version_request(self):
         """
@@ -385,60 +1040,198 @@ class ELRSBackpack(VRxController):
         self.send_msp(packet)
 
     #
-    # Field Tests
+    # OSD row ownership
     #
 
-    def test_bind_osd(self, *_):
-        """
-        A test for checking the connection of the pilot
-        bound to the timer backpack
+    def _claim_row(self, uid: bytes, row: int) -> int:
         """
+        Marks a row of the pilot's OSD as owned by a new message
+        generation. Any pending expiry of the previous owner is
+        cancelled so it can not clear the newer message.
 
-        def test():
-            self._queue_lock.acquire()
-            text = "ROTORHAZARD"
-            for row in range(18):
-
-                self.send_clear_osd()
-                start_col = self.center_osd(len(text))
-                self.send_osd_text(row, start_col, text)
-                self.send_display_osd()
+        :param uid: The uid of the pilot
+        :param row: The row being written to
+        :return: The generation now owning the row
+        """
+        key = (bytes(uid), row)
+        generation = next(self._generations)
+        self._row_owners[key] = generation
 
-                gevent.sleep(0.5)
+        if (expiry := self._row_expiries.pop(key, None)) is not None:
+            expiry.cancel()
 
-                self.send_clear_osd_row(row)
-                self.send_display_osd()
+        return generation
 
-            gevent.sleep(1)
-            self.send_clear_osd()
-            self.send_display_osd()
-            self._queue_lock.release()
+    def _claim_screen(self, uid: bytes) -> None:
+        """
+        Releases every row of the pilot's OSD, cancelling all
+        pending expiries. Used when the full OSD is cleared.
 
-        gevent.spawn(test)
+        :param uid: The uid of the pilot
+        """
+        uid = bytes(uid)
+        for key in [key for key in self._row_owners if key[0] == uid]:
+            del self._row_owners[key]
 
-    #
-    # VRxC Event Triggers
-    #
+        for key in [key for key in self._row_expiries if key[0] == uid]:
+            self._row_expiries.pop(key).cancel()
 
-    def pilot_alter(self, args: dict) -> None:
+    def _expire_row(self, uid: bytes, row: int, generation: int, delay: float) -> None:
         """
-        Logs the uid change of the pilot
+        Schedules the row to be cleared after the delay if the
+        generation still owns it at that time
 
-        :param args: _description_
+        :param uid: The uid of the pilot
+        :param row: The row to clear
+        :param generation: The generation that wrote the row
+        :param delay: Seconds to wait before clearing
         """
-        pilot_id = args["pilot_id"]
-        uid = self.get_pilot_uid(pilot_id)
-        uid_formated = ".".join([str(int.from_bytes((byte,))) for byte in uid])
-        logger.info("Pilot %s's UID set to %s", pilot_id, uid_formated)
+        key = (bytes(uid), row)
+        if self._row_owners.get(key) != generation:
+            return
 
-    def onRaceStage(self, args) -> None:
+        self._row_expiries[key] = self._scheduler.submit_later(
+            delay, self._clear_owned_row, key, generation, critical=True
+        )
+
+    def _clear_owned_row(self, key: tuple[bytes, int], generation: int) -> None:
         """
-        _summary_
+        Clears the row if it is still owned by the generation.
+        Stale clears are dropped before reaching the send queue.
 
-        :param args: _description_
+        :param key: The uid and row of the pilot's OSD
+        :param generation: The generation that scheduled the clear
         """
-        if not self._backpack_connected:
-            return
+        with self._queue_lock:
+            if self._row_owners.get(key) != generation:
+                return
+
+            del self._row_owners[key]
+            self._row_expiries.pop(key, None)
+
+            uid, row = key
+            self.set_send_uid(uid)
+            self.send_clear_osd_row(row)
+            self.send_display_osd()
+            self.reset_send_uid()
+
+    #
+    # Critical messages
+    #
+
+    def _repeat_critical(
+        self,
+        owners: list[tuple[bytes, int]],
+        row: int,
+        packets: Sequence[MSPPacket],
+    ) -> None:
+        """
+        Schedules repeats of a critical message, as delivery from
+        the backpack to the goggles is best effort. Repeats are
+        spaced with jitter so they do not share the fate of a
+        lost frame.
+
+        :param owners: The uid of each recipient and the generation that wrote the row
+        :param row: The row of the message
+        :param packets: The packets repeated to each recipient
+        """
+        repeats = self._rhapi.db.option(
+            "_critical_repeats", DEFAULT_CRITICAL_REPEATS, as_int=True
+        )
+        delay = 0.0
+        for _ in range(min(max(repeats, 0), MAX_CRITICAL_REPEATS)):
+            jitter = random.uniform(-CRITICAL_REPEAT_JITTER, CRITICAL_REPEAT_JITTER)
+            delay += CRITICAL_REPEAT_SPACING * (1 + jitter)
+            self._scheduler.submit_later(
+                delay,
+                self._send_critical_repeat,
+                owners,
+                row,
+                packets,
+                critical=True,
+            )
+
+    def _send_critical_repeat(
+        self,
+        owners: list[tuple[bytes, int]],
+        row: int,
+        packets: Sequence[MSPPacket],
+    ) -> None:
+        """
+        Repeats a critical message to the recipients whose row
+        still shows it. Recipients that received a newer message
+        on the row, or whose row was cleared, are skipped.
+
+        :param owners: The uid of each recipient and the generation that wrote the row
+        :param row: The row of the message
+        :param packets: The packets repeated to each recipient
+        """
+        with self._queue_lock:
+            uids = [
+                uid
+                for uid, generation in owners
+                if self._row_owners.get((bytes(uid), row)) == generation
+            ]
+            self.metrics.increment("critical_coalesced", len(owners) - len(uids))
+
+            if uids and self._backpack_connected:
+                self.metrics.increment("critical_repeats")
+                self.send_group(uids, packets)
+
+    #
+    # OSD layout
+    #
+
+    def _get_layout(self) -> OSDLayout:
+        """
+        Gets the OSD layout, compiling it from the plugin's
+        settings if they have changed
+
+        :return: The compiled layout
+        """
+        if self._layout is not None:
+            return self._layout
+
+        rows = {option: self._rhapi.db.option(option) for option in ROW_OPTIONS}
+        constants = {
+            name: self._rhapi.db.option(option)
+            for name, option in MESSAGE_OPTIONS.items()
+        }
+        constants["round_label"] = self._rhapi.__("Round").upper()
+
+        overrides = None
+        if custom := self._rhapi.db.option("_osd_layout", None):
+            try:
+                overrides = json.loads(custom)
+            except json.JSONDecodeError:
+                logger.warning("Custom OSD layout is not valid JSON")
+
+            if not isinstance(overrides, dict):
+                overrides = None
+
+        self._layout = OSDLayout(rows, constants, overrides)
+        return self._layout
+
+    #
+    # Stage precomputation
+    #
+
+    def _build_stage_frames(self, heat_id: int) -> StageFrames:
+        """
+        Builds the OSD frames shown to pilots when the heat
+        is staged, along with the uids of the active pilots
+        in the seats of the current race
+
+        :param heat_id: The id of the heat
+        :return: The stage frames
+        """
+        pilots = dict(self._rhapi.race.pilots)
+        uids = [
+            self.get_pilot_uid(pilot_id)
+            for pilot_id in pilots.values()
+            if pilot_id
+            and self._rhapi.db.pilot_attribute_value(pilot_id, "elrs_active") == "1"
+        ]
 
         use_heat_name = self._rhapi.db.option("_heat_name") == "1"
         use_round_num = self._rhapi.db.option("_round_num") == "1"
@@ -446,11 +1239,11 @@ class ELRSBackpack(VRxController):
         use_event_name = self._rhapi.db.option("_event_name") == "1"
 
         # Pull heat name and rounds
-        heat_data = self._rhapi.db.heat_by_id(args["heat_id"])
+        heat_data = self._rhapi.db.heat_by_id(heat_id)
         if heat_data:
             class_id = heat_data.class_id
             heat_name = heat_data.display_name
-            round_num = self._rhapi.db.heat_max_round(args["heat_id"]) + 1
+            round_num = self._rhapi.db.heat_max_round(heat_id) + 1
         else:
             class_id = None
             heat_name = None
@@ -464,150 +1257,303 @@ class ELRSBackpack(VRxController):
             raceclass = None
             class_name = None
 
+        layout = self._get_layout()
+        texts = [layout.render("stage", "status")]
+
         # Generate heat message
-        heat_name_row = self._rhapi.db.option("_heatname_row")
         if all([use_heat_name, use_round_num, heat_name, round_num]):
-            round_trans = self._rhapi.__("Round")
-            heat_message = (
-                f"x {heat_name.upper()} | {round_trans.upper()} {round_num} w"
+            texts.append(
+                layout.render("stage", "heat_round", heat=heat_name, round=round_num)
             )
-            heat_start_col = self.center_osd(len(heat_message))
-            heat_message_parms = (heat_name_row, heat_start_col, heat_message)
         elif use_heat_name and heat_name:
-            heat_message = f"x {heat_name.upper()} w"
-            heat_start_col = self.center_osd(len(heat_message))
-            heat_message_parms = (heat_name_row, heat_start_col, heat_message)
-        else:
-            heat_message_parms = None
+            texts.append(layout.render("stage", "heat", heat=heat_name))
 
         # Generate class message
-        class_name_row = self._rhapi.db.option("_classname_row")
         if use_class_name and class_name:
-            class_message = f"x {class_name.upper()} w"
-            class_start_col = self.center_osd(len(class_message))
-            class_message_parms = (class_name_row, class_start_col, class_message)
+            texts.append(layout.render("stage", "class", raceclass=class_name))
 
         # Generate event message
-        event_name_row = self._rhapi.db.option("_eventname_row")
         event_name = self._rhapi.db.option("eventName")
         if use_event_name and event_name:
-            event_name = self._rhapi.db.option("eventName")
-            event_message = heat_message = f"x {event_name.upper()} w"
-            event_start_col = self.center_osd(len(heat_message))
-            event_message_parms = (event_name_row, event_start_col, event_message)
-
-        start_col = self.center_osd(len(self._rhapi.db.option("_racestage_message")))
-        stage_mesage = (
-            self._rhapi.db.option("_status_row"),
-            start_col,
-            self._rhapi.db.option("_racestage_message"),
+            texts.append(layout.render("stage", "event", event=event_name))
+
+        packets = [self.clear_osd_packet()]
+        for text in texts:
+            packets.append(self.text_packet(text))
+        packets.append(self.display_osd_packet())
+
+        # Encode ahead of time so staging only queues the frames
+        for packet in packets:
+            packet.get_packet()
+
+        rows = [text.row for text in texts]
+        return StageFrames(heat_id, pilots, uids, rows, tuple(packets))
+
+    def refresh_stage_frames(self, *_) -> None:
+        """
+        Precomputes the stage frames for the currently selected heat.
+        While no backpack is connected the frames are only discarded,
+        to be built when a race is staged.
+        """
+        if not self._backpack_connected:
+            self._stage_frames = None
+            return
+
+        self._stage_frames = self._build_stage_frames(self._rhapi.race.heat)
+
+    #
+    # Race start staging
+    #
+
+    def _stage_start(self, uids: list[bytes]) -> None:
+        """
+        Builds the race start frames for the pilots and holds
+        them until the race starts
+
+        :param uids: The uids of the pilots
+        """
+        text = self._get_layout().render("racing", "start")
+
+        text_packet = self.text_packet(text)
+        display_packet = self.display_osd_packet()
+        packets = (self.clear_osd_packet(), text_packet, display_packet)
+
+        # Repeats only rewrite the start row, so rows written
+        # since the start are not cleared again
+        repeat_packets = (
+            self.clear_osd_row_packet(text.row),
+            text_packet,
+            display_packet,
+        )
+        uptime = self._rhapi.db.option("_racestart_uptime") * 1e-1
+        self._staged_start = StagedStart(
+            uids, packets, repeat_packets, text.row, uptime
         )
 
-        # Send stage message to all pilots
-        def arm(pilot_id):
-            uid = self.get_pilot_uid(pilot_id)
-            with self._queue_lock:
-                self.set_send_uid(uid)
-                self.send_clear_osd()
+    def _cancel_staged_start(self) -> None:
+        """
+        Discards any staged race start frames
+        """
+        self._staged_start = None
 
-                # Send messages to backpack
-                self.send_osd_text(*stage_mesage)
-                if use_heat_name and heat_name:
-                    assert heat_message_parms is not None
-                    self.send_osd_text(*heat_message_parms)
-                if use_class_name and class_name:
-                    self.send_osd_text(*class_message_parms)
-                if use_event_name and event_name:
-                    self.send_osd_text(*event_message_parms)
+        if self._start_timer is not None:
+            if self._start_timer is not gevent.getcurrent():
+                self._start_timer.kill(block=False)
+            self._start_timer = None
 
-                self.send_display_osd()
-                self.reset_send_uid()
+    @traced("race_start")
+    def _flush_start(self) -> None:
+        """
+        Writes the staged race start frames to all pilots
+        as a single burst
+        """
+        staged = self._staged_start
+        self._cancel_staged_start()
 
-        seat_pilots = self._rhapi.race.pilots
-        for seat in seat_pilots:
-            if (
-                seat_pilots[seat]
-                and self._rhapi.db.pilot_attribute_value(
-                    seat_pilots[seat], "elrs_active"
-                )
-                == "1"
-            ):
-                gevent.spawn(arm, seat_pilots[seat])
+        if staged is None or not self._backpack_connected:
+            return
 
-    def onRaceStart(self, *_) -> None:
-        if not self._backpack_connected:
+        self._start_sent = True
+
+        with self._queue_lock:
+            generations = []
+            for uid in staged.uids:
+                self._claim_screen(uid)
+                generations.append(self._claim_row(uid, staged.status_row))
+
+            self.send_group(staged.uids, staged.packets)
+
+        owners = list(zip(staged.uids, generations))
+        for uid, generation in owners:
+            self._expire_row(uid, staged.status_row, generation, staged.uptime)
+
+        self._repeat_critical(owners, staged.status_row, staged.repeat_packets)
+
+    #
+    # Field Tests
+    #
+
+    def test_bind_osd(self, *_):
+        """
+        A test for checking the connection of the pilot
+        bound to the timer backpack. Each row of the sweep
+        is sent as its own short job, so race traffic is
+        never blocked while the test runs.
+        """
+        first = self._rhapi.db.option("_test_first_row", None, as_int=True) or 0
+        last = self._rhapi.db.option("_test_last_row", None, as_int=True)
+        if last is None:
+            last = OSD_ROWS - 1
+
+        first = min(max(first, 0), OSD_ROWS - 1)
+        last = min(max(last, 0), OSD_ROWS - 1)
+        step = 1 if last >= first else -1
+        rows = tuple(range(first, last + step, step))
+
+        # Starting a new test cancels any sweep still running
+        self._field_test = next(self._generations)
+        self._scheduler.submit(self._field_test_frame, self._field_test, rows, 0)
+
+    def _field_test_frame(self, test_id: int, rows: Sequence[int], index: int) -> None:
+        """
+        Sends one frame of the OSD field test and schedules the next.
+        Frames are deferred while race jobs are waiting for a worker.
+
+        :param test_id: The test the frame belongs to
+        :param rows: The rows of the sweep
+        :param index: The position of the frame in the sweep
+        """
+        if test_id != self._field_test:
             return
 
-        def start(pilot_id):
-            uid = self.get_pilot_uid(pilot_id)
-            start_col = self.center_osd(
-                len(self._rhapi.db.option("_racestart_message"))
+        if self._scheduler.queue_depth:
+            self._scheduler.submit_later(
+                FIELD_TEST_BACKOFF, self._field_test_frame, test_id, rows, index
             )
+            return
 
-            self._queue_lock.acquire()
-            self.set_send_uid(uid)
+        with self._queue_lock:
+            self.reset_send_uid()
+            if index > 0:
+                self.send_clear_osd_row(rows[index - 1])
+            if index < len(rows):
+                self.send_centered_osd_text(rows[index], "ROTORHAZARD")
+            self.send_display_osd()
 
-            self.send_clear_osd()
+        if index < len(rows):
+            delay = FIELD_TEST_INTERVAL
+            if index == len(rows) - 1:
+                delay += FIELD_TEST_HOLD
 
-            self.send_osd_text(
-                self._rhapi.db.option("_status_row"),
-                start_col,
-                self._rhapi.db.option("_racestart_message"),
+            self._scheduler.submit_later(
+                delay, self._field_test_frame, test_id, rows, index + 1
             )
-            self.send_display_osd()
-            self.reset_send_uid()
-            self._queue_lock.release()
 
-            gevent.sleep(self._rhapi.db.option("_racestart_uptime") * 1e-1)
+    #
+    # VRxC Event Triggers
+    #
 
-            self._queue_lock.acquire()
-            self.set_send_uid(uid)
-            self.send_clear_osd_row(self._rhapi.db.option("_status_row"))
-            self.send_display_osd()
-            self.reset_send_uid()
-            self._queue_lock.release()
+    def pilot_alter(self, args: dict) -> None:
+        """
+        Logs the uid change of the pilot and rebuilds the
+        stage frames, as the pilot may have been activated
+        or deactivated
 
-        seat_pilots = self._rhapi.race.pilots
-        for seat in seat_pilots:
-            if (
-                seat_pilots[seat]
-                and self._rhapi.db.pilot_attribute_value(
-                    seat_pilots[seat], "elrs_active"
-                )
-                == "1"
-            ):
-                gevent.spawn(start, seat_pilots[seat])
+        :param args: _description_
+        """
+        pilot_id = args["pilot_id"]
+        self._pilot_uids.pop(pilot_id, None)
+        uid = self.get_pilot_uid(pilot_id)
+        uid_formated = ".".join([str(int.from_bytes((byte,))) for byte in uid])
+        logger.info("Pilot %s's UID set to %s", pilot_id, uid_formated)
+
+        self.refresh_stage_frames()
+
+    def clear_pilot_caches(self, *_) -> None:
+        """
+        Discards the cached pilot uids and stage frames when
+        pilots are deleted or the database is replaced, as the
+        ids of removed pilots can be reused
+        """
+        self._pilot_uids.clear()
+        self._stage_frames = None
 
+    @traced("race_stage")
+    def onRaceStage(self, args) -> None:
+        """
+        _summary_
+
+        :param args: _description_
+        """
+        # Reset the state of the previous race even without a backpack,
+        # so a backpack connected before the start still gets the start
+        self._lap_states.clear()
+        self._cancel_staged_start()
+        self._start_sent = False
+
+        if not self._backpack_connected:
+            return
+
+        # Frames are normally prepared when the heat is set, so
+        # staging does not need to look anything up in the database
+        frames = self._stage_frames
+        if (
+            frames is None
+            or frames.heat_id != args["heat_id"]
+            or frames.pilots != self._rhapi.race.pilots
+        ):
+            frames = self._stage_frames = self._build_stage_frames(args["heat_id"])
+
+        if uids := frames.uids:
+            # Send stage message to all pilots
+            with self._queue_lock:
+                for uid in uids:
+                    self._claim_screen(uid)
+                    for row in frames.rows:
+                        self._claim_row(uid, row)
+
+                self.send_group(uids, frames.packets)
+
+            self._stage_start(uids)
+
+            # Optionally send the start frames at the scheduled start time
+            starts_at = args.get("pi_starts_at_s")
+            if self._rhapi.db.option("_timed_start") == "1" and starts_at is not None:
+                delay = max(starts_at - time.monotonic(), 0)
+                self._start_timer = gevent.spawn_later(delay, self._flush_start)
+
+    @traced("race_start")
+    def onRaceStart(self, *_) -> None:
+        if not self._backpack_connected:
+            return
+
+        if self._start_sent:
+            return
+
+        # Frames are normally prepared while the race is staging
+        if self._staged_start is None:
+            pilot_ids = []
+            seat_pilots = self._rhapi.race.pilots
+            for seat in seat_pilots:
+                if (
+                    seat_pilots[seat]
+                    and self._rhapi.db.pilot_attribute_value(
+                        seat_pilots[seat], "elrs_active"
+                    )
+                    == "1"
+                ):
+                    pilot_ids.append(seat_pilots[seat])
+
+            if not pilot_ids:
+                return
+
+            self._stage_start([self.get_pilot_uid(pilot_id) for pilot_id in pilot_ids])
+
+        self._flush_start()
+
+    @traced("race_finish")
     def onRaceFinish(self, *_) -> None:
         if not self._backpack_connected:
             return
 
         def finish(pilot_id):
             uid = self.get_pilot_uid(pilot_id)
-            start_col = self.center_osd(
-                len(self._rhapi.db.option("_racefinish_message"))
-            )
+            text = self._get_layout().render("racing", "finish")
 
-            self._queue_lock.acquire()
-            self.set_send_uid(uid)
-            self.send_clear_osd_row(self._rhapi.db.option("_status_row"))
-            self.send_osd_text(
-                self._rhapi.db.option("_status_row"),
-                start_col,
-                self._rhapi.db.option("_racefinish_message"),
-            )
-            self.send_display_osd()
-            self.reset_send_uid()
-            self._queue_lock.release()
-
-            gevent.sleep(self._rhapi.db.option("_finish_uptime") * 1e-1)
+            with self._queue_lock:
+                generation = self._claim_row(uid, text.row)
+                self.set_send_uid(uid)
+                self.send_clear_osd_row(text.row)
+                self.send_msp(self.text_packet(text))
+                self.send_display_osd()
+                self.reset_send_uid()
 
-            self._queue_lock.acquire()
-            self.set_send_uid(uid)
-            self.send_clear_osd_row(self._rhapi.db.option("_status_row"))
-            self.send_display_osd()
-            self.reset_send_uid()
-            self._queue_lock.release()
+            self._expire_row(
+                uid,
+                text.row,
+                generation,
+                self._rhapi.db.option("_finish_uptime") * 1e-1,
+            )
 
         seat_pilots = self._rhapi.race.pilots
         seats_finished = self._rhapi.race.seats_finished
@@ -621,27 +1567,28 @@ class ELRSBackpack(VRxController):
                 == "1"
             ):
                 if not seats_finished[seat]:
-                    gevent.spawn(finish, seat_pilots[seat])
+                    self._scheduler.submit(finish, seat_pilots[seat], critical=True)
 
+    @traced("race_stop")
     def onRaceStop(self, *_) -> None:
+        self._cancel_staged_start()
+
         if not self._backpack_connected:
             return
 
-        def land(pilot_id):
-            uid = self.get_pilot_uid(pilot_id)
-            start_col = self.center_osd(len(self._rhapi.db.option("_racestop_message")))
+        def land(pilot_ids):
+            uids = [self.get_pilot_uid(pilot_id) for pilot_id in pilot_ids]
+            text = self._get_layout().render("racing", "stop")
 
-            self._queue_lock.acquire()
-            self.set_send_uid(uid)
-            self.send_osd_text(
-                self._rhapi.db.option("_status_row"),
-                start_col,
-                self._rhapi.db.option("_racestop_message"),
-            )
-            self.send_display_osd()
-            self.reset_send_uid()
-            self._queue_lock.release()
+            packets = (self.text_packet(text), self.display_osd_packet())
+
+            with self._queue_lock:
+                generations = [self._claim_row(uid, text.row) for uid in uids]
+                self.send_group(uids, packets)
 
+            self._repeat_critical(list(zip(uids, generations)), text.row, packets)
+
+        pilot_ids = []
         seat_pilots = self._rhapi.race.pilots
         seats_finished = self._rhapi.race.seats_finished
 
@@ -654,8 +1601,12 @@ class ELRSBackpack(VRxController):
                 == "1"
             ):
                 if not seats_finished[seat]:
-                    gevent.spawn(land, seat_pilots[seat])
+                    pilot_ids.append(seat_pilots[seat])
+
+        if pilot_ids:
+            self._scheduler.submit(land, pilot_ids, critical=True)
 
+    @traced("lap_recorded")
     def onRaceLapRecorded(self, args: dict) -> None:
         if not self._backpack_connected:
             return
@@ -663,118 +1614,126 @@ class ELRSBackpack(VRxController):
         def update_pos(result):
             pilot_id = result["pilot_id"]
 
+            layout = self._get_layout()
             if self._rhapi.db.option("_position_mode") != "1":
-                message = f"LAP: {result['laps'] + 1}"
+                text = layout.render("racing", "lap", lap=result["laps"] + 1)
             else:
-                message = f"POSN: {str(result['position']).upper()} | LAP: {result['laps'] + 1}"
-            start_col = self.center_osd(len(message))
+                text = layout.render(
+                    "racing",
+                    "position",
+                    position=result["position"],
+                    lap=result["laps"] + 1,
+                )
 
             uid = self.get_pilot_uid(pilot_id)
-            self._queue_lock.acquire()
-            self.set_send_uid(uid)
-            self.send_clear_osd_row(self._rhapi.db.option("_currentlap_row"))
+            with self._queue_lock:
+                self._claim_row(uid, text.row)
+                self.set_send_uid(uid)
+                self.send_clear_osd_row(text.row)
 
-            self.send_osd_text(
-                self._rhapi.db.option("_currentlap_row"), start_col, message
-            )
-            self.send_display_osd()
-            self.reset_send_uid()
-            self._queue_lock.release()
+                self.send_msp(self.text_packet(text))
+                self.send_display_osd()
+                self.reset_send_uid()
 
         def lap_results(result, gap_info):
             pilot_id = result["pilot_id"]
 
-            message = ""
+            layout = self._get_layout()
+            current = gap_info.current
+
+            text = None
             if self._rhapi.db.option("_gap_mode") != "1":
                 if gap_info.race.win_condition == WinCondition.FASTEST_CONSECUTIVE:
-                    formatted_time1 = self._rhapi.utils.format_split_time_to_str(
-                        gap_info.current.last_lap_time, "{m}:{s}.{d}"
+                    text = layout.render(
+                        "racing",
+                        "consecutive",
+                        lap_time=format_split_time(current.last_lap_time),
+                        consecutives_base=current.consecutives_base,
+                        consecutives=format_split_time(current.consecutives),
                     )
-                    formatted_time2 = self._rhapi.utils.format_split_time_to_str(
-                        gap_info.current.consecutives, "{m}:{s}.{d}"
-                    )
-                    message = f"x {formatted_time1} | {gap_info.current.consecutives_base}/{formatted_time2} w"
                 elif (
                     gap_info.race.win_condition == WinCondition.FASTEST_LAP
-                    and gap_info.current.is_best
+                    and current.is_best
                 ):
-                    formatted_time = self._rhapi.utils.format_split_time_to_str(
-                        gap_info.current.last_lap_time, "{m}:{s}.{d}"
+                    text = layout.render(
+                        "racing",
+                        "best_lap",
+                        lap_time=format_split_time(current.last_lap_time),
                     )
-                    message = f"x BEST LAP | {formatted_time} w"
                 else:
-                    formatted_time1 = self._rhapi.utils.format_split_time_to_str(
-                        gap_info.current.last_lap_time, "{m}:{s}.{d}"
-                    )
-                    formatted_time2 = self._rhapi.utils.format_split_time_to_str(
-                        gap_info.current.total_time_laps, "{m}:{s}.{d}"
+                    text = layout.render(
+                        "racing",
+                        "lap_time",
+                        lap_time=format_split_time(current.last_lap_time),
+                        total_time=format_split_time(current.total_time_laps),
                     )
-                    message = f"x {formatted_time1} | {formatted_time2} w"
 
             elif gap_info.race.win_condition == WinCondition.FASTEST_CONSECUTIVE:
-                formatted_time1 = self._rhapi.utils.format_split_time_to_str(
-                    gap_info.current.last_lap_time, "{m}:{s}.{d}"
+                text = layout.render(
+                    "racing",
+                    "consecutive",
+                    lap_time=format_split_time(current.last_lap_time),
+                    consecutives_base=current.consecutives_base,
+                    consecutives=format_split_time(current.consecutives),
                 )
-                formatted_time2 = self._rhapi.utils.format_split_time_to_str(
-                    gap_info.current.consecutives, "{m}:{s}.{d}"
-                )
-                message = f"x {formatted_time1} | {gap_info.current.consecutives_base}/{formatted_time2} w"
 
             elif gap_info.race.win_condition == WinCondition.FASTEST_LAP:
                 if gap_info.next_rank.diff_time:
-                    formatted_time = self._rhapi.utils.format_split_time_to_str(
-                        gap_info.next_rank.diff_time, "{m}:{s}.{d}"
+                    text = layout.render(
+                        "racing",
+                        "gap",
+                        callsign=gap_info.next_rank.callsign,
+                        gap=format_split_time(gap_info.next_rank.diff_time),
                     )
-                    formatted_callsign = str.upper(gap_info.next_rank.callsign)
-                    message = f"x {formatted_callsign} | +{formatted_time} w"
 
-                elif gap_info.current.is_best_lap and gap_info.current.lap_number:
-                    formatted_time = self._rhapi.utils.format_split_time_to_str(
-                        gap_info.current.last_lap_time, "{m}:{s}.{d}"
+                elif current.is_best_lap and current.lap_number:
+                    text = layout.render(
+                        "racing",
+                        "leader",
+                        lap_time=format_split_time(current.last_lap_time),
                     )
-                    message = f"x {self._rhapi.db.option('_leader_message')} | {formatted_time} w"
 
-                elif gap_info.current.lap_number:
-                    formatted_time = self._rhapi.utils.format_split_time_to_str(
-                        gap_info.first_rank.diff_time, "{m}:{s}.{d}"
+                elif current.lap_number:
+                    text = layout.render(
+                        "racing",
+                        "gap",
+                        callsign=gap_info.first_rank.callsign,
+                        gap=format_split_time(gap_info.first_rank.diff_time),
                     )
-                    formatted_callsign = str.upper(gap_info.first_rank.callsign)
-                    message = f"x {formatted_callsign} | +{formatted_time} w"
 
             else:
                 if gap_info.next_rank.diff_time:
-                    formatted_time = self._rhapi.utils.format_split_time_to_str(
-                        gap_info.next_rank.diff_time, "{m}:{s}.{d}"
+                    text = layout.render(
+                        "racing",
+                        "gap",
+                        callsign=gap_info.next_rank.callsign,
+                        gap=format_split_time(gap_info.next_rank.diff_time),
                     )
-                    formatted_callsign = str.upper(gap_info.next_rank.callsign)
-                    message = f"x {formatted_callsign} | +{formatted_time} w"
 
-                elif gap_info.current.lap_number:
-                    formatted_time = self._rhapi.utils.format_split_time_to_str(
-                        gap_info.current.last_lap_time, "{m}:{s}.{d}"
+                elif current.lap_number:
+                    text = layout.render(
+                        "racing",
+                        "leader",
+                        lap_time=format_split_time(current.last_lap_time),
                     )
-                    message = f"x {self._rhapi.db.option('_leader_message')} | {formatted_time} w"
 
-            start_col = self.center_osd(len(message))
+            if text is None:
+                return
 
             uid = self.get_pilot_uid(pilot_id)
-            self._queue_lock.acquire()
-            self.set_send_uid(uid)
-            self.send_osd_text(
-                self._rhapi.db.option("_lapresults_row"), start_col, message
-            )
-            self.send_display_osd()
-            self.reset_send_uid()
-            self._queue_lock.release()
-
-            gevent.sleep(self._rhapi.db.option("_results_uptime") * 1e-1)
+            with self._queue_lock:
+                generation = self._claim_row(uid, text.row)
+                self.set_send_uid(uid)
+                self.send_msp(self.text_packet(text))
+                self.send_display_osd()
+                self.reset_send_uid()
 
-            self._queue_lock.acquire()
-            self.set_send_uid(uid)
-            self.send_clear_osd_row(self._rhapi.db.option("_lapresults_row"))
-            self.send_display_osd()
-            self.reset_send_uid()
-            self._queue_lock.release()
+            self._expire_row(
+                uid,
+                text.row,
+                generation,
+                self._rhapi.db.option("_results_uptime") * 1e-1,
+            )
 
         seats_finished = self._rhapi.race.seats_finished
         pilots_completion = {}
@@ -782,20 +1741,30 @@ class ELRSBackpack(VRxController):
             if pilot_id:
                 pilots_completion[pilot_id] = seats_finished[slot]
 
+        position_mode = self._rhapi.db.option("_position_mode") == "1"
+
         results = args["results"]["by_race_time"]
         for result in results:
+            pilot_id = result["pilot_id"]
+            lapped = pilot_id == args["pilot_id"]
 
-            if (
-                self._rhapi.db.pilot_attribute_value(result["pilot_id"], "elrs_active")
-                == "1"
-            ):
+            # Only the lapping pilot and pilots with a changed position need an update
+            state = (result["position"] if position_mode else None, result["laps"])
+            changed = self._lap_states.get(pilot_id) != state
+            if not (changed or lapped):
+                continue
+
+            if self._rhapi.db.pilot_attribute_value(pilot_id, "elrs_active") == "1":
 
-                if not pilots_completion[result["pilot_id"]]:
-                    gevent.spawn(update_pos, result)
+                if not pilots_completion[pilot_id]:
+                    # A dropped update is retried on the next lap
+                    if changed and self._scheduler.submit(update_pos, result):
+                        self._lap_states[pilot_id] = state
 
-                    if result["pilot_id"] == args["pilot_id"] and (result["laps"] > 0):
-                        gevent.spawn(lap_results, result, args["gap_info"])
+                    if lapped and (result["laps"] > 0):
+                        self._scheduler.submit(lap_results, result, args["gap_info"])
 
+    @traced("lap_delete")
     def onLapDelete(self, *_) -> None:
         """
         Update a pilot's OSD when a they have finished
@@ -803,14 +1772,16 @@ class ELRSBackpack(VRxController):
         if not self._backpack_connected:
             return
 
+        self._lap_states.clear()
+
         def delete(pilot_id):
             uid = self.get_pilot_uid(pilot_id)
-            self._queue_lock.acquire()
-            self.set_send_uid(uid)
-            self.send_clear_osd()
-            self.send_display_osd()
-            self.reset_send_uid()
-            self._queue_lock.release()
+            with self._queue_lock:
+                self._claim_screen(uid)
+                self.set_send_uid(uid)
+                self.send_clear_osd()
+                self.send_display_osd()
+                self.reset_send_uid()
 
         if self._rhapi.db.option("_results_mode") == "1":
             seat_pilots = self._rhapi.race.pilots
@@ -822,8 +1793,9 @@ class ELRSBackpack(VRxController):
                     )
                     == "1"
                 ):
-                    gevent.spawn(delete, seat_pilots[seat])
+                    self._scheduler.submit(delete, seat_pilots[seat], critical=True)
 
+    @traced("pilot_done")
     def onRacePilotDone(self, args: dict) -> None:
         """
         Update a pilot's OSD when a they have finished
@@ -834,52 +1806,58 @@ class ELRSBackpack(VRxController):
         def done(result, win_condition):
 
             pilot_id = result["pilot_id"]
-            start_col = self.center_osd(
-                len(self._rhapi.db.option("_pilotdone_message"))
-            )
-            results_row1 = self._rhapi.db.option("_results_row")
-            results_row2 = results_row1 + 1
-
-            uid = self.get_pilot_uid(pilot_id)
-            self._queue_lock.acquire()
-            self.set_send_uid(uid)
-            self.send_clear_osd_row(self._rhapi.db.option("_currentlap_row"))
-            self.send_clear_osd_row(self._rhapi.db.option("_status_row"))
-            self.send_osd_text(
-                self._rhapi.db.option("_status_row"),
-                start_col,
-                self._rhapi.db.option("_pilotdone_message"),
-            )
+            layout = self._get_layout()
+            text = layout.render("finished", "done")
 
+            result_texts = []
             if self._rhapi.db.option("_results_mode") == "1":
-                placement_message = f'PLACEMENT: {result["position"]}'
-                place_col = self.center_osd(len(placement_message))
-                self.send_osd_text(results_row1, place_col, placement_message)
+                result_texts.append(
+                    layout.render("results", "placement", position=result["position"])
+                )
 
                 if win_condition == WinCondition.FASTEST_CONSECUTIVE:
-                    win_message = f'FASTEST {result["consecutives_base"]} CONSEC: {result["consecutives"]}'
+                    result_texts.append(
+                        layout.render("results", "consecutive", **result)
+                    )
                 elif win_condition == WinCondition.FASTEST_LAP:
-                    win_message = f'FASTEST LAP: {result["fastest_lap"]}'
+                    result_texts.append(
+                        layout.render("results", "fastest_lap", **result)
+                    )
                 elif win_condition == WinCondition.FIRST_TO_LAP_X:
-                    win_message = f'TOTAL TIME: {result["total_time"]}'
+                    result_texts.append(
+                        layout.render("results", "total_time", **result)
+                    )
                 else:
-                    win_message = f'LAPS COMPLETED: {result["laps"]}'
+                    result_texts.append(layout.render("results", "laps", **result))
 
-                win_col = self.center_osd(len(win_message))
-                self.send_osd_text(results_row2, win_col, win_message)
+            # Clears the lap rows of the racing screen along with
+            # the rows the finished screen is shown on
+            rows = [
+                layout.template("racing", "lap").row,
+                layout.template("racing", "position").row,
+                text.row,
+                *(text_.row for text_ in result_texts),
+            ]
 
-            self.send_display_osd()
-            self.reset_send_uid()
-            self._queue_lock.release()
+            uid = self.get_pilot_uid(pilot_id)
+            with self._queue_lock:
+                generations = {row: self._claim_row(uid, row) for row in rows}
+                self.set_send_uid(uid)
+                for row in generations:
+                    self.send_clear_osd_row(row)
 
-            gevent.sleep(self._rhapi.db.option("_finish_uptime") * 1e-1)
+                for text_ in (text, *result_texts):
+                    self.send_msp(self.text_packet(text_))
 
-            self._queue_lock.acquire()
-            self.set_send_uid(uid)
-            self.send_clear_osd_row(self._rhapi.db.option("_status_row"))
-            self.send_display_osd()
-            self.reset_send_uid()
-            self._queue_lock.release()
+                self.send_display_osd()
+                self.reset_send_uid()
+
+            self._expire_row(
+                uid,
+                text.row,
+                generations[text.row],
+                self._rhapi.db.option("_finish_uptime") * 1e-1,
+            )
 
         results = args["results"]
         leaderboard = results[results["meta"]["primary_leaderboard"]]
@@ -888,9 +1866,12 @@ class ELRSBackpack(VRxController):
                 self._rhapi.db.pilot_attribute_value(args["pilot_id"], "elrs_active")
                 == "1"
             ) and (result["pilot_id"] == args["pilot_id"]):
-                gevent.spawn(done, result, results["meta"]["win_condition"])
+                self._scheduler.submit(
+                    done, result, results["meta"]["win_condition"], critical=True
+                )
                 break
 
+    @traced("laps_clear")
     def onLapsClear(self, *_) -> None:
         """
         Removes data from pilot's OSD when laps are removed from the system
@@ -898,15 +1879,20 @@ class ELRSBackpack(VRxController):
         if not self._backpack_connected:
             return
 
-        def clear(pilot_id):
-            uid = self.get_pilot_uid(pilot_id)
-            self._queue_lock.acquire()
-            self.set_send_uid(uid)
-            self.send_clear_osd()
-            self.send_display_osd()
-            self.reset_send_uid()
-            self._queue_lock.release()
+        self._lap_states.clear()
+        self._cancel_staged_start()
 
+        def clear(pilot_ids):
+            uids = [self.get_pilot_uid(pilot_id) for pilot_id in pilot_ids]
+            packets = (self.clear_osd_packet(), self.display_osd_packet())
+
+            with self._queue_lock:
+                for uid in uids:
+                    self._claim_screen(uid)
+
+                self.send_group(uids, packets)
+
+        pilot_ids = []
         seat_pilots = self._rhapi.race.pilots
         for seat in seat_pilots:
             if (
@@ -916,8 +1902,12 @@ class ELRSBackpack(VRxController):
                 )
                 == "1"
             ):
-                gevent.spawn(clear, seat_pilots[seat])
+                pilot_ids.append(seat_pilots[seat])
 
+        if pilot_ids:
+            self._scheduler.submit(clear, pilot_ids, critical=True)
+
+    @traced("send_message")
     def onSendMessage(self, args: dict | None = None) -> None:
         """
         Sends custom text to pilots of the active heat
@@ -928,29 +1918,23 @@ class ELRSBackpack(VRxController):
         if args is None:
             return
 
-        def notify(pilot):
-            uid = self.get_pilot_uid(pilot)
-            start_col = self.center_osd(len(args["message"]))
-            self._queue_lock.acquire()
-            self.set_send_uid(uid)
-            self.send_osd_text(
-                self._rhapi.db.option("_announcement_row"),
-                start_col,
-                f"x {str.upper(args['message'])} w",
+        def notify(pilot_ids):
+            uids = [self.get_pilot_uid(pilot_id) for pilot_id in pilot_ids]
+            text = self._get_layout().render(
+                "racing", "announcement", message=args["message"]
             )
-            self.send_display_osd()
-            self.reset_send_uid()
-            self._queue_lock.release()
 
-            gevent.sleep(self._rhapi.db.option("_announcement_uptime") * 1e-1)
+            packets = (self.text_packet(text), self.display_osd_packet())
 
-            self._queue_lock.acquire()
-            self.set_send_uid(uid)
-            self.send_clear_osd_row(self._rhapi.db.option("_announcement_row"))
-            self.send_display_osd()
-            self.reset_send_uid()
-            self._queue_lock.release()
+            with self._queue_lock:
+                generations = [self._claim_row(uid, text.row) for uid in uids]
+                self.send_group(uids, packets)
 
+            uptime = self._rhapi.db.option("_announcement_uptime") * 1e-1
+            for uid, generation in zip(uids, generations):
+                self._expire_row(uid, text.row, generation, uptime)
+
+        pilot_ids = []
         seat_pilots = self._rhapi.race.pilots
         for seat in seat_pilots:
             if (
@@ -960,4 +1944,7 @@ class ELRSBackpack(VRxController):
                 )
                 == "1"
             ):
-                gevent.spawn(notify, seat_pilots[seat])
+                pilot_ids.append(seat_pilots[seat])
+
+        if pilot_ids:
+            self._scheduler.submit(notify, pilot_ids, critical=True)
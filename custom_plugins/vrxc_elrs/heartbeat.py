@@ -0,0 +1,133 @@
+"""
+Liveness and round trip time of the backpack link
+"""
+
+import logging
+import time
+from collections.abc import Callable
+from enum import IntEnum
+from typing import Union
+
+import gevent
+
+from .metrics import Metrics
+
+DEFAULT_HEARTBEAT_INTERVAL = 5
+HEARTBEAT_IDLE_CHECK = 0.05
+DEGRADED_MISSES = 1
+DEAD_MISSES = 3
+
+logger = logging.getLogger(__name__)
+
+
+class LinkState(IntEnum):
+    DEAD = 0
+    DEGRADED = 1
+    HEALTHY = 2
+
+
+class Heartbeat:
+    """
+    Periodically pings the backpack and times the response. Pings
+    are low priority: each one waits until no OSD messages are
+    queued, for up to one interval. Only one ping is outstanding
+    at a time, so a response always belongs to the last ping.
+
+    The link is degraded once a ping goes unanswered and dead
+    after several unanswered pings in a row. Any response marks
+    it healthy again.
+    """
+
+    _greenlet: Union[gevent.Greenlet, None] = None
+
+    def __init__(
+        self,
+        ping: Callable[[], None],
+        idle: Callable[[], bool],
+        metrics: Metrics,
+        on_state: Callable[[LinkState], None],
+    ):
+        """
+        :param ping: Sends a ping to the backpack
+        :param idle: Whether the link is free for a ping
+        :param metrics: Receives the round trip times and ping counts
+        :param on_state: Called when the state of the link changes
+        """
+        self.interval: float = DEFAULT_HEARTBEAT_INTERVAL
+        self._ping = ping
+        self._idle = idle
+        self._metrics = metrics
+        self._on_state = on_state
+        self._sent: Union[float, None] = None
+        self._misses = 0
+        self._state = LinkState.HEALTHY
+
+        metrics.gauge_callback("link_state", lambda: self._state)
+
+    @property
+    def state(self) -> LinkState:
+        """
+        The state of the link
+        """
+        return self._state
+
+    def start(self) -> None:
+        """
+        Starts pinging a newly connected backpack
+        """
+        self.stop()
+        self._sent = None
+        self._misses = 0
+        self._state = LinkState.HEALTHY
+
+        if self.interval > 0:
+            self._greenlet = gevent.spawn(self._run)
+
+    def stop(self) -> None:
+        """
+        Stops pinging the backpack
+        """
+        if self._greenlet is not None:
+            self._greenlet.kill()
+            self._greenlet = None
+
+    def _run(self) -> None:
+        while True:
+            gevent.sleep(self.interval)
+
+            deadline = time.monotonic() + self.interval
+            while not self._idle() and time.monotonic() < deadline:
+                gevent.sleep(HEARTBEAT_IDLE_CHECK)
+
+            if self._sent is not None:
+                self._misses += 1
+                self._metrics.increment("ping_timeouts")
+                if self._misses >= DEAD_MISSES:
+                    self._set_state(LinkState.DEAD)
+                elif self._misses >= DEGRADED_MISSES:
+                    self._set_state(LinkState.DEGRADED)
+
+            self._sent = time.perf_counter()
+            self._metrics.increment("pings")
+            self._ping()
+
+    def response(self) -> Union[float, None]:
+        """
+        Handles a ping response from the backpack
+
+        :return: The round trip time, or None when no ping was outstanding
+        """
+        if self._sent is None:
+            return None
+
+        rtt = time.perf_counter() - self._sent
+        self._sent = None
+        self._misses = 0
+        self._metrics.observe("rtt_seconds", rtt)
+        self._set_state(LinkState.HEALTHY)
+        return rtt
+
+    def _set_state(self, state: LinkState) -> None:
+        if state != self._state:
+            self._state = state
+            self._on_state(state)
@@ -0,0 +1,205 @@
+"""
+Backpack links and the distribution of pilots between them
+"""
+
+import hashlib
+from collections.abc import Callable, Sequence
+from typing import Union
+
+import gevent
+from gevent.queue import Queue
+
+from .capture import WireRecorder
+from .connections import BackpackConnection, ConnectionTypeEnum
+from .heartbeat import Heartbeat, LinkState
+from .metrics import Metrics
+from .msp import MSPPacket, MSPTypes
+from .tracing import Transaction
+
+LINK_TYPES = {
+    "usb": ConnectionTypeEnum.USB,
+    "socket": ConnectionTypeEnum.SOCKET,
+}
+
+
+class BackpackLink:
+    """
+    One backpack attached to the timer. Each link has its own
+    send queue, so several backpacks are written to in parallel,
+    and its own heartbeat, so the pilots of a backpack that stops
+    responding can be moved to the others. Counters are kept
+    across reconnects.
+    """
+
+    connection: Union[BackpackConnection, None] = None
+    receiver: Union[gevent.Greenlet, None] = None
+    reconnector: Union[gevent.Greenlet, None] = None
+    version: Union[str, None] = None
+    _connect_args: Union[tuple[Callable, dict], None] = None
+
+    def __init__(
+        self,
+        name: str,
+        idle: Callable[[], bool],
+        on_state: Callable[["BackpackLink", LinkState], None],
+    ):
+        """
+        :param name: The name of the link in logs and metrics
+        :param idle: Whether the timer has no OSD messages waiting
+        :param on_state: Called when the heartbeat state of the link changes
+        """
+        self.name = name
+        self.send_queue = Queue()
+        self.recieve_queue = Queue(maxsize=100)
+        self.metrics = Metrics()
+        self._idle = idle
+        self.heartbeat = Heartbeat(
+            self.ping, self.idle, self.metrics, lambda state: on_state(self, state)
+        )
+
+        self.metrics.gauge_callback("connected", lambda: int(self.connected))
+        self.metrics.gauge_callback("send_queue_depth", self.send_queue.qsize)
+
+    @property
+    def connected(self) -> bool:
+        if self.connection is None:
+            return False
+
+        return self.connection.connected
+
+    @property
+    def healthy(self) -> bool:
+        """
+        Whether the link is connected and its backpack responding
+        """
+        return self.connected and self.heartbeat.state != LinkState.DEAD
+
+    def idle(self) -> bool:
+        """
+        Whether no OSD messages are waiting to be sent
+
+        :return: Whether the link is idle
+        """
+        return self.send_queue.empty() and self._idle()
+
+    def flush(self) -> int:
+        """
+        Discards the packets left in the send queue
+
+        :return: The number of packets discarded
+        """
+        flushed = 0
+        while not self.send_queue.empty():
+            if not isinstance(self.send_queue.get(), Transaction):
+                flushed += 1
+
+        return flushed
+
+    def connect(
+        self,
+        connection_type: Callable[[Queue, Queue], BackpackConnection],
+        recorder: Union[WireRecorder, None] = None,
+        **kwargs,
+    ) -> bool:
+        """
+        Opens a new connection to the backpack
+
+        :param connection_type: The type of connection to use
+        :param recorder: Records the traffic of the connection
+        :return: Whether the connection was established
+        """
+        self._connect_args = (connection_type, kwargs)
+        self.heartbeat.stop()
+        self.connection = connection_type(self.send_queue, self.recieve_queue)
+        self.connection.recorder = recorder
+        self.connection.metrics = self.metrics
+        self.metrics.increment("connection_attempts")
+        if not self.connection.connect(**kwargs):
+            self.metrics.increment("connection_failures")
+            return False
+
+        self.version = None
+        self.ping()
+        self.heartbeat.start()
+        return True
+
+    def disconnect(self) -> None:
+        """
+        Closes the connection to the backpack
+        """
+        self.heartbeat.stop()
+        if self.connection is not None:
+            self.connection.disconnect()
+
+    def reconnect(self, recorder: Union[WireRecorder, None] = None) -> bool:
+        """
+        Closes the connection and opens it again with the
+        type and settings of the last connection
+
+        :param recorder: Records the traffic of the connection
+        :return: Whether the connection was established
+        """
+        if self._connect_args is None:
+            return False
+
+        connection_type, kwargs = self._connect_args
+        self.disconnect()
+        return self.connect(connection_type, recorder, **kwargs)
+
+    def ping(self) -> None:
+        """
+        Requests the version of the backpack
+        """
+        if self.connected:
+            packet = MSPPacket()
+            packet.set_function(MSPTypes.MSP_ELRS_GET_BACKPACK_VERSION)
+            self.send_queue.put(packet)
+
+
+def parse_links(value: str) -> list[tuple[ConnectionTypeEnum, str]]:
+    """
+    Parses a comma separated list of backpacks, such as
+    `usb:/dev/ttyUSB1, socket:elrs-netpack-2`
+
+    :param value: The list of backpacks
+    :raises ValueError: When an entry is not a usb or socket backpack
+    :return: The connection type and address of each backpack
+    """
+    links = []
+    for entry in value.split(","):
+        if not (entry := entry.strip()):
+            continue
+
+        kind, _, address = entry.partition(":")
+        if (type_ := LINK_TYPES.get(kind.strip().lower())) is None or not (
+            address := address.strip()
+        ):
+            raise ValueError(f"Invalid backpack {entry!r}")
+
+        links.append((type_, address))
+
+    return links
+
+
+def link_for_uid(
+    uid: bytes, links: Sequence[BackpackLink]
+) -> Union[BackpackLink, None]:
+    """
+    Picks the link a pilot's messages are sent through. Pilots
+    are spread by rendezvous hashing of their UID, so when a link
+    fails only its own pilots move to the remaining links, and
+    they move back once it recovers.
+
+    :param uid: The pilot's UID
+    :param links: The links to choose from
+    :return: The link, or None when there are no links
+    """
+    if not links:
+        return None
+
+    return max(
+        links,
+        key=lambda link: hashlib.blake2b(
+            uid + link.name.encode(), digest_size=8
+        ).digest(),
+    )
@@ -0,0 +1,220 @@
+"""
+Counters, gauges and latency histograms of the backpack bridge
+"""
+
+import bisect
+from collections.abc import Callable
+from typing import Any
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+class LatencyHistogram:
+    """
+    Counts observed durations into fixed buckets. Each bucket
+    counts the observations up to its upper bound, the last
+    bucket counts everything slower.
+    """
+
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        """
+        :param buckets: Upper bounds of the buckets in seconds, ascending
+        """
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        """
+        Records a duration
+
+        :param seconds: The duration
+        """
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, quantile: float) -> float:
+        """
+        Estimates a quantile as the upper bound of the bucket
+        it falls in, limited to the largest observation
+
+        :param quantile: The quantile between 0 and 1
+        :return: The estimated duration in seconds
+        """
+        if not self.count:
+            return 0.0
+
+        rank = quantile * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+
+        return self.max
+
+    def as_dict(self) -> dict[str, Any]:
+        bounds = [*map(str, self.buckets), "+Inf"]
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "max": self.max,
+            "mean": self.total / self.count if self.count else 0.0,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99),
+            "buckets": dict(zip(bounds, self.counts)),
+        }
+
+
+class Metrics:
+    """
+    A named set of counters, gauges and latency histograms.
+    Gauges can be set directly or read from a callback when
+    the metrics are collected. Histograms can be split into
+    labelled series of one name.
+    """
+
+    def __init__(self) -> None:
+        self.counters: dict[str, int] = {}
+        self.histograms: dict[str, LatencyHistogram] = {}
+        self._gauges: dict[str, float] = {}
+        self._gauge_callbacks: dict[str, Callable[[], float]] = {}
+        self._series: dict[str, tuple[str, dict[str, str]]] = {}
+
+    def increment(self, name: str, value: int = 1) -> None:
+        """
+        Increases a counter
+
+        :param name: The counter
+        :param value: The amount to add
+        """
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def set_gauge(self, name: str, value: float) -> None:
+        """
+        Sets the current value of a gauge
+
+        :param name: The gauge
+        :param value: The value
+        """
+        self._gauges[name] = value
+
+    def gauge_callback(self, name: str, callback: Callable[[], float]) -> None:
+        """
+        Reads a gauge from a callback whenever the metrics are collected
+
+        :param name: The gauge
+        :param callback: Returns the current value
+        """
+        self._gauge_callbacks[name] = callback
+
+    def observe(self, name: str, seconds: float, **labels: str) -> None:
+        """
+        Records a duration in a latency histogram
+
+        :param name: The histogram
+        :param seconds: The duration
+        :param labels: Labels of the histogram's series
+        """
+        key = name
+        if labels:
+            key += "{" + ",".join(f"{k}={v}" for k, v in labels.items()) + "}"
+
+        if (histogram := self.histograms.get(key)) is None:
+            histogram = self.histograms[key] = LatencyHistogram()
+            self._series[key] = (name, labels)
+
+        histogram.observe(seconds)
+
+    @property
+    def gauges(self) -> dict[str, float]:
+        """
+        The current value of every gauge
+        """
+        gauges = dict(self._gauges)
+        for name, callback in self._gauge_callbacks.items():
+            gauges[name] = callback()
+
+        return gauges
+
+    def as_dict(self) -> dict[str, Any]:
+        """
+        Collects the metrics
+
+        :return: The counters, gauges and histograms. Histograms
+            are keyed by name and labels, and include both.
+        """
+        histograms = {}
+        for key, histogram in self.histograms.items():
+            name, labels = self._series.get(key, (key, {}))
+            histograms[key] = {"name": name, "labels": labels, **histogram.as_dict()}
+
+        return {
+            "counters": dict(self.counters),
+            "gauges": self.gauges,
+            "histograms": histograms,
+        }
+
+
+def format_metrics(metrics: dict[str, Any], prefix: str = "") -> list[str]:
+    """
+    Formats collected metrics as short lines for display
+
+    :param metrics: Metrics from `Metrics.as_dict`
+    :param prefix: Text put in front of every name
+    :return: The lines
+    """
+    lines = [f"{prefix}{name}: {value}" for name, value in metrics["counters"].items()]
+    lines.extend(
+        f"{prefix}{name}: {value:g}" for name, value in metrics["gauges"].items()
+    )
+    for name, histogram in metrics["histograms"].items():
+        lines.append(
+            f"{prefix}{name}: n={histogram['count']} "
+            f"mean={histogram['mean'] * 1000:.2f}ms "
+            f"p99<={histogram['p99'] * 1000:.2f}ms "
+            f"max={histogram['max'] * 1000:.2f}ms"
+        )
+
+    return lines
+
+
+def format_metrics_markdown(sections: dict[str, dict[str, Any]]) -> str:
+    """
+    Formats collected metrics as markdown tables for a settings panel
+
+    :param sections: Metrics from `Metrics.as_dict` by section title
+    :return: The markdown
+    """
+    lines = []
+    for title, metrics in sections.items():
+        lines += [f"#### {title}", "", "| Metric | Value |", "| --- | --- |"]
+        lines.extend(
+            f"| {name} | {value} |" for name, value in metrics["counters"].items()
+        )
+        lines.extend(
+            f"| {name} | {value:g} |" for name, value in metrics["gauges"].items()
+        )
+
+        if metrics["histograms"]:
+            lines += [
+                "",
+                "| Latency | Count | Mean | p99 | Max |",
+                "| --- | --- | --- | --- | --- |",
+            ]
+            for name, histogram in metrics["histograms"].items():
+                lines.append(
+                    f"| {name} | {histogram['count']} "
+                    f"| {histogram['mean'] * 1000:.2f} ms "
+                    f"| {histogram['p99'] * 1000:.2f} ms "
+                    f"| {histogram['max'] * 1000:.2f} ms |"
+                )
+
+        lines.append("")
+
+    return "\n".join(lines)
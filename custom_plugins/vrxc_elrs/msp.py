@@ -3,12 +3,15 @@ ExpressLRS Backpack bridge
 """
 
 import sys
+from collections import deque
 from collections.abc import Generator, Sequence
 from enum import Enum, IntEnum, auto
 from typing import Union
 
 from gevent.queue import Queue
 
+from .metrics import Metrics
+
 if sys.version_info >= (3, 11):
     from typing import Self
 else:
@@ -104,42 +107,54 @@ class MSPPacket:
         self._function: Union[MSPTypes, None] = None
         self._payload: bytes | bytearray = bytearray()
         self._flags: int = 0
+        self._encoded: Union[bytes, None] = None
 
     @classmethod
-    def packets_from_bytes_queue(cls, queue: Queue) -> Generator[Self, None, None]:
+    def packets_from_bytes_queue(
+        cls, queue: Queue, metrics: Union[Metrics, None] = None
+    ) -> Generator[Self, None, None]:
         """
-        Parses packets from a provided queue
+        Parses packets from a provided queue. The chunks in the
+        queue are parsed as one stream, so packets split across
+        reads are kept.
 
         :param queue: The queue to generate packets from
+        :param metrics: Counts CRC failures and resyncs when provided
         :yield: The packet
         """
 
-        def _gen() -> Generator[bytes, None, None]:
+        def _gen() -> Generator[int, None, None]:
             while not queue.is_shutdown:
-                yield queue.get()
+                yield from queue.get()
 
-        for bytes_ in _gen():
-            yield from cls.packets_from_bytes(bytes_)
+        yield from cls._generate_packets(_gen(), metrics)
 
     @classmethod
-    def packets_from_bytes(cls, data: bytes) -> Generator[Self, None, None]:
+    def packets_from_bytes(
+        cls, data: bytes, metrics: Union[Metrics, None] = None
+    ) -> Generator[Self, None, None]:
         """
         Parses packets from a provided queue
 
         :param queue: The queue to generate packets from
+        :param metrics: Counts CRC failures and resyncs when provided
         :yield: The packet
         """
 
-        yield from cls._generate_packets((i for i in data))
+        yield from cls._generate_packets((i for i in data), metrics)
 
     @classmethod
     def _generate_packets(
-        cls, data: Generator[int, None, None]
+        cls, data: Generator[int, None, None], metrics: Union[Metrics, None] = None
     ) -> Generator[Self, None, None]:
         """
-        Generates packets from an incoming generator
+        Generates packets from an incoming generator. A header that
+        turns out not to start a frame counts as a resync. The bytes
+        after the `$` of a false start or a frame failing its CRC
+        are scanned again, so a frame starting inside them is kept.
 
         :param data: The data generator
+        :param metrics: Counts CRC failures and resyncs when provided
         :yield: The generated packet
         """
         state: MSPState = MSPState.IDLE
@@ -149,8 +164,18 @@ class MSPPacket:
         buffer = bytearray()
         length = 0
         crc = 0
+        rescan: deque[int] = deque()
 
-        for c in data:
+        def _bytes() -> Generator[int, None, None]:
+            for c in data:
+                yield c
+                while rescan:
+                    yield rescan.popleft()
+
+        def _resync(*bytes_: int) -> None:
+            rescan.extendleft(reversed((*buffer[1:], *bytes_)))
+
+        for c in _bytes():
 
             if state == MSPState.IDLE:
                 if c == ord("$"):
@@ -164,6 +189,9 @@ class MSPPacket:
                     state = MSPState.HEADER_X
                 else:
                     state = MSPState.IDLE
+                    _resync(c)
+                    if metrics is not None:
+                        metrics.increment("resyncs")
 
             elif state == MSPState.HEADER_X:
                 state = MSPState.HEADER_V2_NATIVE
@@ -178,6 +206,9 @@ class MSPPacket:
                 else:
                     type_ = MSPPacketType.UNKNOWN
                     state = MSPState.IDLE
+                    _resync(c)
+                    if metrics is not None:
+                        metrics.increment("resyncs")
 
             elif state == MSPState.HEADER_V2_NATIVE:
                 buffer.append(c)
@@ -185,8 +216,15 @@ class MSPPacket:
 
                 if len(buffer) == MSP_HEADER_LENGTH:
                     flags = buffer[3]
-                    function_ = MSPTypes(cls._bytes_to_int(buffer[4:6]))
                     length = cls._bytes_to_int(buffer[6:8])
+                    try:
+                        function_ = MSPTypes(cls._bytes_to_int(buffer[4:6]))
+                    except ValueError:
+                        state = MSPState.IDLE
+                        _resync()
+                        if metrics is not None:
+                            metrics.increment("resyncs")
+                        continue
 
                     if length == 0:
                         state = MSPState.CHECKSUM_V2_NATIVE
@@ -213,6 +251,11 @@ class MSPPacket:
 
                     yield packet
 
+                else:
+                    _resync(c)
+                    if metrics is not None:
+                        metrics.increment("crc_failures")
+
                 state = MSPState.IDLE
 
             else:
@@ -239,6 +282,13 @@ class MSPPacket:
         """
         return self._payload
 
+    @property
+    def flags(self) -> int:
+        """
+        Getter for the packet's flags
+        """
+        return self._flags
+
     @staticmethod
     def _int_to_bytes(a: int) -> bytes:
         return a.to_bytes(2, "little")
@@ -254,6 +304,7 @@ class MSPPacket:
         :param function: The enum to set the function to
         """
         self._function = function
+        self._encoded = None
 
     def set_payload(self, payload: Sequence[int] | bytes) -> None:
         """
@@ -262,6 +313,7 @@ class MSPPacket:
         :param payload: The payload of the packet
         """
         self._payload = bytes(payload)
+        self._encoded = None
 
     def set_flags(self, flags: int) -> None:
         """
@@ -270,6 +322,7 @@ class MSPPacket:
         :param payload: The payload of the packet
         """
         self._flags = flags
+        self._encoded = None
 
     def set_type(self, type_: MSPPacketType) -> None:
         """
@@ -278,6 +331,7 @@ class MSPPacket:
         :param payload: The payload of the packet
         """
         self._type = type_
+        self._encoded = None
 
     def iterate_payload(self) -> Generator[int, None, None]:
         """
@@ -328,14 +382,19 @@ class MSPPacket:
 
         return body
 
-    def get_packet(self) -> bytearray:
+    def get_packet(self) -> bytes:
         """
-        Get the constrcuted packet
+        Get the constrcuted packet. The packet is only encoded
+        once until its contents change, so the same packet can be
+        sent to several recipients without recomputing the checksum.
 
         :return: The constructed packet
         """
         assert self._type is not MSPPacketType.UNKNOWN
 
+        if self._encoded is not None:
+            return self._encoded
+
         msp = bytearray()
         msp.append(ord("$"))
         msp.append(ord("X"))
@@ -347,4 +406,5 @@ class MSPPacket:
         msp += bytes(body)
         msp.append(checksum)
 
-        return msp
+        self._encoded = bytes(msp)
+        return self._encoded
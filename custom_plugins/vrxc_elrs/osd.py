@@ -0,0 +1,360 @@
+"""
+OSD text encoding and layouts for the HDZero goggle font
+"""
+
+import functools
+import logging
+import unicodedata
+from collections.abc import Mapping
+from string import Formatter
+from typing import Any, NamedTuple, Union
+
+OSD_COLUMNS = 50
+OSD_ROWS = 18
+UNKNOWN_CHAR = ord("?")
+TIME_CACHE_SIZE = 4096
+
+logger = logging.getLogger(__name__)
+
+# Screen elements as (row option, row offset, format). Fields found in
+# the layout constants are filled in when the layout is compiled; all
+# other fields are variable slots filled in when the element is sent.
+DEFAULT_LAYOUT: dict[str, dict[str, tuple[str, int, str]]] = {
+    "stage": {
+        "status": ("_status_row", 0, "{racestage_message}"),
+        "heat": ("_heatname_row", 0, "x {heat} w"),
+        "heat_round": ("_heatname_row", 0, "x {heat} | {round_label} {round} w"),
+        "class": ("_classname_row", 0, "x {raceclass} w"),
+        "event": ("_eventname_row", 0, "x {event} w"),
+    },
+    "racing": {
+        "start": ("_status_row", 0, "{racestart_message}"),
+        "lap": ("_currentlap_row", 0, "LAP: {lap}"),
+        "position": ("_currentlap_row", 0, "POSN: {position} | LAP: {lap}"),
+        "lap_time": ("_lapresults_row", 0, "x {lap_time} | {total_time} w"),
+        "consecutive": (
+            "_lapresults_row",
+            0,
+            "x {lap_time} | {consecutives_base}/{consecutives} w",
+        ),
+        "best_lap": ("_lapresults_row", 0, "x BEST LAP | {lap_time} w"),
+        "gap": ("_lapresults_row", 0, "x {callsign} | +{gap} w"),
+        "leader": ("_lapresults_row", 0, "x {leader_message} | {lap_time} w"),
+        "finish": ("_status_row", 0, "{racefinish_message}"),
+        "stop": ("_status_row", 0, "{racestop_message}"),
+        "announcement": ("_announcement_row", 0, "x {message} w"),
+    },
+    "finished": {
+        "done": ("_status_row", 0, "{pilotdone_message}"),
+    },
+    "results": {
+        "placement": ("_results_row", 0, "PLACEMENT: {position}"),
+        "consecutive": (
+            "_results_row",
+            1,
+            "FASTEST {consecutives_base} CONSEC: {consecutives}",
+        ),
+        "fastest_lap": ("_results_row", 1, "FASTEST LAP: {fastest_lap}"),
+        "total_time": ("_results_row", 1, "TOTAL TIME: {total_time}"),
+        "laps": ("_results_row", 1, "LAPS COMPLETED: {laps}"),
+    },
+}
+
+# Layout constants taken from the plugin's message options
+MESSAGE_OPTIONS = {
+    "racestage_message": "_racestage_message",
+    "racestart_message": "_racestart_message",
+    "racefinish_message": "_racefinish_message",
+    "racestop_message": "_racestop_message",
+    "pilotdone_message": "_pilotdone_message",
+    "leader_message": "_leader_message",
+}
+
+# Values of the variable slots used to check custom layouts. Slots
+# not listed here are never filled in by the plugin.
+SAMPLE_VALUES: dict[str, Any] = {
+    "heat": "HEAT 1",
+    "round": 1,
+    "raceclass": "OPEN",
+    "event": "EVENT",
+    "lap": 1,
+    "position": 1,
+    "laps": 1,
+    "lap_time": "1:00.000",
+    "total_time": "1:00.000",
+    "fastest_lap": "1:00.000",
+    "consecutives": "1:00.000",
+    "consecutives_base": 3,
+    "callsign": "PILOT",
+    "gap": "1.000",
+    "message": "MESSAGE",
+}
+
+ROW_OPTIONS = {
+    row_option
+    for elements in DEFAULT_LAYOUT.values()
+    for row_option, _, _ in elements.values()
+}
+
+
+def _translate_char(char: str) -> int:
+    """
+    Finds the goggle font character for a unicode character.
+    Printable ASCII is passed through, so lowercase letters keep
+    mapping to the font's symbols. Accented letters are reduced
+    to their uppercase base letter so they are not shown as symbols.
+
+    :param char: The character to translate
+    :return: The font character
+    """
+    code = ord(char)
+    if 0x20 <= code < 0x7F:
+        return code
+
+    base = unicodedata.normalize("NFKD", char).encode("ascii", "ignore")
+    if len(base) == 1 and chr(base[0]).isalpha():
+        return ord(chr(base[0]).upper())
+
+    return UNKNOWN_CHAR
+
+
+class _OSDTranslation(dict):
+    """
+    Translation table for `str.translate`. Latin characters are
+    compiled when the module is loaded; any other character is
+    compiled on first use.
+    """
+
+    def __missing__(self, key: int) -> int:
+        value = self[key] = _translate_char(chr(key))
+        return value
+
+
+OSD_TRANSLATION = _OSDTranslation(
+    (code, _translate_char(chr(code))) for code in range(0x250)
+)
+
+
+def center_column(len_: int) -> int:
+    """
+    Provides the column value needed to center text
+    of the provided length on the goggle's screen
+
+    :param len_: The length of the text
+    :return: The starting column
+    """
+    return max(OSD_COLUMNS // 2 - len_ // 2, 0)
+
+
+def encode_text(text: str) -> bytes:
+    """
+    Encodes text into goggle font characters, truncated
+    to the width of the screen
+
+    :param text: The text to encode
+    :return: The encoded text
+    """
+    return text[:OSD_COLUMNS].translate(OSD_TRANSLATION).encode("ascii")
+
+
+def encode_centered_text(text: str) -> tuple[int, bytes]:
+    """
+    Encodes text into goggle font characters, truncated
+    to the width of the screen, and finds the column that
+    centers it
+
+    :param text: The text to encode
+    :return: The starting column and the encoded text
+    """
+    data = encode_text(text)
+    return center_column(len(data)), data
+
+
+@functools.lru_cache(maxsize=TIME_CACHE_SIZE)
+def _format_split_ms(millis: int) -> str:
+    """
+    Formats whole milliseconds as `{m}:{s}.{d}`
+
+    :param millis: The time in milliseconds
+    :return: The formatted time
+    """
+    minutes, millis = divmod(millis, 60000)
+    seconds, millis = divmod(millis, 1000)
+    if minutes > 0:
+        return f"{minutes}:{seconds:02}.{millis:03}"
+
+    return f"{seconds}.{millis:03}"
+
+
+def format_split_time(millis: Union[int, float, None]) -> str:
+    """
+    Formats a time the same way as RotorHazard's
+    `format_split_time_to_str` with the `{m}:{s}.{d}`
+    format, dropping the minutes under a minute. Recent
+    results are cached, as the same lap and gap times are
+    formatted for several pilots.
+
+    :param millis: The time in milliseconds
+    :return: The formatted time
+    """
+    if millis is None:
+        return ""
+
+    return _format_split_ms(int(round(millis)))
+
+
+class OSDText(NamedTuple):
+    """
+    Encoded text positioned on the goggle's screen
+    """
+
+    row: int
+    col: int
+    data: bytes
+
+
+class OSDTemplate:
+    """
+    A row of the OSD compiled into encoded literal parts and
+    variable slots. Rendering only encodes the variable parts.
+    Variable values are uppercased so they are never shown as
+    symbols.
+    """
+
+    def __init__(self, row: int, format_: str, constants: Mapping[str, str]):
+        """
+        Compiles the template
+
+        :param row: The row the template is shown on
+        :param format_: The format string of the row
+        :param constants: Values substituted when compiling
+        """
+        self.row = row
+        self._parts: list[Union[bytes, tuple[str, str]]] = []
+
+        literal = ""
+        for text, field, spec, _ in Formatter().parse(format_):
+            literal += text
+            if field is None:
+                continue
+
+            if field in constants:
+                literal += format(constants[field], spec or "")
+                continue
+
+            if literal:
+                self._parts.append(literal.translate(OSD_TRANSLATION).encode("ascii"))
+                literal = ""
+
+            self._parts.append((field, spec or ""))
+
+        if literal:
+            self._parts.append(literal.translate(OSD_TRANSLATION).encode("ascii"))
+
+        self._static: Union[OSDText, None] = None
+        if all(isinstance(part, bytes) for part in self._parts):
+            self._static = self.render()
+
+    def render(self, **values: Any) -> OSDText:
+        """
+        Renders the template, centered on its row. Slots
+        without a provided value are left empty, without
+        applying their format spec.
+
+        :return: The encoded text
+        """
+        if self._static is not None:
+            return self._static
+
+        data = b"".join(
+            (
+                part
+                if isinstance(part, bytes)
+                else (
+                    encode_text(format(values[part[0]], part[1]).upper())
+                    if part[0] in values
+                    else b""
+                )
+            )
+            for part in self._parts
+        )[:OSD_COLUMNS]
+
+        return OSDText(self.row, center_column(len(data)), data)
+
+
+class OSDLayout:
+    """
+    The OSD screens compiled from the plugin's settings
+    """
+
+    def __init__(
+        self,
+        rows: Mapping[str, int],
+        constants: Mapping[str, str],
+        overrides: Union[Mapping[str, Any], None] = None,
+    ):
+        """
+        Compiles every screen of the layout
+
+        :param rows: Row option values by option name
+        :param constants: Values substituted when compiling
+        :param overrides: Custom formats by `screen.element`. Values
+        are either a format string or an object with `format` and
+        optionally `row` keys.
+        """
+        overrides = overrides or {}
+        self._templates: dict[tuple[str, str], OSDTemplate] = {}
+
+        for screen, elements in DEFAULT_LAYOUT.items():
+            for element, (row_option, offset, format_) in elements.items():
+                default_row = row = rows[row_option] + offset
+
+                custom = overrides.get(f"{screen}.{element}")
+                if isinstance(custom, str):
+                    format_ = custom
+                elif isinstance(custom, Mapping):
+                    format_ = custom.get("format", format_)
+                    row = custom.get("row", row)
+
+                try:
+                    row = int(row)
+                    valid = 0 <= row < OSD_ROWS
+                except (ValueError, TypeError):
+                    valid = False
+
+                if not valid:
+                    logger.warning("Invalid OSD row for %s.%s", screen, element)
+                    row = default_row
+
+                # Trial render, so format specs that do not fit the
+                # slot's values fail here rather than when sending
+                try:
+                    template = OSDTemplate(row, format_, constants)
+                    template.render(**SAMPLE_VALUES)
+                except (ValueError, TypeError):
+                    logger.warning("Invalid OSD layout for %s.%s", screen, element)
+                    template = OSDTemplate(
+                        row, DEFAULT_LAYOUT[screen][element][2], constants
+                    )
+
+                self._templates[(screen, element)] = template
+
+    def template(self, screen: str, element: str) -> OSDTemplate:
+        """
+        Gets a compiled template
+
+        :param screen: The screen of the element
+        :param element: The element of the screen
+        :return: The template
+        """
+        return self._templates[(screen, element)]
+
+    def render(self, screen: str, element: str, **values: Any) -> OSDText:
+        """
+        Renders an element of a screen
+
+        :param screen: The screen of the element
+        :param element: The element of the screen
+        :return: The encoded text
+        """
+        return self._templates[(screen, element)].render(**values)
@@ -0,0 +1,124 @@
+"""
+Sampling profiler for the plugin's greenlets
+"""
+
+import logging
+import os
+import sys
+from collections import Counter
+from types import FrameType
+from typing import Union
+
+import gevent
+import gevent.event
+import gevent.monkey
+
+DEFAULT_PROFILE_SECONDS = 30
+PROFILE_INTERVAL = 0.01
+HUB_LOOP = "hub:Hub.run"
+PLUGIN_PATH = os.path.dirname(os.path.abspath(__file__))
+
+logger = logging.getLogger(__name__)
+
+# The profiler thread must not yield to the hub it is watching
+_sleep = gevent.monkey.get_original("time", "sleep")
+_monotonic = gevent.monkey.get_original("time", "monotonic")
+_get_ident = gevent.monkey.get_original("_thread", "get_ident")
+
+
+def _frame_name(frame: FrameType) -> str:
+    code = frame.f_code
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f"{module}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+def collapse_stack(frame: Union[FrameType, None]) -> str:
+    """
+    Collapses a stack into a single line of frame names from the
+    outermost to the innermost frame. Stacks running plugin code
+    start at the outermost plugin frame, which names the greenlet
+    (send, receive, parser or an OSD worker). Other stacks are
+    kept whole under `other`, and the hub waiting for events
+    is counted as `idle`.
+
+    :param frame: The innermost frame
+    :return: The collapsed stack
+    """
+    names: list[str] = []
+    plugin_depth = None
+    while frame is not None:
+        if frame.f_code.co_filename.startswith(PLUGIN_PATH):
+            plugin_depth = len(names)
+
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+
+    if plugin_depth is not None:
+        return ";".join(["elrs", *reversed(names[: plugin_depth + 1])])
+
+    if not names or names[0] == HUB_LOOP:
+        return "idle"
+
+    return ";".join(["other", *reversed(names)])
+
+
+class StackSampler:
+    """
+    Samples the stack running on the gevent hub's thread from a
+    native thread, so time spent without yielding to the hub is
+    caught as well. Samples are written in the collapsed stack
+    format read by flamegraph tools.
+    """
+
+    def __init__(self, path: str, duration: float, interval: float = PROFILE_INTERVAL):
+        """
+        :param path: The file the collapsed stacks are written to
+        :param duration: Seconds to sample for
+        :param interval: Seconds between samples
+        """
+        self.path = path
+        self.duration = duration
+        self.interval = interval
+        self.samples: Counter[str] = Counter()
+        self._thread_id = _get_ident()
+        self._stopped = False
+        self._result: Union[gevent.event.AsyncResult, None] = None
+
+    @property
+    def running(self) -> bool:
+        return self._result is not None and not self._result.ready()
+
+    def start(self) -> None:
+        """
+        Starts sampling on a thread of the hub's threadpool
+        """
+        self._result = gevent.get_hub().threadpool.spawn(self._sample)
+
+    def stop(self) -> None:
+        """
+        Ends sampling before the duration has passed
+        """
+        self._stopped = True
+
+    def _sample(self) -> None:
+        deadline = _monotonic() + self.duration
+        while not self._stopped and _monotonic() < deadline:
+            frame = sys._current_frames().get(self._thread_id)
+            self.samples[collapse_stack(frame)] += 1
+            del frame
+            _sleep(self.interval)
+
+    def wait(self) -> int:
+        """
+        Waits for sampling to end and writes the samples
+
+        :return: The number of samples taken
+        """
+        assert self._result is not None
+        self._result.get()
+
+        with open(self.path, "w", encoding="utf-8") as file:
+            for stack, count in self.samples.most_common():
+                file.write(f"{stack} {count}\n")
+
+        return sum(self.samples.values())
@@ -0,0 +1,89 @@
+"""
+Export of the plugin metrics in the Prometheus text format
+"""
+
+from collections.abc import Callable, Iterable
+from typing import Any
+
+from flask import Blueprint, Response
+
+METRICS_ROUTE = "/elrs/metrics"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: dict[str, str], **extra: str) -> str:
+    pairs = {**labels, **extra}
+    if not pairs:
+        return ""
+
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs.items()) + "}"
+
+
+def format_prometheus(
+    sources: Iterable[tuple[dict[str, Any], dict[str, str]]], prefix: str
+) -> list[str]:
+    """
+    Formats collected metrics as Prometheus metric families. Samples
+    of the same name are grouped into one family under a single TYPE
+    line, and are told apart by their labels.
+
+    :param sources: Metrics from `Metrics.as_dict`, each with the labels
+        added to its samples
+    :param prefix: Prefix of every metric name
+    :return: The lines of the exposition
+    """
+    families: dict[str, tuple[str, list[str]]] = {}
+
+    def samples(name: str, type_: str) -> list[str]:
+        return families.setdefault(name, (type_, []))[1]
+
+    for metrics, labels in sources:
+        label_text = _labels(labels)
+
+        for name, value in metrics["counters"].items():
+            name = f"{prefix}{name}_total"
+            samples(name, "counter").append(f"{name}{label_text} {value}")
+
+        for name, value in metrics["gauges"].items():
+            name = f"{prefix}{name}"
+            samples(name, "gauge").append(f"{name}{label_text} {value}")
+
+        for histogram in metrics["histograms"].values():
+            name = f"{prefix}{histogram['name']}"
+            series = {**labels, **histogram["labels"]}
+            family = samples(name, "histogram")
+
+            cumulative = 0
+            for bound, count in histogram["buckets"].items():
+                cumulative += count
+                family.append(f"{name}_bucket{_labels(series, le=bound)} {cumulative}")
+
+            family.append(f"{name}_sum{_labels(series)} {histogram['sum']}")
+            family.append(f"{name}_count{_labels(series)} {histogram['count']}")
+
+    lines = []
+    for name, (type_, family) in families.items():
+        lines.append(f"# TYPE {name} {type_}")
+        lines.extend(family)
+
+    return lines
+
+
+def create_blueprint(collect: Callable[[], str]) -> Blueprint:
+    """
+    Creates the blueprint serving the metrics from the timer's web server
+
+    :param collect: Returns the current exposition
+    :return: The blueprint
+    """
+    blueprint = Blueprint("elrs_metrics", __name__)
+
+    @blueprint.route(METRICS_ROUTE)
+    def metrics() -> Response:
+        return Response(collect(), content_type=CONTENT_TYPE)
+
+    return blueprint
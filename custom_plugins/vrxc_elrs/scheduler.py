@@ -0,0 +1,243 @@
+import logging
+import time
+from collections.abc import Callable
+from typing import Any, Union
+
+import gevent
+import gevent.event
+import gevent.pool
+from gevent.queue import Queue
+
+from .metrics import Metrics
+from .tracing import Transaction, current_transaction
+
+DEFAULT_POOL_SIZE = 8
+DEFAULT_QUEUE_SIZE = 256
+
+logger = logging.getLogger(__name__)
+
+
+class OSDScheduler:
+    """
+    Runs OSD fan-out work on a bounded pool of greenlets.
+
+    Jobs are buffered in a queue and dispatched into the pool as
+    workers become available, so bursts of RotorHazard events never
+    block the caller or create unbounded greenlets. At most
+    `queue_size` droppable jobs wait at a time; further droppable
+    jobs are rejected. Critical jobs, such as race control messages
+    and row clears, are never dropped. Jobs run as transactions of
+    the event that submitted them.
+    """
+
+    _dispatcher: Union[gevent.Greenlet, None] = None
+
+    def __init__(
+        self,
+        size: int = DEFAULT_POOL_SIZE,
+        metrics: Union[Metrics, None] = None,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+    ):
+        """
+        :param size: The maximum number of concurrent workers
+        :param metrics: Records how long jobs wait and run when provided
+        :param queue_size: The maximum number of droppable jobs waiting for a worker
+        """
+        self._size = max(size, 1)
+        self._workers = gevent.pool.Group()
+        self._available = gevent.event.Event()
+        self._jobs: Queue = Queue()
+        self._queue_size = max(queue_size, 1)
+        self._droppable = 0
+        self._max_queue_depth = 0
+        self._dropped = 0
+        self._metrics = metrics
+
+    @property
+    def size(self) -> int:
+        """
+        The maximum number of concurrent workers
+        """
+        return self._size
+
+    @property
+    def active(self) -> int:
+        """
+        The number of workers currently running
+        """
+        return len(self._workers)
+
+    @property
+    def queue_depth(self) -> int:
+        """
+        The number of jobs waiting for a worker
+        """
+        return self._jobs.qsize()
+
+    @property
+    def max_queue_depth(self) -> int:
+        """
+        The largest queue depth seen since startup
+        """
+        return self._max_queue_depth
+
+    @property
+    def dropped(self) -> int:
+        """
+        The number of droppable jobs rejected by a full queue since startup
+        """
+        return self._dropped
+
+    def resize(self, size: int) -> None:
+        """
+        Changes the number of concurrent workers. When shrinking,
+        running workers are allowed to finish and no new worker
+        starts until fewer than the new size are running.
+
+        :param size: The new pool size
+        """
+        size = max(size, 1)
+        if size == self._size:
+            return
+
+        logger.info("Resizing OSD worker pool to %s", size)
+        self._size = size
+        self._available.set()
+
+    def submit(self, func: Callable[..., Any], *args, critical: bool = False) -> bool:
+        """
+        Queues a job to run on the worker pool
+
+        :param func: The function to run
+        :param critical: Never drop the job, even when the queue is full
+        :return: Whether the job was queued
+        """
+        return self._enqueue(current_transaction(), func, args, critical)
+
+    def submit_later(
+        self, delay: float, func: Callable[..., Any], *args, critical: bool = False
+    ) -> "DelayedJob":
+        """
+        Queues a job to run on the worker pool after a delay
+
+        :param delay: Seconds to wait before queueing the job
+        :param func: The function to run
+        :param critical: Never drop the job, even when the queue is full
+        :return: The delayed job, which can be cancelled until it is queued
+        """
+        return DelayedJob(delay, self._enqueue, None, func, args, critical)
+
+    def _enqueue(
+        self,
+        transaction: Union[Transaction, None],
+        func: Callable[..., Any],
+        args: tuple,
+        critical: bool,
+    ) -> bool:
+        """
+        Puts a job in the queue. A droppable job is rejected when
+        the queue already holds the maximum of droppable jobs, so
+        jobs that were accepted are never lost.
+
+        :param transaction: The transaction of the submitting event
+        :param func: The function to run
+        :param args: The arguments of the function
+        :param critical: Whether the job may be dropped
+        :return: Whether the job was queued
+        """
+        if not critical:
+            if self._droppable >= self._queue_size:
+                self._dropped += 1
+                if self._metrics is not None:
+                    self._metrics.increment("osd_jobs_dropped")
+                return False
+
+            self._droppable += 1
+
+        self._jobs.put_nowait((time.perf_counter(), transaction, func, args, critical))
+        self._max_queue_depth = max(self._max_queue_depth, self._jobs.qsize())
+
+        if self._dispatcher is None:
+            self._dispatcher = gevent.spawn(self._dispatch)
+
+        return True
+
+    def _dispatch(self) -> None:
+        """
+        Moves queued jobs into the pool as workers free up
+        """
+        while True:
+            queued, transaction, func, args, critical = self._jobs.get()
+            if not critical:
+                self._droppable -= 1
+
+            # Waits here until a worker is free
+            while len(self._workers) >= self._size:
+                self._available.clear()
+                self._available.wait()
+
+            if self._metrics is not None:
+                wait = time.perf_counter() - queued
+                self._metrics.observe("osd_job_wait_seconds", wait)
+
+            worker = self._workers.spawn(self._run, transaction, func, args)
+            worker.link(lambda _: self._available.set())
+
+    def _run(
+        self,
+        transaction: Union[Transaction, None],
+        func: Callable[..., Any],
+        args: tuple,
+    ) -> None:
+        """
+        Runs a job and records its duration
+
+        :param transaction: The transaction of the submitting event
+        :param func: The function to run
+        :param args: The arguments of the function
+        """
+        start = time.perf_counter()
+        try:
+            if transaction is None:
+                func(*args)
+            else:
+                tracer = transaction.tracer
+                with tracer.transaction(transaction.event, transaction.started):
+                    func(*args)
+        finally:
+            if self._metrics is not None:
+                self._metrics.observe("osd_job_seconds", time.perf_counter() - start)
+
+
+class DelayedJob:
+    """
+    A job queued after a delay. The delay runs on a timer of the
+    event loop rather than a greenlet of its own.
+    """
+
+    def __init__(
+        self,
+        delay: float,
+        enqueue: Callable[..., bool],
+        *job,
+    ):
+        """
+        :param delay: Seconds to wait before queueing the job
+        :param enqueue: Queues the job once the delay has passed
+        :param job: The transaction, function, arguments and criticality of the job
+        """
+        self._timer = gevent.get_hub().loop.timer(max(delay, 0.0))
+        self._timer.start(enqueue, *job)
+
+    @property
+    def pending(self) -> bool:
+        """
+        Whether the job is still waiting for its delay to pass
+        """
+        return self._timer.active
+
+    def cancel(self) -> None:
+        """
+        Cancels the job if it has not been queued yet
+        """
+        self._timer.close()
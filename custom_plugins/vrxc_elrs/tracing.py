@@ -0,0 +1,215 @@
+"""
+Tracing of OSD transactions from the RotorHazard event that
+caused them until their bytes are written to the backpack
+"""
+
+import functools
+import logging
+import time
+from collections.abc import Callable, Generator
+from contextlib import contextmanager
+from typing import Any, Union
+
+import gevent.local
+import gevent.lock
+from gevent.queue import Queue
+
+from .metrics import Metrics
+
+DEFAULT_SLOW_TRANSACTION_MS = 250
+
+logger = logging.getLogger(__name__)
+
+_context = gevent.local.local()
+
+
+class Transaction:
+    """
+    The OSD packets queued on behalf of one event. Each pilot's
+    job of an event is a separate transaction sharing the event's
+    start time. A transaction sending through several backpack
+    links is complete once every link has written its packets.
+    """
+
+    def __init__(self, tracer: "Tracer", event: str, started: float):
+        """
+        :param tracer: The tracer recording the transaction
+        :param event: The name of the originating event
+        :param started: `time.perf_counter` when the event was handled
+        """
+        self.tracer = tracer
+        self.event = event
+        self.started = started
+        self.lock_wait = 0.0
+        self.queued: Union[float, None] = None
+        self._pending = 0
+        self.send_queues: list[Queue] = []
+
+    def mark_queued(self, send_queue: Queue) -> None:
+        """
+        Records that the transaction queued a packet
+
+        :param send_queue: The send queue the packet was put in
+        """
+        if self.queued is None:
+            self.queued = time.perf_counter()
+
+        if not any(queue is send_queue for queue in self.send_queues):
+            self.send_queues.append(send_queue)
+
+    def complete(self, write_start: float, write_end: float) -> None:
+        """
+        Called by the connection once the transaction's packets
+        have been written
+
+        :param write_start: `time.perf_counter` before the write
+        :param write_end: `time.perf_counter` after the write
+        """
+        self._pending -= 1
+        if self._pending == 0:
+            self.tracer.complete(self, write_start, write_end)
+
+    def emit(self) -> None:
+        """
+        Puts the finished transaction behind its packets in
+        each send queue it used
+        """
+        self._pending = len(self.send_queues)
+        for queue in self.send_queues:
+            queue.put(self)
+
+
+def current_transaction() -> Union[Transaction, None]:
+    """
+    The transaction of the running greenlet
+
+    :return: The transaction, or None outside of a traced event
+    """
+    return getattr(_context, "transaction", None)
+
+
+class Tracer:
+    """
+    Records the latency of transactions per event. The time from
+    the event until the write is split into waiting for the queue
+    lock, waiting in the send queue and writing.
+    """
+
+    def __init__(self, metrics: Metrics):
+        """
+        :param metrics: Receives the latency histograms
+        """
+        self.slow_threshold = DEFAULT_SLOW_TRANSACTION_MS / 1000
+        self._metrics = metrics
+
+    @contextmanager
+    def transaction(
+        self, event: str, started: Union[float, None] = None
+    ) -> Generator[Transaction, None, None]:
+        """
+        Makes a transaction current for the running greenlet. A
+        transaction already running is reused, so nested handlers
+        count towards the outer event.
+
+        :param event: The name of the originating event
+        :param started: When the event was handled, defaults to now
+        :yield: The current transaction
+        """
+        if (transaction := current_transaction()) is not None:
+            yield transaction
+            return
+
+        if started is None:
+            started = time.perf_counter()
+
+        transaction = Transaction(self, event, started)
+        _context.transaction = transaction
+        try:
+            yield transaction
+        finally:
+            _context.transaction = None
+            if transaction.queued is not None:
+                transaction.emit()
+
+    def complete(
+        self, transaction: Transaction, write_start: float, write_end: float
+    ) -> None:
+        """
+        Records the latency of a written transaction
+
+        :param transaction: The transaction
+        :param write_start: `time.perf_counter` before the write
+        :param write_end: `time.perf_counter` after the write
+        """
+        assert transaction.queued is not None
+
+        total = write_end - transaction.started
+        queued = max(write_start - transaction.queued, 0.0)
+        writing = write_end - write_start
+
+        for stage, seconds in (
+            ("total", total),
+            ("lock", transaction.lock_wait),
+            ("queue", queued),
+            ("write", writing),
+        ):
+            self._metrics.observe(
+                "transaction_seconds", seconds, event=transaction.event, stage=stage
+            )
+
+        if self.slow_threshold and total > self.slow_threshold:
+            logger.warning(
+                "Slow %s transaction: %.1f ms total, %.1f ms waiting for the lock, "
+                "%.1f ms queued, %.1f ms writing",
+                transaction.event,
+                total * 1000,
+                transaction.lock_wait * 1000,
+                queued * 1000,
+                writing * 1000,
+            )
+
+
+def traced(event: str) -> Callable:
+    """
+    Runs a method of the controller as a transaction of an event
+
+    :param event: The name of the event
+    :return: The decorator
+    """
+
+    def decorator(method: Callable) -> Callable:
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs) -> Any:
+            with self._tracer.transaction(event):
+                return method(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class TracedLock:
+    """
+    A reentrant lock that adds the time spent waiting for it
+    to the current transaction
+    """
+
+    def __init__(self) -> None:
+        self._lock = gevent.lock.RLock()
+
+    def acquire(self, blocking: bool = True, timeout: Union[float, None] = None):
+        start = time.perf_counter()
+        acquired = self._lock.acquire(blocking, timeout)
+        if (transaction := current_transaction()) is not None:
+            transaction.lock_wait += time.perf_counter() - start
+
+        return acquired
+
+    def release(self) -> None:
+        self._lock.release()
+
+    def __enter__(self) -> bool:
+        return self.acquire()
+
+    def __exit__(self, *_) -> None:
+        self.release()
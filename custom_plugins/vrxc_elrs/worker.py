@@ -0,0 +1,551 @@
+"""
+Backpack I/O in a worker process, so encoding packets and
+writing them to the backpack never hold up the timer's hub
+"""
+
+import itertools
+import json
+import logging
+import os
+import struct
+import sys
+import time
+from enum import IntEnum
+from typing import BinaryIO, Union
+
+import gevent
+import gevent.lock
+import gevent.subprocess
+from gevent.fileobject import FileObjectPosix
+from gevent.queue import Queue
+
+from .capture import Direction, WireRecorder
+from .connections import (
+    BackpackConnection,
+    SerialConnection,
+    SocketConnection,
+    complete_transactions,
+    drain_burst,
+    record_drop,
+)
+from .metrics import Metrics
+from .msp import MSPPacket, MSPPacketType, MSPTypes
+from .tracing import Transaction
+
+FRAME_HEADER = struct.Struct("<BI")
+PACKET_HEADER = struct.Struct("<BBHH")
+PACKET_INDEX = struct.Struct("<H")
+BURST_HEADER = struct.Struct("<I")
+WRITTEN = struct.Struct("<Id?")
+WORKER_CONNECT_TIMEOUT = 60
+WORKER_CLOSE_TIMEOUT = 2
+WORKER_POLL_INTERVAL = 0.25
+WORKER_CONNECTIONS = {
+    SerialConnection.__name__: SerialConnection,
+    SocketConnection.__name__: SocketConnection,
+}
+PLUGIN_PATH = os.path.dirname(os.path.abspath(__file__))
+
+# The worker imports the plugin's modules without running the
+# package's __init__, which needs the RotorHazard server
+WORKER_BOOTSTRAP = (
+    "import gevent.monkey; gevent.monkey.patch_all()\n"
+    "import importlib, sys, types\n"
+    "package = types.ModuleType(sys.argv[2])\n"
+    "package.__path__ = [sys.argv[1]]\n"
+    "sys.modules[sys.argv[2]] = package\n"
+    "importlib.import_module(sys.argv[2] + '.worker').run_worker()\n"
+)
+
+logger = logging.getLogger(__name__)
+
+
+class FrameKind(IntEnum):
+    CONNECT = 1
+    CONNECTED = 2
+    BURST = 3
+    WRITTEN = 4
+    PACKET = 5
+    CAPTURE = 6
+    COUNTERS = 7
+    CLOSE = 8
+
+
+class FramePipe:
+    """
+    Frames exchanged between the timer and the worker. Each
+    frame is a `FRAME_HEADER` of the kind and body length,
+    followed by the body.
+    """
+
+    def __init__(self, reader: BinaryIO, writer: BinaryIO):
+        """
+        :param reader: The pipe frames are read from
+        :param writer: The pipe frames are written to
+        """
+        self._reader = reader
+        self._writer = writer
+        self._lock = gevent.lock.Semaphore()
+
+    def send(self, kind: FrameKind, body: bytes = b"") -> None:
+        """
+        Writes a frame
+
+        :param kind: The kind of frame
+        :param body: The body of the frame
+        """
+        with self._lock:
+            self._writer.write(FRAME_HEADER.pack(kind, len(body)) + body)
+            self._writer.flush()
+
+    def receive(self) -> Union[tuple[FrameKind, bytes], None]:
+        """
+        Reads the next frame
+
+        :return: The kind and body of the frame, or None once the pipe is closed
+        """
+        if (header := self._read(FRAME_HEADER.size)) is None:
+            return None
+
+        kind, length = FRAME_HEADER.unpack(header)
+        if (body := self._read(length)) is None:
+            return None
+
+        return FrameKind(kind), body
+
+    def _read(self, size: int) -> Union[bytes, None]:
+        data = b""
+        while len(data) < size:
+            if not (chunk := self._reader.read(size - len(data))):
+                return None
+
+            data += chunk
+
+        return data
+
+
+def encode_packet(packet: MSPPacket) -> bytes:
+    """
+    Encodes a packet as a `PACKET_HEADER` of its type, flags,
+    function and payload length, followed by the payload. The
+    checksum is left to the receiving side.
+
+    :param packet: The packet
+    :return: The encoded packet
+    """
+    payload = packet.payload
+    return (
+        PACKET_HEADER.pack(packet.type_, packet.flags, packet.function, len(payload))
+        + payload
+    )
+
+
+def decode_packet(data: bytes, offset: int = 0) -> tuple[MSPPacket, int]:
+    """
+    Decodes a packet encoded by `encode_packet`
+
+    :param data: The encoded data
+    :param offset: Where the packet starts in the data
+    :return: The packet and the offset after it
+    """
+    type_, flags, function, length = PACKET_HEADER.unpack_from(data, offset)
+    offset += PACKET_HEADER.size
+
+    packet = MSPPacket()
+    packet.set_type(MSPPacketType(type_))
+    packet.set_flags(flags)
+    packet.set_function(MSPTypes(function))
+    packet.set_payload(data[offset : offset + length])
+    return packet, offset + length
+
+
+def encode_burst(burst: int, packets: list[MSPPacket]) -> bytes:
+    """
+    Encodes a burst of packets. Each packet is a `PACKET_INDEX`
+    into the distinct packets of the burst. An index that has not
+    been seen yet is followed by the encoded packet, so a packet
+    sent to several pilots is only passed to the worker once.
+
+    :param burst: The number the worker acknowledges the burst with
+    :param packets: The packets of the burst
+    :return: The encoded burst
+    """
+    body = [BURST_HEADER.pack(burst)]
+    indexes: dict[int, int] = {}
+    for packet in packets:
+        if (index := indexes.get(id(packet))) is not None:
+            body.append(PACKET_INDEX.pack(index))
+        else:
+            index = indexes[id(packet)] = len(indexes)
+            body += (PACKET_INDEX.pack(index), encode_packet(packet))
+
+    return b"".join(body)
+
+
+def decode_burst(data: bytes) -> tuple[int, list[MSPPacket]]:
+    """
+    Decodes a burst encoded by `encode_burst`. Repeated packets
+    are the same object, so the connection only computes their
+    checksum once.
+
+    :param data: The encoded burst
+    :return: The number of the burst and its packets
+    """
+    (burst,) = BURST_HEADER.unpack_from(data)
+    offset = BURST_HEADER.size
+    distinct: list[MSPPacket] = []
+    packets: list[MSPPacket] = []
+    while offset < len(data):
+        (index,) = PACKET_INDEX.unpack_from(data, offset)
+        offset += PACKET_INDEX.size
+        if index == len(distinct):
+            packet, offset = decode_packet(data, offset)
+            distinct.append(packet)
+
+        packets.append(distinct[index])
+
+    return burst, packets
+
+
+class WorkerConnection:
+    """
+    Runs a backpack connection in a worker process. Bursts from
+    the send queue are passed to the worker, which encodes and
+    writes them, and the packets it receives are passed back.
+    Counters of the worker's connection are added to this
+    connection's metrics.
+    """
+
+    _process: Union[gevent.subprocess.Popen, None] = None
+    _pipe: Union[FramePipe, None] = None
+    _send_greenlet: Union[gevent.Greenlet, None] = None
+    _recieve_greenlet: Union[gevent.Greenlet, None] = None
+
+    def __init__(
+        self,
+        send_queue: Queue,
+        recieve_queue: Queue,
+        connection_type: type[BackpackConnection],
+    ):
+        """
+        :param send_queue: The queue of packets to send
+        :param recieve_queue: The queue received packets are put in
+        :param connection_type: The connection the worker runs
+        """
+        self._connected = False
+        self._send_queue = send_queue
+        self._recieve_queue = recieve_queue
+        self._connection_type = connection_type
+        self._recorder: Union[WireRecorder, None] = None
+        self._bursts = itertools.count(1)
+        self._pending: dict[int, list[Transaction]] = {}
+        self.metrics = Metrics()
+
+    @property
+    def connected(self) -> bool:
+        return self._connected
+
+    @property
+    def recorder(self) -> Union[WireRecorder, None]:
+        return self._recorder
+
+    @recorder.setter
+    def recorder(self, recorder: Union[WireRecorder, None]) -> None:
+        self._recorder = recorder
+        if self._connected:
+            self._send_capture()
+
+    def _send_capture(self) -> None:
+        assert self._pipe is not None
+        self._pipe.send(FrameKind.CAPTURE, bytes((self._recorder is not None,)))
+
+    def connect(self, **kwargs) -> bool:
+        """
+        Starts the worker and waits for it to connect to the backpack
+
+        :return: Whether the backpack was found
+        """
+        try:
+            self._process = gevent.subprocess.Popen(
+                [sys.executable, "-c", WORKER_BOOTSTRAP, PLUGIN_PATH, __package__],
+                stdin=gevent.subprocess.PIPE,
+                stdout=gevent.subprocess.PIPE,
+            )
+        except OSError:
+            logger.exception("Failed to start the backpack worker")
+            return False
+
+        assert self._process.stdin is not None and self._process.stdout is not None
+        self._pipe = FramePipe(self._process.stdout, self._process.stdin)
+
+        request = {"connection": self._connection_type.__name__, "kwargs": kwargs}
+        frame = None
+        try:
+            self._pipe.send(FrameKind.CONNECT, json.dumps(request).encode())
+            with gevent.Timeout(WORKER_CONNECT_TIMEOUT, False):
+                frame = self._pipe.receive()
+        except OSError:
+            logger.exception("Failed to start the backpack worker")
+
+        if frame != (FrameKind.CONNECTED, b"\x01"):
+            self._stop_worker()
+            return False
+
+        self._connected = True
+        if self._recorder is not None:
+            self._send_capture()
+
+        self._send_greenlet = gevent.spawn(self._send)
+        self._recieve_greenlet = gevent.spawn(self._recieve)
+        return True
+
+    def _send(self) -> None:
+        """
+        Passes bursts from the send queue to the worker
+        """
+        assert self._pipe is not None
+
+        try:
+            while self._connected:
+                packets, transactions = drain_burst(self._send_queue)
+                burst = next(self._bursts) & 0xFFFFFFFF
+                self._pending[burst] = transactions
+                self._pipe.send(FrameKind.BURST, encode_burst(burst, packets))
+
+        except OSError:
+            logger.warning("Lost the backpack worker")
+
+        finally:
+            record_drop(self.metrics, self._connected)
+            self._send_greenlet = None
+            self.disconnect()
+
+    def _recieve(self) -> None:
+        """
+        Handles the frames sent by the worker
+        """
+        assert self._pipe is not None
+
+        try:
+            while (frame := self._pipe.receive()) is not None:
+                kind, body = frame
+
+                if kind == FrameKind.PACKET:
+                    self._recieve_queue.put(decode_packet(body)[0])
+
+                elif kind == FrameKind.WRITTEN:
+                    burst, seconds, first = WRITTEN.unpack(body)
+                    if first:
+                        self.metrics.observe("write_seconds", seconds)
+
+                    now = time.perf_counter()
+                    complete_transactions(
+                        self._pending.pop(burst, []), now - seconds, now
+                    )
+
+                elif kind == FrameKind.CAPTURE:
+                    if self._recorder is not None:
+                        self._recorder.record(Direction(body[0]), body[1:])
+
+                elif kind == FrameKind.COUNTERS:
+                    for name, value in json.loads(body).items():
+                        self.metrics.increment(name, value)
+
+        except OSError:
+            logger.warning("Lost the backpack worker")
+
+        finally:
+            record_drop(self.metrics, self._connected)
+            self._recieve_greenlet = None
+            self.disconnect()
+
+    def disconnect(self):
+        """
+        Closes the backpack connection and stops the worker
+        """
+        self._connected = False
+
+        if self._send_greenlet is not None:
+            self._send_greenlet.kill()
+
+        if self._recieve_greenlet is not None:
+            self._recieve_greenlet.kill()
+
+        self._stop_worker()
+        self._pending.clear()
+
+    def _stop_worker(self) -> None:
+        if self._process is None:
+            return
+
+        process, self._process = self._process, None
+        if process.poll() is None and self._pipe is not None:
+            try:
+                self._pipe.send(FrameKind.CLOSE)
+                process.wait(timeout=WORKER_CLOSE_TIMEOUT)
+            except (OSError, gevent.subprocess.TimeoutExpired):
+                process.kill()
+                process.wait()
+
+        for pipe in (process.stdin, process.stdout):
+            if pipe is not None:
+                pipe.close()
+
+
+class _WrittenBurst(Transaction):
+    """
+    Stands in for the transactions of a burst in the worker,
+    reporting back to the timer once the burst is written
+    """
+
+    def __init__(self, worker: "_Worker", burst: int):
+        self._worker = worker
+        self._burst = burst
+
+    def complete(self, write_start: float, write_end: float) -> None:
+        self._worker.written(self._burst, write_start, write_end)
+
+
+class _CaptureForwarder:
+    """
+    Passes the traffic of the worker's connection to the
+    timer's recorder
+    """
+
+    def __init__(self, pipe: FramePipe):
+        self._pipe = pipe
+
+    def record(self, direction: Direction, data: bytes) -> None:
+        if data:
+            self._pipe.send(FrameKind.CAPTURE, bytes((direction,)) + data)
+
+
+class _Worker:
+    """
+    The worker process's side of a `WorkerConnection`
+    """
+
+    _connection: Union[BackpackConnection, None] = None
+
+    def __init__(self, pipe: FramePipe):
+        self._pipe = pipe
+        self._send_queue = Queue()
+        self._recieve_queue = Queue()
+        self._sent_counters: dict[str, int] = {}
+        self._last_write: Union[tuple[float, float], None] = None
+
+    def run(self) -> None:
+        """
+        Connects to the backpack and relays frames until the
+        timer closes the worker or the connection is lost
+        """
+        if (frame := self._pipe.receive()) is None or frame[0] != FrameKind.CONNECT:
+            return
+
+        request = json.loads(frame[1])
+        connection = WORKER_CONNECTIONS[request["connection"]](
+            self._send_queue, self._recieve_queue
+        )
+        if not connection.connect(**request["kwargs"]):
+            self._pipe.send(FrameKind.CONNECTED, b"\x00")
+            return
+
+        self._connection = connection
+        self._pipe.send(FrameKind.CONNECTED, b"\x01")
+
+        reader = gevent.spawn(self._read_frames)
+        forwarder = gevent.spawn(self._forward_packets)
+        try:
+            while connection.connected and not reader.dead:
+                reader.join(WORKER_POLL_INTERVAL)
+                self._send_counters()
+
+        finally:
+            if connection.connected:
+                connection.disconnect()
+
+            forwarder.kill()
+            reader.kill()
+            self._send_counters()
+
+    def _read_frames(self) -> None:
+        assert self._connection is not None
+
+        while (frame := self._pipe.receive()) is not None:
+            kind, body = frame
+
+            if kind == FrameKind.BURST:
+                burst, packets = decode_burst(body)
+                for packet in packets:
+                    self._send_queue.put(packet)
+
+                self._send_queue.put(_WrittenBurst(self, burst))
+
+            elif kind == FrameKind.CAPTURE:
+                self._connection.recorder = (
+                    _CaptureForwarder(self._pipe) if body[0] else None
+                )
+
+            elif kind == FrameKind.CLOSE:
+                return
+
+    def _forward_packets(self) -> None:
+        while True:
+            packet: MSPPacket = self._recieve_queue.get()
+            self._pipe.send(FrameKind.PACKET, encode_packet(packet))
+
+    def written(self, burst: int, write_start: float, write_end: float) -> None:
+        """
+        Reports a written burst to the timer. Bursts the connection
+        wrote together share the write, which is only timed once.
+
+        :param burst: The number of the burst
+        :param write_start: `time.perf_counter` before the write
+        :param write_end: `time.perf_counter` after the write
+        """
+        first = (write_start, write_end) != self._last_write
+        self._last_write = (write_start, write_end)
+        self._pipe.send(
+            FrameKind.WRITTEN, WRITTEN.pack(burst, write_end - write_start, first)
+        )
+
+    def _send_counters(self) -> None:
+        """
+        Sends the counters that changed since they were last sent.
+        Drops are counted by the timer when the worker exits.
+        """
+        assert self._connection is not None
+
+        changes = {
+            name: value - self._sent_counters.get(name, 0)
+            for name, value in self._connection.metrics.counters.items()
+            if name != "drops" and value != self._sent_counters.get(name, 0)
+        }
+        if changes:
+            self._sent_counters.update(
+                {name: self._connection.metrics.counters[name] for name in changes}
+            )
+            self._pipe.send(FrameKind.COUNTERS, json.dumps(changes).encode())
+
+
+def run_worker() -> None:
+    """
+    Runs the worker process. Frames are read from stdin and
+    written to stdout, so anything else printed is moved to stderr.
+    """
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s ELRS worker %(levelname)s: %(message)s",
+    )
+
+    output = os.dup(sys.stdout.fileno())
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+
+    pipe = FramePipe(
+        FileObjectPosix(sys.stdin.fileno(), "rb", close=False),
+        FileObjectPosix(output, "wb"),
+    )
+    try:
+        _Worker(pipe).run()
+    except OSError:
+        logger.exception("Lost the connection to the timer")
@@ -0,0 +1,41 @@
+"""
+Makes the plugin importable without a RotorHazard server
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import pytest  # noqa: E402
+
+from benchmarks.fake_rhapi import (  # noqa: E402
+    FakeRHAPI,
+    install_stubs,
+    load_controller,
+)
+
+install_stubs()
+
+PILOTS = 4
+
+
+@pytest.fixture
+def rhapi() -> FakeRHAPI:
+    rhapi = FakeRHAPI()
+    rhapi.db.options["_critical_repeats"] = 0
+    for seat in range(PILOTS):
+        pilot_id = seat + 1
+        rhapi.race.pilots[seat] = pilot_id
+        rhapi.race.seats_finished[seat] = False
+        rhapi.db.pilot_attributes[(pilot_id, "elrs_active")] = "1"
+
+    return rhapi
+
+
+@pytest.fixture
+def controller(rhapi: FakeRHAPI):
+    controller = load_controller(rhapi)
+    yield controller
+    for link in controller._links:
+        link.disconnect()
@@ -0,0 +1,107 @@
+from vrxc_elrs.connections import SendUIDTracker
+from vrxc_elrs.msp import MSPPacket, MSPTypes
+
+PILOT_A = bytes.fromhex("0102030405a0")
+PILOT_B = bytes.fromhex("0102030405b0")
+
+
+def set_uid(address: bytes) -> MSPPacket:
+    packet = MSPPacket()
+    packet.set_function(MSPTypes.MSP_ELRS_SET_SEND_UID)
+    packet.set_payload(bytearray([0x01]) + address)
+    return packet
+
+
+def reset_uid() -> MSPPacket:
+    packet = MSPPacket()
+    packet.set_function(MSPTypes.MSP_ELRS_SET_SEND_UID)
+    packet.set_payload(bytearray([0x00]))
+    return packet
+
+
+def osd_text(text: str) -> MSPPacket:
+    packet = MSPPacket()
+    packet.set_function(MSPTypes.MSP_ELRS_SET_OSD)
+    packet.set_payload(bytearray([0x03, 0, 0, 0]) + text.encode())
+    return packet
+
+
+def version() -> MSPPacket:
+    packet = MSPPacket()
+    packet.set_function(MSPTypes.MSP_ELRS_GET_BACKPACK_VERSION)
+    return packet
+
+
+def written(tracker: SendUIDTracker, *packets: MSPPacket) -> list[MSPPacket]:
+    return [packet_ for packet in packets for packet_ in tracker.filter(packet)]
+
+
+def test_set_is_written_before_the_first_packet():
+    tracker = SendUIDTracker()
+    set_a, text = set_uid(PILOT_A), osd_text("A")
+
+    assert written(tracker, set_a, text) == [set_a, text]
+
+
+def test_set_to_the_current_address_is_skipped():
+    tracker = SendUIDTracker()
+    written(tracker, set_uid(PILOT_A), osd_text("A"))
+    text = osd_text("A")
+
+    assert written(tracker, set_uid(PILOT_A), text) == [text]
+
+
+def test_only_the_last_pending_set_is_written():
+    tracker = SendUIDTracker()
+    set_b, text = set_uid(PILOT_B), osd_text("B")
+
+    assert written(tracker, set_uid(PILOT_A), set_b, text) == [set_b, text]
+
+
+def test_pending_set_without_a_packet_is_not_written():
+    tracker = SendUIDTracker()
+
+    assert written(tracker, set_uid(PILOT_A), reset_uid(), set_uid(PILOT_B)) == []
+
+
+def test_change_of_address_is_written():
+    tracker = SendUIDTracker()
+    written(tracker, set_uid(PILOT_A), osd_text("A"))
+    set_b, text = set_uid(PILOT_B), osd_text("B")
+
+    assert written(tracker, set_b, text) == [set_b, text]
+
+
+def test_reset_is_written_once_after_a_set():
+    tracker = SendUIDTracker()
+    written(tracker, set_uid(PILOT_A), osd_text("A"))
+    reset, first, second = reset_uid(), osd_text("1"), osd_text("2")
+
+    assert written(tracker, reset, first, reset_uid(), second) == [
+        reset,
+        first,
+        second,
+    ]
+
+
+def test_set_back_to_the_address_before_a_skipped_reset_is_skipped():
+    tracker = SendUIDTracker()
+    written(tracker, set_uid(PILOT_A), osd_text("A"))
+    text = osd_text("A")
+
+    assert written(tracker, reset_uid(), set_uid(PILOT_A), text) == [text]
+
+
+def test_local_packets_do_not_consume_the_pending_set():
+    tracker = SendUIDTracker()
+    set_a, ping, text = set_uid(PILOT_A), version(), osd_text("A")
+
+    assert written(tracker, set_a, ping, text) == [ping, set_a, text]
+
+
+def test_encode_joins_the_written_packets():
+    tracker = SendUIDTracker()
+    set_a, text = set_uid(PILOT_A), osd_text("A")
+    expected = set_a.get_packet() + text.get_packet()
+
+    assert tracker.encode([set_a, text, set_uid(PILOT_A)]) == expected
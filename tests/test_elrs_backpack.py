@@ -0,0 +1,327 @@
+import types
+
+import gevent
+from vrxc_elrs import elrs_backpack
+from vrxc_elrs.heartbeat import LinkState
+from vrxc_elrs.msp import MSPTypes
+from vrxc_elrs.osd import OSD_COLUMNS
+from vrxc_elrs.scheduler import OSDScheduler
+
+from benchmarks.fake_rhapi import CountingConnection, WinCondition, wait_idle
+
+
+def osd_texts(controller) -> list[bytes]:
+    """
+    The text written to the OSD rows of every link, in order
+    """
+    return [
+        packet.payload[4:]
+        for link in controller._links
+        for packet in link.connection.sent
+        if packet.function == MSPTypes.MSP_ELRS_SET_OSD and packet.payload[0] == 0x03
+    ]
+
+
+def lap_args(pilot_id: int, standings: list[tuple[int, int]]) -> dict:
+    """
+    The arguments of a recorded lap
+
+    :param pilot_id: The pilot that completed the lap
+    :param standings: The pilot id and laps of each position
+    """
+    results = [
+        {"pilot_id": pilot, "position": position, "laps": laps}
+        for position, (pilot, laps) in enumerate(standings, 1)
+    ]
+    laps = dict(standings)[pilot_id]
+    gap_info = types.SimpleNamespace(
+        race=types.SimpleNamespace(win_condition=WinCondition.NONE),
+        current=types.SimpleNamespace(
+            lap_number=laps, last_lap_time=30000, total_time_laps=laps * 30000
+        ),
+    )
+    return {
+        "pilot_id": pilot_id,
+        "results": {"by_race_time": results},
+        "gap_info": gap_info,
+    }
+
+
+def start_text(controller) -> bytes:
+    return controller._get_layout().render("racing", "start").data
+
+
+def test_every_staged_race_is_started(controller):
+    for _ in range(2):
+        controller.onRaceStage({"heat_id": 1})
+        controller.onRaceStart()
+        wait_idle(controller)
+
+    assert osd_texts(controller).count(start_text(controller)) == 8
+
+
+def test_race_staged_without_backpack_is_started(controller):
+    connection = controller._links[0].connection
+    controller.onRaceStage({"heat_id": 1})
+    controller.onRaceStart()
+
+    connection.connected = False
+    controller.onRaceStage({"heat_id": 1})
+    connection.connected = True
+    controller.onRaceStart()
+    wait_idle(controller)
+
+    assert osd_texts(controller).count(start_text(controller)) == 8
+
+
+def test_dropped_position_update_is_sent_with_the_next_lap(rhapi, controller):
+    rhapi.db.options["_position_mode"] = "1"
+    controller._scheduler = OSDScheduler(size=1, queue_size=1)
+    standings = [(1, 0), (2, 0), (3, 0), (4, 0)]
+
+    controller.onRaceLapRecorded(lap_args(1, standings))
+    assert list(controller._lap_states) == [1]
+
+    controller._scheduler = OSDScheduler()
+    controller.onRaceLapRecorded(lap_args(1, standings))
+    assert list(controller._lap_states) == [1, 2, 3, 4]
+
+
+def cleared_rows(controller) -> list[int]:
+    return [
+        packet.payload[1]
+        for link in controller._links
+        for packet in link.connection.sent
+        if packet.function == MSPTypes.MSP_ELRS_SET_OSD
+        and packet.payload[0] == 0x03
+        and packet.payload[4:] == bytes(OSD_COLUMNS)
+    ]
+
+
+def test_expired_row_is_cleared(controller):
+    uid = bytes(controller.get_pilot_uid(1))
+    generation = controller._claim_row(uid, 5)
+
+    controller._expire_row(uid, 5, generation, 0.001)
+    gevent.sleep(0.01)
+    wait_idle(controller)
+
+    assert cleared_rows(controller) == [5]
+    assert (uid, 5) not in controller._row_owners
+
+
+def test_newer_message_takes_over_the_row(controller):
+    uid = bytes(controller.get_pilot_uid(1))
+    old = controller._claim_row(uid, 5)
+    controller._expire_row(uid, 5, old, 0.001)
+
+    new = controller._claim_row(uid, 5)
+    gevent.sleep(0.01)
+    wait_idle(controller)
+
+    assert new != old
+    assert controller._row_owners[(uid, 5)] == new
+    assert (uid, 5) not in controller._row_expiries
+    assert cleared_rows(controller) == []
+
+
+def test_stale_clear_keeps_the_newer_text(controller):
+    uid = bytes(controller.get_pilot_uid(1))
+    old = controller._claim_row(uid, 5)
+    new = controller._claim_row(uid, 5)
+
+    controller._expire_row(uid, 5, old, 0)
+    controller._clear_owned_row((uid, 5), old)
+    gevent.sleep(0.01)
+    wait_idle(controller)
+
+    assert controller._row_owners[(uid, 5)] == new
+    assert cleared_rows(controller) == []
+
+
+def test_claiming_the_screen_cancels_every_expiry(controller):
+    uid = bytes(controller.get_pilot_uid(1))
+    other = controller.get_pilot_uid(2)
+    for row in (3, 5):
+        controller._expire_row(uid, row, controller._claim_row(uid, row), 0.001)
+    controller._expire_row(other, 5, controller._claim_row(other, 5), 0.001)
+
+    controller._claim_screen(uid)
+    gevent.sleep(0.01)
+    wait_idle(controller)
+
+    assert list(controller._row_owners) == []
+    assert cleared_rows(controller) == [5]
+
+
+def position_writes(controller) -> int:
+    row = controller._get_layout().render("racing", "position", position=1, lap=1).row
+    return sum(
+        1
+        for link in controller._links
+        for packet in link.connection.sent
+        if packet.function == MSPTypes.MSP_ELRS_SET_OSD
+        and packet.payload[:2] == bytes((0x03, row))
+        and packet.payload[4:] != bytes(OSD_COLUMNS)
+    )
+
+
+def test_only_changed_positions_are_sent(rhapi, controller):
+    rhapi.db.options["_position_mode"] = "1"
+    laps = [
+        (1, [(1, 1), (2, 0), (3, 0), (4, 0)]),
+        (2, [(1, 1), (2, 1), (3, 0), (4, 0)]),
+        (4, [(1, 1), (2, 1), (4, 1), (3, 0)]),
+        (3, [(1, 1), (2, 1), (4, 1), (3, 1)]),
+    ]
+
+    writes = []
+    for pilot_id, standings in laps:
+        before = position_writes(controller)
+        controller.onRaceLapRecorded(lap_args(pilot_id, standings))
+        wait_idle(controller)
+        writes.append(position_writes(controller) - before)
+
+    assert writes == [4, 1, 2, 1]
+
+
+def test_group_burst_sets_each_uid_once(controller):
+    uids = [bytes(controller.get_pilot_uid(pilot_id)) for pilot_id in (1, 2, 3)]
+    text = controller.osd_text_packet(4, 0, "GO")
+    display = controller.display_osd_packet()
+
+    controller.send_group(uids, (text, display))
+    controller.send_group(uids[2:], (text, display))
+    controller.send_display_osd()
+    wait_idle(controller)
+
+    sent = [
+        (
+            packet.payload[1:]
+            if packet.function == MSPTypes.MSP_ELRS_SET_SEND_UID
+            else packet.payload[0]
+        )
+        for packet in controller._links[0].connection.sent
+    ]
+    assert sent == [
+        *(value for uid in uids for value in (uid, 0x03, 0x04)),
+        # The second burst continues with the uid already set
+        *(0x03, 0x04),
+        # The reset is written once a packet needs the default address
+        *(b"", 0x04),
+    ]
+
+
+def count_lookups(rhapi, monkeypatch) -> list[str]:
+    """
+    Records the pilot and heat lookups made through the fake database
+    """
+    lookups = []
+
+    def counted(name, lookup):
+        def wrapper(*args):
+            lookups.append(name)
+            return lookup(*args)
+
+        return wrapper
+
+    for name in ("pilot_attribute_value", "pilot_by_id", "heat_by_id"):
+        monkeypatch.setattr(rhapi.db, name, counted(name, getattr(rhapi.db, name)))
+
+    return lookups
+
+
+def test_cached_stage_does_no_lookups(rhapi, controller, monkeypatch):
+    controller.refresh_stage_frames()
+    lookups = count_lookups(rhapi, monkeypatch)
+
+    controller.onRaceStage({"heat_id": 1})
+    wait_idle(controller)
+
+    assert lookups == []
+    assert osd_texts(controller)
+
+
+def test_pilot_alter_rebuilds_the_stage_frames(rhapi, controller):
+    controller.refresh_stage_frames()
+    rhapi.db.pilot_attributes[(2, "elrs_active")] = "0"
+
+    controller.pilot_alter({"pilot_id": 2})
+
+    uids = [controller.get_pilot_uid(pilot_id) for pilot_id in (1, 3, 4)]
+    assert controller._stage_frames.uids == uids
+
+
+def test_critical_message_is_repeated(rhapi, controller, monkeypatch):
+    monkeypatch.setattr(elrs_backpack, "CRITICAL_REPEAT_SPACING", 0.001)
+    rhapi.db.options["_critical_repeats"] = 2
+    uid = bytes(controller.get_pilot_uid(1))
+    packets = (controller.osd_text_packet(4, 0, "GO"),)
+
+    generation = controller._claim_row(uid, 4)
+    controller._repeat_critical([(uid, generation)], 4, packets)
+    gevent.sleep(0.02)
+    wait_idle(controller)
+
+    assert osd_texts(controller).count(b"GO") == 2
+    assert controller.metrics.counters["critical_repeats"] == 2
+
+
+def test_newer_message_cancels_critical_repeats(rhapi, controller, monkeypatch):
+    monkeypatch.setattr(elrs_backpack, "CRITICAL_REPEAT_SPACING", 0.001)
+    rhapi.db.options["_critical_repeats"] = 2
+    uids = [bytes(controller.get_pilot_uid(pilot_id)) for pilot_id in (1, 2)]
+    packets = (controller.osd_text_packet(4, 0, "GO"),)
+
+    owners = [(uid, controller._claim_row(uid, 4)) for uid in uids]
+    controller._repeat_critical(owners, 4, packets)
+    controller._claim_row(uids[0], 4)
+    gevent.sleep(0.02)
+    wait_idle(controller)
+
+    assert osd_texts(controller).count(b"GO") == 2
+    assert controller.metrics.counters["critical_coalesced"] == 2
+
+    controller._claim_screen(uids[1])
+    controller._repeat_critical(owners, 4, packets)
+    gevent.sleep(0.02)
+    wait_idle(controller)
+
+    assert osd_texts(controller).count(b"GO") == 2
+
+
+class FailingConnection(CountingConnection):
+    connected = False
+
+    def connect(self, **_) -> bool:
+        return False
+
+
+def test_dead_link_is_reconnected(rhapi, controller):
+    link = controller._links[0]
+    assert link.connect(CountingConnection, port="/dev/ttyUSB0")
+    connection = link.connection
+
+    controller._link_state_changed(link, LinkState.DEAD)
+    gevent.sleep(0.01)
+
+    assert link.connection is not connection
+    assert link.connected and link.healthy
+    assert link.reconnector is None
+    assert rhapi.notifications[-1] == "Backpack reconnected"
+
+
+def test_failed_reconnect_is_retried(rhapi, controller, monkeypatch):
+    monkeypatch.setattr(elrs_backpack, "RECONNECT_DELAY", 0)
+    link = controller._links[0]
+    assert link.connect(CountingConnection)
+    link._connect_args = (FailingConnection, {})
+
+    controller._link_state_changed(link, LinkState.DEAD)
+    gevent.sleep(0.01)
+
+    assert (
+        link.metrics.counters["connection_failures"] == elrs_backpack.RECONNECT_ATTEMPTS
+    )
+    assert not link.connected
+    assert rhapi.notifications[-1] == "Attempt to reconnect backpack failed"
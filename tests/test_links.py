@@ -0,0 +1,88 @@
+import hashlib
+
+import pytest
+from vrxc_elrs.connections import ConnectionTypeEnum, SerialConnection
+from vrxc_elrs.links import BackpackLink, link_for_uid, parse_links
+
+from benchmarks.fake_rhapi import FakeRHAPI, load_controller
+
+UIDS = [hashlib.sha256(str(pilot).encode()).digest()[:6] for pilot in range(400)]
+
+
+def make_links(*names: str) -> list[BackpackLink]:
+    return [BackpackLink(name, lambda: True, lambda *_: None) for name in names]
+
+
+def assignment(links: list[BackpackLink]) -> dict[bytes, str]:
+    return {uid: link_for_uid(uid, links).name for uid in UIDS}
+
+
+def test_no_links():
+    assert link_for_uid(UIDS[0], []) is None
+
+
+def test_assignment_is_stable():
+    links = make_links("", "usb:/dev/ttyUSB1", "socket:netpack-2")
+
+    assert assignment(links) == assignment(list(reversed(links)))
+
+
+def test_pilots_are_spread_across_links():
+    links = make_links("", "usb:/dev/ttyUSB1", "socket:netpack-2", "usb:/dev/ttyUSB2")
+    counts = list(assignment(links).values())
+
+    for link in links:
+        assert counts.count(link.name) == pytest.approx(len(UIDS) / 4, rel=0.25)
+
+
+def test_only_the_pilots_of_a_dropped_link_move():
+    links = make_links("", "usb:/dev/ttyUSB1", "socket:netpack-2")
+    before = assignment(links)
+    after = assignment([link for link in links if link.name != "usb:/dev/ttyUSB1"])
+
+    for uid, name in before.items():
+        if name != "usb:/dev/ttyUSB1":
+            assert after[uid] == name
+        else:
+            assert after[uid] != name
+
+
+def test_pilots_return_when_a_link_recovers():
+    links = make_links("", "usb:/dev/ttyUSB1", "socket:netpack-2")
+    before = assignment(links)
+    assignment(links[:2])
+
+    assert assignment(links) == before
+
+
+def test_parse_links():
+    assert parse_links(" usb:/dev/ttyUSB1, SOCKET:netpack-2 ,") == [
+        (ConnectionTypeEnum.USB, "/dev/ttyUSB1"),
+        (ConnectionTypeEnum.SOCKET, "netpack-2"),
+    ]
+
+
+@pytest.mark.parametrize("value", ["serial:/dev/ttyUSB1", "usb:", "netpack-2"])
+def test_parse_links_rejects_invalid_entries(value):
+    with pytest.raises(ValueError):
+        parse_links(value)
+
+
+def test_disconnect_link_that_failed_to_connect(tmp_path):
+    link = make_links("usb:/dev/ttyUSB1")[0]
+
+    assert not link.connect(SerialConnection, port=str(tmp_path / "missing"))
+    link.disconnect()
+    assert not link.connected
+
+
+def test_remove_link_that_failed_to_connect(tmp_path):
+    rhapi = FakeRHAPI()
+    controller = load_controller(rhapi)
+    rhapi.db.options["_extra_backpacks"] = f"usb:{tmp_path / 'missing'}"
+    ((link, _, address),) = controller.configure_links()
+    assert not link.connect(SerialConnection, port=address)
+
+    rhapi.db.options["_extra_backpacks"] = ""
+    assert controller.configure_links() == []
+    assert [link.name for link in controller._links] == ["bench:0"]
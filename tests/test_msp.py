@@ -0,0 +1,66 @@
+import gevent
+from gevent.queue import Queue
+from vrxc_elrs.metrics import Metrics
+from vrxc_elrs.msp import MSPPacket, MSPTypes
+
+
+def frame(function: MSPTypes, payload: bytes = b"") -> bytes:
+    packet = MSPPacket()
+    packet.set_function(function)
+    packet.set_payload(payload)
+    return packet.get_packet()
+
+
+def decode_chunks(chunks: list[bytes]) -> list[MSPPacket]:
+    queue: Queue = Queue()
+    packets: list[MSPPacket] = []
+
+    def consume():
+        packets.extend(MSPPacket.packets_from_bytes_queue(queue))
+
+    consumer = gevent.spawn(consume)
+    for chunk in chunks:
+        queue.put(chunk)
+
+    gevent.idle()
+    consumer.kill()
+    return packets
+
+
+VERSION = frame(MSPTypes.MSP_ELRS_GET_BACKPACK_VERSION)
+OSD = frame(MSPTypes.MSP_ELRS_SET_OSD, bytes((3, 1, 0, 0)) + b"HELLO")
+
+
+def test_frames_split_across_reads_are_decoded():
+    data = VERSION + OSD
+    chunks = [data[index : index + 3] for index in range(0, len(data), 3)]
+
+    packets = decode_chunks(chunks)
+
+    assert [packet.get_packet() for packet in packets] == [VERSION, OSD]
+
+
+def test_one_byte_reads_are_decoded():
+    packets = decode_chunks([bytes((c,)) for c in OSD])
+
+    assert [packet.get_packet() for packet in packets] == [OSD]
+
+
+def test_false_starts_before_a_frame_resync():
+    for false_start in (b"$", b"$X", b"$X<", b"$X<\x00\xff\xff\x00\x00"):
+        metrics = Metrics()
+        packets = list(MSPPacket.packets_from_bytes(false_start + OSD, metrics))
+
+        assert [packet.get_packet() for packet in packets] == [OSD]
+        assert metrics.counters["resyncs"] == 1
+
+
+def test_frames_after_a_truncated_frame_are_kept():
+    corrupt = OSD[:-1] + bytes(((OSD[-1] + 1) % 256,))
+    truncated = OSD[:10]
+    metrics = Metrics()
+
+    packets = list(MSPPacket.packets_from_bytes(truncated + corrupt + VERSION, metrics))
+
+    assert [packet.get_packet() for packet in packets] == [VERSION]
+    assert metrics.counters["crc_failures"] >= 1
@@ -0,0 +1,139 @@
+import pytest
+from vrxc_elrs.osd import (
+    DEFAULT_LAYOUT,
+    OSD_COLUMNS,
+    OSD_ROWS,
+    OSDLayout,
+    encode_centered_text,
+    encode_text,
+    format_split_time,
+)
+
+ROWS = {
+    row_option: row
+    for row, row_option in enumerate(
+        sorted(
+            {
+                row_option
+                for elements in DEFAULT_LAYOUT.values()
+                for row_option, _, _ in elements.values()
+            }
+        )
+    )
+}
+CONSTANTS = {
+    "racestage_message": "ARM NOW",
+    "racestart_message": "GO",
+    "racefinish_message": "FINISH",
+    "racestop_message": "LAND",
+    "pilotdone_message": "DONE",
+    "leader_message": "LEADER",
+    "round_label": "ROUND",
+}
+
+
+def default_row(screen: str, element: str) -> int:
+    row_option, offset, _ = DEFAULT_LAYOUT[screen][element]
+    return ROWS[row_option] + offset
+
+
+def test_custom_format_is_used():
+    layout = OSDLayout(ROWS, CONSTANTS, {"racing.lap": "LAP {lap:02d}"})
+
+    assert layout.render("racing", "lap", lap=3).data == encode_text("LAP 03")
+
+
+def test_missing_value_is_left_empty_without_its_spec():
+    layout = OSDLayout(ROWS, CONSTANTS, {"results.laps": "{lap:02d} LAPS"})
+
+    assert layout.render("results", "laps", laps=5).data == encode_text(" LAPS")
+
+
+def test_spec_that_does_not_fit_its_value_falls_back_to_the_default():
+    layout = OSDLayout(ROWS, CONSTANTS, {"racing.lap_time": "{lap_time:02d}"})
+    text = layout.render("racing", "lap_time", lap_time="1.234", total_time="5.678")
+
+    assert text.data == encode_text("x 1.234 | 5.678 w")
+
+
+def test_custom_row_is_used():
+    layout = OSDLayout(ROWS, CONSTANTS, {"racing.stop": {"row": 3}})
+
+    assert layout.render("racing", "stop").row == 3
+
+
+@pytest.mark.parametrize("row", [-1, OSD_ROWS, 40, 256, "top", None])
+def test_row_off_the_screen_falls_back_to_the_default(row):
+    layout = OSDLayout(ROWS, CONSTANTS, {"racing.stop": {"row": row, "format": "STOP"}})
+    text = layout.render("racing", "stop")
+
+    assert text.row == default_row("racing", "stop")
+    assert text.data == b"STOP"
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("LAP 3", b"LAP 3"),
+        ("x 1.234 w", b"x 1.234 w"),
+        ("ÉLODIE", b"ELODIE"),
+        ("Ñandú", b"NandU"),
+        ("Łukasz", b"?ukasz"),
+        ("ΑΘΗΝΑ", b"?????"),
+        ("東京", b"??"),
+        ("€ 5", b"? 5"),
+        ("🏁", b"?"),
+        ("TAB\tEND", b"TAB?END"),
+    ],
+)
+def test_encode_text(text, expected):
+    assert encode_text(text) == expected
+
+
+@pytest.mark.parametrize("char", ["A", "é", "東", "🏁"])
+def test_encode_text_truncates_to_the_row(char):
+    data = encode_text(char * (OSD_COLUMNS + 10))
+
+    assert len(data) == OSD_COLUMNS
+    assert max(data) < 0x80
+
+
+def test_centered_text_is_truncated_before_centering():
+    assert encode_centered_text("GO") == (OSD_COLUMNS // 2 - 1, b"GO")
+    assert encode_centered_text("東" * 60) == (0, b"?" * OSD_COLUMNS)
+
+
+def rotorhazard_format_split_time(millis, time_format="{m}:{s}.{d}"):
+    """
+    RotorHazard's `RHUtils.format_split_time_to_str`, which the
+    controller used before formatting times itself
+    """
+    millis = int(round(millis, 0))
+    minutes = millis // 60000
+    over = millis % 60000
+    seconds = over // 1000
+    milliseconds = over % 1000
+
+    if minutes <= 0:
+        time_format = time_format.replace("{m}:", "")
+        time_format = time_format.replace("{m}", "")
+        time_format = time_format.replace("{s}", str(seconds))
+    else:
+        time_format = time_format.replace("{m}", str(minutes))
+        time_format = time_format.replace("{s}", "{0:02d}".format(seconds))
+
+    return time_format.replace("{d}", "{0:03d}".format(milliseconds))
+
+
+@pytest.mark.parametrize(
+    "millis",
+    [-61234, -1500, -0.4, 0, 0.5, 1.5, 999.6, 9876, 59999.5, 60000, 61234.4, 3723456],
+)
+def test_format_split_time_matches_rotorhazard(millis):
+    assert format_split_time(millis) == rotorhazard_format_split_time(millis)
+    # Cached results are the same as the first
+    assert format_split_time(millis) == rotorhazard_format_split_time(millis)
+
+
+def test_format_split_time_without_a_time():
+    assert format_split_time(None) == ""
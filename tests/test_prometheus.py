@@ -0,0 +1,81 @@
+from vrxc_elrs.metrics import Metrics
+from vrxc_elrs.prometheus import format_prometheus
+
+
+def link_metrics() -> dict:
+    metrics = Metrics()
+    metrics.increment("packets_sent", 3)
+    metrics.gauge_callback("connected", lambda: 1)
+    metrics.observe("write_seconds", 0.002)
+    metrics.observe("transaction_seconds", 0.01, event="lap_recorded", stage="total")
+    metrics.observe("rtt_seconds", 0.02)
+    metrics.observe("transaction_seconds", 0.02, event="race_stage", stage="total")
+    return metrics.as_dict()
+
+
+def families(lines: list[str]) -> dict[str, list[str]]:
+    """
+    Groups the samples of an exposition by the TYPE line above them,
+    failing when a family is typed twice or a sample is outside its family
+    """
+    grouped: dict[str, list[str]] = {}
+    current = None
+    for line in lines:
+        if line.startswith("# TYPE "):
+            current = line.split()[2]
+            assert current not in grouped, f"{current} typed twice"
+            grouped[current] = []
+            continue
+
+        name = line.split("{")[0].split()[0]
+        assert current is not None
+        assert name == current or name in (
+            f"{current}_bucket",
+            f"{current}_sum",
+            f"{current}_count",
+        ), f"{name} outside of {current}"
+        grouped[current].append(line)
+
+    return grouped
+
+
+def test_links_share_one_family_per_metric():
+    lines = format_prometheus(
+        [
+            (link_metrics(), {"timer": "t", "link": ""}),
+            (link_metrics(), {"timer": "t", "link": "2"}),
+        ],
+        "elrs_link_",
+    )
+    grouped = families(lines)
+
+    assert grouped["elrs_link_packets_sent_total"] == [
+        'elrs_link_packets_sent_total{timer="t",link=""} 3',
+        'elrs_link_packets_sent_total{timer="t",link="2"} 3',
+    ]
+    assert grouped["elrs_link_connected"] == [
+        'elrs_link_connected{timer="t",link=""} 1',
+        'elrs_link_connected{timer="t",link="2"} 1',
+    ]
+
+
+def test_labelled_histograms_are_one_family():
+    grouped = families(format_prometheus([(link_metrics(), {})], "elrs_backpack_"))
+    counts = [
+        line
+        for line in grouped["elrs_backpack_transaction_seconds"]
+        if "_count" in line
+    ]
+
+    assert counts == [
+        'elrs_backpack_transaction_seconds_count{event="lap_recorded",stage="total"} 1',
+        'elrs_backpack_transaction_seconds_count{event="race_stage",stage="total"} 1',
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    grouped = families(format_prometheus([(link_metrics(), {})], "elrs_"))
+    buckets = [line for line in grouped["elrs_write_seconds"] if "_bucket" in line]
+
+    assert buckets[0] == 'elrs_write_seconds_bucket{le="0.0005"} 0'
+    assert buckets[-1] == 'elrs_write_seconds_bucket{le="+Inf"} 1'
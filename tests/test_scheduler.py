@@ -0,0 +1,58 @@
+import gevent
+from vrxc_elrs.metrics import Metrics
+from vrxc_elrs.scheduler import OSDScheduler
+
+
+def test_full_queue_rejects_new_droppable_jobs():
+    scheduler = OSDScheduler(size=1, queue_size=2)
+    ran = []
+
+    accepted = [scheduler.submit(ran.append, job) for job in range(4)]
+    gevent.sleep(0.01)
+
+    assert accepted == [True, True, False, False]
+    assert ran == [0, 1]
+    assert scheduler.dropped == 2
+
+
+def test_critical_jobs_are_never_dropped():
+    metrics = Metrics()
+    scheduler = OSDScheduler(size=1, metrics=metrics, queue_size=2)
+    ran = []
+
+    for job in range(3):
+        scheduler.submit(ran.append, f"lap {job}")
+    for job in range(3):
+        assert scheduler.submit(ran.append, f"clear {job}", critical=True)
+    gevent.sleep(0.01)
+
+    assert ran == ["lap 0", "lap 1", "clear 0", "clear 1", "clear 2"]
+    assert metrics.counters["osd_jobs_dropped"] == 1
+
+
+def test_queue_accepts_droppable_jobs_once_drained():
+    scheduler = OSDScheduler(size=1, queue_size=1)
+    ran = []
+
+    scheduler.submit(ran.append, 0)
+    assert not scheduler.submit(ran.append, 1)
+    gevent.sleep(0.01)
+
+    assert scheduler.submit(ran.append, 2)
+    gevent.sleep(0.01)
+    assert ran == [0, 2]
+
+
+def test_delayed_critical_job_is_queued_while_the_queue_is_full():
+    scheduler = OSDScheduler(size=1, queue_size=1)
+    ran = []
+
+    scheduler.submit(gevent.sleep, 0.02)
+    gevent.sleep(0)
+    for job in range(3):
+        scheduler.submit(ran.append, f"lap {job}")
+    scheduler.submit_later(0.001, ran.append, "expiry", critical=True)
+    gevent.sleep(0.05)
+
+    assert ran == ["lap 0", "expiry"]
+    assert scheduler.dropped == 2
@@ -0,0 +1,81 @@
+import io
+
+from vrxc_elrs.connections import SendUIDTracker
+from vrxc_elrs.msp import MSPPacket, MSPPacketType, MSPTypes
+from vrxc_elrs.worker import (
+    FrameKind,
+    FramePipe,
+    decode_burst,
+    decode_packet,
+    encode_burst,
+    encode_packet,
+)
+
+
+def packet(function: MSPTypes, payload: bytes = b"") -> MSPPacket:
+    packet_ = MSPPacket()
+    packet_.set_function(function)
+    packet_.set_payload(payload)
+    return packet_
+
+
+def set_uid(address: bytes) -> MSPPacket:
+    return packet(MSPTypes.MSP_ELRS_SET_SEND_UID, b"\x01" + address)
+
+
+def test_packet_round_trip():
+    original = packet(MSPTypes.MSP_ELRS_SET_OSD, bytes((3, 1, 0, 0)) + b"LAP 3")
+    original.set_type(MSPPacketType.RESPONSE)
+    original.set_flags(0x02)
+
+    decoded, offset = decode_packet(encode_packet(original))
+
+    assert decoded.get_packet() == original.get_packet()
+    assert offset == len(encode_packet(original))
+
+
+def test_repeated_packets_are_encoded_once():
+    text = packet(MSPTypes.MSP_ELRS_SET_OSD, bytes((3, 1, 0, 0)) + b"GO" * 20)
+    display = packet(MSPTypes.MSP_ELRS_SET_OSD, b"\x04")
+    uids = [bytes((1, 2, 3, 4, 5, pilot)) for pilot in range(8)]
+    packets = [p for uid in uids for p in (set_uid(uid), text, display)]
+
+    data = encode_burst(7, packets)
+
+    assert data.count(b"GO" * 20) == 1
+    burst, decoded = decode_burst(data)
+    assert burst == 7
+    assert [p.get_packet() for p in decoded] == [p.get_packet() for p in packets]
+    assert all(decoded[index] is decoded[1] for index in range(1, len(decoded), 3))
+
+
+def test_equal_but_distinct_packets_are_kept_apart():
+    first = packet(MSPTypes.MSP_ELRS_SET_OSD, b"\x02")
+    second = packet(MSPTypes.MSP_ELRS_SET_OSD, b"\x02")
+
+    _, decoded = decode_burst(encode_burst(1, [first, second, first]))
+
+    assert decoded[0] is decoded[2]
+    assert decoded[0] is not decoded[1]
+
+
+def test_worker_writes_the_same_bytes():
+    text = packet(MSPTypes.MSP_ELRS_SET_OSD, bytes((3, 1, 0, 0)) + b"LAND")
+    reset = packet(MSPTypes.MSP_ELRS_SET_SEND_UID, b"\x00")
+    packets = [set_uid(b"\x01" * 6), text, set_uid(b"\x01" * 6), text, reset, text]
+
+    _, decoded = decode_burst(encode_burst(1, packets))
+
+    assert SendUIDTracker().encode(decoded) == SendUIDTracker().encode(packets)
+
+
+def test_frame_pipe_round_trip():
+    buffer = io.BytesIO()
+    FramePipe(io.BytesIO(), buffer).send(FrameKind.BURST, b"burst")
+    FramePipe(io.BytesIO(), buffer).send(FrameKind.CLOSE)
+
+    pipe = FramePipe(io.BytesIO(buffer.getvalue()), io.BytesIO())
+
+    assert pipe.receive() == (FrameKind.BURST, b"burst")
+    assert pipe.receive() == (FrameKind.CLOSE, b"")
+    assert pipe.receive() is None